@@ -45,6 +45,8 @@ new MskS3ConnectorStack(app, "cs-msk-s3-sink-small", {
     mskTopicParameterName: "/cs-msk-small/mskTopic",
     mskSecurityGroupIdParameterName: "/cs-msk-small/mskSecurityGroupId",
     mskClusterNameParameterName: "/cs-msk-small/mskClusterName",
+    mskTopicPartitionsParameterName: "/cs-msk-small/mskTopicPartitions",
+    mskClusterArnParameterName: "/cs-msk-small/mskClusterArn",
   },
   s3Config: {
     bucketNameParameterName: "/clickstream-infra/bucketName",
@@ -16,6 +16,10 @@ export function createServerApi(scope: Construct, props: ServerApiProps) {
       handler: props.metricLambda,
       proxy: false,
       description: `${Stack.of(scope).stackName} Server Api`,
+      // compressed metric responses are returned base64 encoded with these
+      // content types, see compressed_media_types in lambda/metric/app.py.
+      // Not */*, the JSON requests and the CORS preflight mocks stay text.
+      binaryMediaTypes: ["application/gzip", "application/x-brotli"],
     }
   );
   const v1 = api.root.addResource("v1");
@@ -29,6 +33,16 @@ export function createServerApi(scope: Construct, props: ServerApiProps) {
     // authorizationType: apigateway.AuthorizationType.IAM,
   });
 
+  // metrics of many deployments, see fleet_handler in lambda/metric/app.py
+  const fleet = metric.addResource("fleet", {
+    defaultCorsPreflightOptions: {
+      allowOrigins: apigateway.Cors.ALL_ORIGINS,
+      allowMethods: ["GET", "POST"],
+    },
+  });
+  fleet.addMethod("GET");
+  fleet.addMethod("POST");
+
   let tokenUrl = undefined;
   if (props.tokenLambda) {
     const tokenIntegration = new apigateway.LambdaIntegration(
@@ -50,6 +64,7 @@ export function createServerApi(scope: Construct, props: ServerApiProps) {
   return {
     api,
     metricUrl: `https://${api.restApiId}.execute-api.${region}.amazonaws.com/prod/v1/metric`,
+    fleetMetricUrl: `https://${api.restApiId}.execute-api.${region}.amazonaws.com/prod/v1/metric/fleet`,
     tokenUrl,
   };
 }
@@ -22,6 +22,36 @@ export class AppConfig {
     return scope.node.tryGetContext("EndpointPath") || "/collect";
   }
 
+  // opt-in profiling of the Python Lambdas, e.g.
+  // cdk deploy -c LambdaProfileSampleRate=0.05 -c LambdaProfileS3Bucket=<bucket>
+  static lambdaProfileSampleRate(scope: Construct): number {
+    return Number(scope.node.tryGetContext("LambdaProfileSampleRate") || 0);
+  }
+
+  static lambdaProfileS3Bucket(scope: Construct): string | undefined {
+    return scope.node.tryGetContext("LambdaProfileS3Bucket");
+  }
+
+  // minutes between the ingestion probes of the health check Lambda, 0 turns
+  // them off, e.g. cdk deploy -c IngestionProbeIntervalMinutes=0
+  static ingestionProbeIntervalMinutes(scope: Construct): number {
+    const minutes = scope.node.tryGetContext("IngestionProbeIntervalMinutes");
+    return minutes === undefined ? 60 : Number(minutes);
+  }
+
+  // profile of the MSK S3 sink connector: small, medium or large. Without it
+  // every tier keeps the original fixed connector settings, e.g.
+  // cdk deploy -c MskConnectorProfile=medium
+  static mskConnectorProfile(scope: Construct): string | undefined {
+    return scope.node.tryGetContext("MskConnectorProfile");
+  }
+
+  // what writes the MSK topic to S3: "connector" (MSK Connect, default) or
+  // "lambda", e.g. cdk deploy -c MskSinkType=lambda
+  static mskSinkType(scope: Construct): string {
+    return scope.node.tryGetContext("MskSinkType") || "connector";
+  }
+
   static serverHttpEndpointPort(): number {
     return 80;
   }
@@ -57,23 +87,33 @@ export class AppConfig {
   }
 
   getMskSinkConnectorSetting(): S3SinkConnectorSetting {
+    const topicPartitionCount = this.getMskSetting().topicPartitionCount;
+    const connectorProfile = AppConfig.mskConnectorProfile(this.scope);
     return {
       LARGE: {
+        connectorProfile,
+        topicPartitionCount,
         maxWorkerCount: 5,
         minWorkerCount: 1,
         workerMcuCount: 1,
       },
       MEDIUM: {
+        connectorProfile,
+        topicPartitionCount,
         maxWorkerCount: 4,
         minWorkerCount: 1,
         workerMcuCount: 1,
       },
       SMALL: {
+        connectorProfile,
+        topicPartitionCount,
         maxWorkerCount: 3,
         minWorkerCount: 1,
         workerMcuCount: 1,
       },
       XSMALL: {
+        connectorProfile,
+        topicPartitionCount,
         maxWorkerCount: 2,
         minWorkerCount: 1,
         workerMcuCount: 1,
@@ -82,7 +122,8 @@ export class AppConfig {
   }
 
   getMskSetting(): MSKSetting {
-    return {
+    const sinkType = AppConfig.mskSinkType(this.scope);
+    const setting = {
       LARGE: {
         instanceSize: ec2.InstanceSize.XLARGE2, // kafka.m5.2xlarge
         numberOfBrokerNodesPerAz: 6,
@@ -112,6 +153,7 @@ export class AppConfig {
         dataRetentionHours: 120,
       },
     }[this.getTier()];
+    return { ...setting, sinkType };
   }
 
   getKinesisSetting(): KinesisSetting {
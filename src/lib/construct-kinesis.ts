@@ -49,6 +49,9 @@ export class KinesisAndS3SinkConstruct extends Construct {
         vpc: props.vpc,
         s3Bucket: props.s3Config.bucketName,
         prefix: props.s3Config.prefix,
+        recordProjection: props.kinesisSetting.lambdaRecordProjection,
+        recordEnrichment: props.kinesisSetting.lambdaRecordEnrichment,
+        recordAggregates: props.kinesisSetting.lambdaRecordAggregates,
       });
 
       s3Bucket.grantReadWrite(kinesisToS3Lambda);
@@ -12,6 +12,9 @@ import {
   createS3SinkConnectorCustomResource,
 } from "./custom-resource";
 import { S3SinkConfig } from "./stack-main";
+import { createMskToS3Lambda } from "./lambda";
+import { ManagedKafkaEventSource } from "aws-cdk-lib/aws-lambda-event-sources";
+import * as lambda from "aws-cdk-lib/aws-lambda";
 
 export interface MSKSetting {
   topicPartitionCount: number;
@@ -19,12 +22,15 @@ export interface MSKSetting {
   ebsVolumeSize: number;
   instanceSize: ec2.InstanceSize; // kafka.m5.large
   dataRetentionHours: number;
+  sinkType?: string; // connector (default) or lambda, see AppConfig.mskSinkType
 }
 
 export interface S3SinkConnectorSetting {
   maxWorkerCount: number;
   minWorkerCount: number;
   workerMcuCount: number;
+  connectorProfile?: string; // small, medium, large
+  topicPartitionCount?: number;
 }
 
 interface Props {
@@ -34,7 +40,12 @@ interface Props {
   clusterName: string;
   mskBrokers: string;
   mskSecurityGroup: ec2.ISecurityGroup;
+  // the event source of the Lambda sink
+  mskClusterArn?: string;
+  // partition count of the topic, else s3SinkConnectorSetting.topicPartitionCount
+  mskTopicPartitions?: string;
   s3SinkConnectorSetting: S3SinkConnectorSetting;
+  mskSetting: MSKSetting;
 }
 
 export class MSKS3SinkConnectorConstruct extends Construct {
@@ -53,6 +64,11 @@ export class MSKS3SinkConnectorConstruct extends Construct {
         mskSecurityGroup
       );
 
+    if (props.mskSetting.sinkType == "lambda") {
+      this.createLambdaS3Sink(scope, props, mskCustomResourceLambdaSecurityGroup);
+      return;
+    }
+
     const { role: s3SinkConnectorRole, policy } = createS3SinkConnectorRole(
       this,
       props.clusterName,
@@ -80,6 +96,7 @@ export class MSKS3SinkConnectorConstruct extends Construct {
       s3SinkConnectorRole,
       mskClusterName: props.clusterName,
       s3SinkConnectorSetting,
+      mskTopicPartitions: props.mskTopicPartitions,
       createS3SinkConnector: true,
     });
     sinkCr.node.addDependency(mskSecurityGroup);
@@ -88,4 +105,45 @@ export class MSKS3SinkConnectorConstruct extends Construct {
       value: sinkS3Bucket.bucketName,
     });
   }
+
+  // same S3 layout as the connector, written by a Lambda consuming the topic
+  private createLambdaS3Sink(
+    scope: Construct,
+    props: Props,
+    lambdaSecurityGroup: ec2.ISecurityGroup
+  ) {
+    if (!props.mskClusterArn) {
+      throw new Error(
+        "mskClusterArn or mskClusterArnParameterName not set, the lambda sink needs it"
+      );
+    }
+    const sinkS3Bucket = s3.Bucket.fromBucketName(
+      scope,
+      "s3-lambda-sink-bucket",
+      props.s3SinkConfig.bucketName
+    );
+    const fn = createMskToS3Lambda(this, {
+      vpc: props.vpc,
+      lambdaSecurityGroup,
+      s3Bucket: props.s3SinkConfig.bucketName,
+      prefix: props.s3SinkConfig.prefix,
+    });
+    sinkS3Bucket.grantReadWrite(fn);
+
+    // the event source mapping reaches the brokers through the cluster's
+    // subnets and security group
+    fn.addEventSource(
+      new ManagedKafkaEventSource({
+        clusterArn: props.mskClusterArn,
+        topic: props.mskTopic,
+        batchSize: 10000,
+        maxBatchingWindow: cdk.Duration.minutes(1),
+        startingPosition: lambda.StartingPosition.TRIM_HORIZON,
+      })
+    );
+
+    new cdk.CfnOutput(this, "MskSinkS3Bucket", {
+      value: sinkS3Bucket.bucketName,
+    });
+  }
 }
@@ -18,16 +18,30 @@ import { getServiceSubnets } from "./vpc";
 
 export interface MSKSetting {
   topicPartitionCount: number;
+  topicTargetMBPerSec?: number;
+  topicSpecs?: MskTopicSpec[];
   numberOfBrokerNodesPerAz: number;
   ebsVolumeSize: number;
   instanceSize: ec2.InstanceSize; // kafka.m5.large
   dataRetentionHours: number;
+  sinkType?: string; // connector (default) or lambda, see AppConfig.mskSinkType
+}
+
+// extra topics next to the main topic, "{topic}" in the name is
+// replaced with the main topic name, e.g. "{topic}-dlq"
+export interface MskTopicSpec {
+  name: string;
+  partitions?: number;
+  replicationFactor?: number;
+  configs?: { [key: string]: string };
 }
 
 export interface S3SinkConnectorSetting {
   maxWorkerCount: number;
   minWorkerCount: number;
   workerMcuCount: number;
+  connectorProfile?: string; // small, medium, large
+  topicPartitionCount?: number;
 }
 
 interface Props {
@@ -42,6 +56,8 @@ export class MSKClusterConstruct extends Construct {
   public mskSecurityGroup: ec2.SecurityGroup;
   public mskCluster: msk.Cluster;
   public mskConfiguration: msk2.CfnConfiguration;
+  // partitions of the topic after planning, see create-msk-topic
+  public topicPartitions: string;
 
   static KAFKA_VERSION = msk.KafkaVersion.V2_6_2;
 
@@ -105,9 +121,12 @@ export class MSKClusterConstruct extends Construct {
       mskTopic: props.mskTopic,
       mskTopicPartitionCountStringValue:
         props.mskSetting.topicPartitionCount + "",
+      topicTargetMBPerSec: props.mskSetting.topicTargetMBPerSec,
+      topicSpecs: props.mskSetting.topicSpecs,
       brokersString: extraProps.mskCluster.bootstrapBrokers,
     });
     topicCr.node.addDependency(extraProps.mskCluster);
+    this.topicPartitions = topicCr.getAttString("partitions");
   }
 
   private addStorageAutoScaling(
@@ -16,6 +16,7 @@ import {
 } from "./lambda";
 import { createRecordInRoute53 } from "./route53";
 import { createServerMonitor } from "./monitor";
+import { createMetricSnapshotEvent } from "./events";
 import { IHostedZone } from "aws-cdk-lib/aws-route53";
 import { createCertificate } from "./acm";
 import { ServerAuthentication } from "./consturct-ingest-server";
@@ -159,6 +160,7 @@ export class IngestLambdaServerConstruct extends Construct {
       albFullName: this.alb.loadBalancerFullName,
     });
 
+    createMetricSnapshotEvent(scope, metricLambda);
     const urls = createServerApi(scope, {
       metricLambda,
       tokenLambda,
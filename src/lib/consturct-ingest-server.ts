@@ -23,6 +23,7 @@ import { AppConfig } from "./config";
 import { grantMskReadWrite } from "./iam";
 import { createRecordInRoute53 } from "./route53";
 import { createServerMonitor } from "./monitor";
+import { createMetricSnapshotEvent } from "./events";
 import { IHostedZone } from "aws-cdk-lib/aws-route53";
 import { createCertificate } from "./acm";
 import { createUserPool, OIDCProps, OIDCProvider } from "./cognito";
@@ -195,7 +196,13 @@ export class IngestServerConstruct extends Construct {
       ecsClusterName: this.cluster.clusterName,
       ecsServiceName: this.ecsService.serviceName,
       targetGroupArn: targetGroup.targetGroupArn,
+      vpc: props.vpc,
+      mskBrokers: props.mskConfig?.mskBrokers,
+      mskTopic: props.mskConfig?.mskTopic,
+      mskClusterName: props.mskConfig?.mskClusterName,
+      mskSecurityGroup: props.mskConfig?.mskSecurityGroup,
     });
+    createMetricSnapshotEvent(scope, metricLambda);
     const urls = createServerApi(scope, { metricLambda, tokenLambda });
     this.loginTokenApiUrl = urls.tokenUrl;
     this.metricApiUrl = urls.metricUrl;
@@ -205,7 +212,8 @@ export class IngestServerConstruct extends Construct {
         scope,
         props.snsTopicArn,
         healthUrl,
-        props.adminEmail
+        props.adminEmail,
+        props.s3Config
       );
     }
   }
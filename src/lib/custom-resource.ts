@@ -23,10 +23,18 @@ export function createS3SinkConnectorCustomResource(
   if (props.createS3SinkConnector) {
     const provider = new Provider(scope, "CrS3SinkConnectorProvider", {
       onEventHandler: fn,
+      isCompleteHandler: fn,
+      queryInterval: cdk.Duration.seconds(10),
+      totalTimeout: cdk.Duration.hours(1),
       logRetention: RetentionDays.ONE_WEEK,
     });
     const cr = new CustomResource(scope, "CrS3SinkConnectorCustomResource", {
       serviceToken: provider.serviceToken,
+      // a changed setting sends an Update to the connector
+      properties: {
+        ...props.s3SinkConnectorSetting,
+        topicPartitions: props.mskTopicPartitions,
+      },
     });
     if (policy) {
       cr.node.addDependency(policy);
@@ -43,6 +51,9 @@ export function createGetMskConfigVersionCustomResource(
   const fn = createCrGetMskConfigVersionLambda(scope, props);
   const provider = new Provider(scope, "CrGetMskConfigVersionProvider", {
     onEventHandler: fn,
+    isCompleteHandler: fn,
+    queryInterval: cdk.Duration.seconds(5),
+    totalTimeout: cdk.Duration.minutes(10),
     logRetention: RetentionDays.ONE_WEEK,
   });
   const cr = new CustomResource(scope, "CrGetMskConfigVersionCustomResource", {
@@ -62,6 +73,12 @@ export function createCreateMskTopicCustomResource(
   });
   const cr = new CustomResource(scope, "CrMskTopicCustomResource", {
     serviceToken: provider.serviceToken,
+    // a changed layout sends an Update to expand the topic
+    properties: {
+      partitions: props.mskTopicPartitionCountStringValue,
+      targetMBPerSec: `${props.topicTargetMBPerSec || 0}`,
+      topicSpecs: JSON.stringify(props.topicSpecs || []),
+    },
   });
   return cr;
 }
@@ -73,6 +90,9 @@ export function createDeleteClusterCustomResource(
   const { fn, policy } = createCrDeleteClusterLambda(scope, props);
   const provider = new Provider(scope, "CrDeleteClusterProvider", {
     onEventHandler: fn,
+    isCompleteHandler: fn,
+    queryInterval: cdk.Duration.seconds(10),
+    totalTimeout: cdk.Duration.minutes(30),
     logRetention: RetentionDays.ONE_WEEK,
   });
   const cr = new CustomResource(scope, "CrDeleteClusterCustomResource", {
@@ -1,4 +1,5 @@
 import * as path from "path";
+import { IgnoreMode } from "aws-cdk-lib";
 import {
   DockerImageAsset,
   NetworkMode,
@@ -100,10 +101,13 @@ export const createNginxLogECRImage = (
 };
 
 export const createAlbLoginLambdaImage = (scope: Construct) => {
+  // the context is the lambda dir so the image gets the lambda_common layer code
   return lambda.DockerImageCode.fromImageAsset(
-    path.join(__dirname, "./lambda/login-token"),
+    path.join(__dirname, "./lambda"),
     {
-      file: "Dockerfile",
+      file: "login-token/Dockerfile",
+      ignoreMode: IgnoreMode.DOCKER,
+      exclude: ["*", "!login-token", "!layer", "**/__pycache__"],
     }
   );
 };
@@ -4,8 +4,13 @@ import { Construct } from 'constructs';
 import * as cdk from "aws-cdk-lib";
 import { createServerHealthCheckLambda } from './lambda';
 import * as sns from 'aws-cdk-lib/aws-sns';
+import * as lambda from 'aws-cdk-lib/aws-lambda';
+import * as s3 from 'aws-cdk-lib/aws-s3';
+import { createMetricSnapshotBucket } from './s3';
+import { AppConfig } from './config';
+import { S3SinkConfig } from './stack-main';
 
-export function createServerMonitorEvent(scope: Construct, serverUrl: string, sns: sns.ITopic) {
+export function createServerMonitorEvent(scope: Construct, serverUrl: string, sns: sns.ITopic, probeSink?: S3SinkConfig) {
     const fn = createServerHealthCheckLambda(scope, sns.topicArn);
     sns.grantPublish(fn);
     const lambdaTarget = new targets.LambdaFunction(fn, {
@@ -19,5 +24,54 @@ export function createServerMonitorEvent(scope: Construct, serverUrl: string, sn
         schedule: events.Schedule.rate(cdk.Duration.minutes(5)),
         targets: [lambdaTarget],
        });
+    createIngestionProbeEvent(scope, fn, serverUrl, probeSink);
     return rule;
-}
\ No newline at end of file
+}
+
+// synthetic events posted by the health check Lambda, see runIngestionProbe
+// in lambda/health-check/app.py, counted again in the sink when it is S3
+function createIngestionProbeEvent(scope: Construct, fn: lambda.Function, serverUrl: string, probeSink?: S3SinkConfig) {
+    const intervalMinutes = AppConfig.ingestionProbeIntervalMinutes(scope);
+    if (intervalMinutes <= 0) {
+        return undefined;
+    }
+    const probe: { [key: string]: any } = { count: 50, rps: 10 };
+    if (probeSink) {
+        const bucket = s3.Bucket.fromBucketName(scope, 'IngestionProbeSinkBucket', probeSink.bucketName);
+        bucket.grantRead(fn, `${probeSink.prefix}/*`);
+        probe.sinkS3Bucket = probeSink.bucketName;
+        probe.sinkS3Prefix = probeSink.prefix;
+    }
+    const lambdaTarget = new targets.LambdaFunction(fn, {
+        maxEventAge: cdk.Duration.minutes(intervalMinutes),
+        // a retry would post another burst
+        retryAttempts: 0,
+        event: events.RuleTargetInput.fromObject({
+            serverUrl,
+            probe,
+        })
+      });
+    return new events.Rule(scope, 'IngestionProbeScheduleRule', {
+        schedule: events.Schedule.rate(cdk.Duration.minutes(intervalMinutes)),
+        targets: [lambdaTarget],
+       });
+}
+
+// precomputed 1h/24h/7d metric windows, served by GET /v1/metric
+export function createMetricSnapshotEvent(scope: Construct, metricFn: lambda.Function) {
+    const bucket = createMetricSnapshotBucket(scope);
+    bucket.grantReadWrite(metricFn);
+    metricFn.addEnvironment('METRIC_SNAPSHOT_BUCKET', bucket.bucketName);
+    const lambdaTarget = new targets.LambdaFunction(metricFn, {
+        maxEventAge: cdk.Duration.minutes(5),
+        retryAttempts: 0,
+        event: events.RuleTargetInput.fromObject({
+            snapshot: true
+        })
+      });
+    const rule = new events.Rule(scope, 'MetricSnapshotScheduleRule', {
+        schedule: events.Schedule.rate(cdk.Duration.minutes(5)),
+        targets: [lambdaTarget],
+       });
+    return rule;
+}
@@ -184,6 +184,10 @@ export function addPoliciesToCrCreateS3SinkConnectorLambda(
         "kafkaconnect:ListCustomPlugins",
         "kafkaconnect:DeleteCustomPlugin",
         "kafkaconnect:UpdateConnector",
+        // owner tags of the plugins shared across stacks
+        "kafkaconnect:ListTagsForResource",
+        "kafkaconnect:TagResource",
+        "kafkaconnect:UntagResource",
       ],
     }),
     new iam.PolicyStatement({
@@ -13,6 +13,15 @@ export interface KinesisSetting {
   dataRetentionHours: number;
   shardCount?: number;
   lambdaBatchSize?: number;
+  // sampling and field projection of the records written to S3,
+  // see lambda/kinesis-to-s3/projection.py
+  lambdaRecordProjection?: { [key: string]: any };
+  // user agent, geo and app metadata enrichment,
+  // see lambda/kinesis-to-s3/enrichment.py
+  lambdaRecordEnrichment?: { [key: string]: any };
+  // hourly counters written next to the raw objects,
+  // see lambda/kinesis-to-s3/aggregates.py
+  lambdaRecordAggregates?: { [key: string]: any };
 }
 export interface KDSProps {
   kinesisSetting: KinesisSetting;
@@ -3,13 +3,16 @@ import {
   aws_s3 as s3,
   aws_ec2 as ec2,
   aws_iam as iam,
+  Aspects,
   Duration,
+  IAspect,
+  Stack,
 } from "aws-cdk-lib";
 import * as path from "path";
 
 import * as lambda_python from "@aws-cdk/aws-lambda-python-alpha";
 
-import { Construct } from "constructs";
+import { Construct, IConstruct } from "constructs";
 import {
   addPoliciesToCrCreateS3SinkConnectorLambda,
   addPoliciesToCrDeleteClusterLambda,
@@ -18,10 +21,29 @@ import {
 } from "./iam";
 import { RetentionDays } from "aws-cdk-lib/aws-logs";
 import { getServiceSubnets } from "./vpc";
-import { S3SinkConnectorSetting } from "./construct-msk";
-import { createKinesisToS3LambdaSecurityGroup } from "./sg";
+import { MskTopicSpec, S3SinkConnectorSetting } from "./construct-msk";
+import {
+  createKinesisToS3LambdaSecurityGroup,
+  createMetricLambdaSecurityGroup,
+} from "./sg";
 import { createAlbLoginLambdaImage } from "./ecr";
 import { OIDCProvider } from "./cognito";
+import { AppConfig } from "./config";
+
+// shared runtime of the Python Lambdas, see lambda/layer/python/lambda_common
+export function getLambdaCommonLayer(scope: Construct): lambda.ILayerVersion {
+  const stack = Stack.of(scope);
+  const id = "LambdaCommonLayer";
+  const existing = stack.node.tryFindChild(id) as lambda.ILayerVersion;
+  if (existing) {
+    return existing;
+  }
+  return new lambda.LayerVersion(stack, id, {
+    code: lambda.Code.fromAsset(path.join(__dirname, "./lambda/layer/")),
+    compatibleRuntimes: [lambda.Runtime.PYTHON_3_9],
+    description: "Shared runtime of the clickstream Python Lambdas",
+  });
+}
 
 export interface CrMskS3SinkConnectorLambdaProps {
   vpc: ec2.IVpc;
@@ -35,6 +57,7 @@ export interface CrMskS3SinkConnectorLambdaProps {
   s3SinkConnectorRole: iam.Role;
   mskClusterName: string;
   s3SinkConnectorSetting: S3SinkConnectorSetting;
+  mskTopicPartitions?: string;
   createS3SinkConnector: boolean;
 }
 
@@ -53,10 +76,12 @@ export function createCrMskS3SinkConnectorLambda(
     "cr-create-msk-s3-sink-connector-lambda",
     {
       runtime: lambda.Runtime.PYTHON_3_9,
+      layers: [getLambdaCommonLayer(scope)],
       entry:  path.join(__dirname, "./lambda/cr/create-msk-s3-sink-connector/"),
       index: "app.py",
       memorySize: 512,
-      timeout: Duration.minutes(15),
+      // one step of the operation per call, the Provider polls isComplete
+      timeout: Duration.minutes(5),
       logRetention: RetentionDays.ONE_WEEK,
       securityGroups: [props.lambdaSecurityGroup],
       //allowPublicSubnet: publicSubnet,
@@ -72,6 +97,10 @@ export function createCrMskS3SinkConnectorLambda(
         MSK_S3_CONNECTOR_WORKER_COUNT_MAX: `${s3SinkConnectorSetting.maxWorkerCount}`,
         MSK_S3_CONNECTOR_WORKER_COUNT_MIN: `${s3SinkConnectorSetting.minWorkerCount}`,
         MSK_S3_CONNECTOR_MCU_COUNT: `${s3SinkConnectorSetting.workerMcuCount}`,
+        MSK_S3_CONNECTOR_PROFILE: s3SinkConnectorSetting.connectorProfile || "default",
+        MSK_TOPIC_PARTITIONS:
+          props.mskTopicPartitions ||
+          `${s3SinkConnectorSetting.topicPartitionCount || 0}`,
         MSK_SUBNET_IDS: vpc.selectSubnets(selectedSubnets).subnetIds.join(","),
       },
     }
@@ -96,6 +125,8 @@ export interface CrMskTopicLambdaProps {
   lambdaSecurityGroup: ec2.SecurityGroup;
   mskTopic: string;
   mskTopicPartitionCountStringValue: string;
+  topicTargetMBPerSec?: number;
+  topicSpecs?: MskTopicSpec[];
   brokersString: string;
 }
 
@@ -110,6 +141,7 @@ export function createCrMskTopicLambda(
   );
   const fn = new lambda_python.PythonFunction(scope, "cr-create-msk-topic-lambda", {
     runtime: lambda.Runtime.PYTHON_3_9,
+    layers: [getLambdaCommonLayer(scope)],
     entry:  path.join(__dirname, "./lambda/cr/create-msk-topic/"),
     index: "app.py",
     memorySize: 512,
@@ -123,6 +155,8 @@ export function createCrMskTopicLambda(
       MSK_TOPIC: props.mskTopic,
       MSK_BROKERS: props.brokersString,
       MSK_TOPIC_PARTITIONS: props.mskTopicPartitionCountStringValue,
+      MSK_TOPIC_TARGET_MB_PER_SEC: `${props.topicTargetMBPerSec || 0}`,
+      MSK_TOPIC_SPECS: JSON.stringify(props.topicSpecs || []),
     },
   });
   return fn;
@@ -138,6 +172,7 @@ export function createCrGetMskConfigVersionLambda(
 ): lambda.Function {
   const fn = new lambda.Function(scope, "cr-get-msk-config-version", {
     runtime: lambda.Runtime.PYTHON_3_9,
+    layers: [getLambdaCommonLayer(scope)],
     code: lambda.Code.fromAsset(
       path.join(__dirname, "./lambda/cr/get-msk-config-version/")
     ),
@@ -169,12 +204,13 @@ export function createCrDeleteClusterLambda(
 ): { fn: lambda.Function; policy?: iam.Policy } {
   const fn = new lambda.Function(scope, "cr-delete-ecs-cluster", {
     runtime: lambda.Runtime.PYTHON_3_9,
+    layers: [getLambdaCommonLayer(scope)],
     code: lambda.Code.fromAsset(
       path.join(__dirname, "./lambda/cr/delete-ecs-cluster/")
     ),
     handler: "app.handler",
     memorySize: 512,
-    timeout: Duration.minutes(15),
+    timeout: Duration.minutes(2),
     logRetention: RetentionDays.ONE_WEEK,
     environment: {
       ECS_CLUSTER_NAME: props.clusterName,
@@ -243,6 +279,9 @@ export interface KinesisToS3Lambda {
   vpc: ec2.IVpc;
   s3Bucket: string;
   prefix: string;
+  recordProjection?: { [key: string]: any };
+  recordEnrichment?: { [key: string]: any };
+  recordAggregates?: { [key: string]: any };
 }
 
 export function createKinesisToS3Lambda(
@@ -257,6 +296,7 @@ export function createKinesisToS3Lambda(
   );
   const fn = new lambda.Function(scope, "kinesis-to-s3-lambda", {
     runtime: lambda.Runtime.PYTHON_3_9,
+    layers: [getLambdaCommonLayer(scope)],
     code: lambda.Code.fromAsset(
       path.join(__dirname, "./lambda/kinesis-to-s3/")
     ),
@@ -268,6 +308,53 @@ export function createKinesisToS3Lambda(
     vpcSubnets: selectedSubnets,
     securityGroups: [lambdaSecurityGroup],
     allowPublicSubnet: publicSubnet,
+    environment: {
+      AWS_S3_BUCKET: props.s3Bucket,
+      AWS_S3_PREFIX: props.prefix,
+      ...(props.recordProjection
+        ? { RECORD_PROJECTION: JSON.stringify(props.recordProjection) }
+        : {}),
+      ...(props.recordEnrichment
+        ? { RECORD_ENRICHMENT: JSON.stringify(props.recordEnrichment) }
+        : {}),
+      ...(props.recordAggregates
+        ? { RECORD_AGGREGATES: JSON.stringify(props.recordAggregates) }
+        : {}),
+    },
+  });
+  return fn;
+}
+
+export interface MskToS3Lambda {
+  vpc: ec2.IVpc;
+  lambdaSecurityGroup: ec2.ISecurityGroup;
+  s3Bucket: string;
+  prefix: string;
+}
+
+// MSK to S3 sink on the kinesis-to-s3 code, see lambda/kinesis-to-s3/msk.py
+export function createMskToS3Lambda(
+  scope: Construct,
+  props: MskToS3Lambda
+): lambda.Function {
+  const { selectedSubnets, publicSubnet } = getServiceSubnets(
+    props.vpc,
+    "lambda.Function"
+  );
+  const fn = new lambda.Function(scope, "msk-to-s3-lambda", {
+    runtime: lambda.Runtime.PYTHON_3_9,
+    layers: [getLambdaCommonLayer(scope)],
+    code: lambda.Code.fromAsset(
+      path.join(__dirname, "./lambda/kinesis-to-s3/")
+    ),
+    handler: "msk.handler",
+    memorySize: 1024,
+    timeout: Duration.minutes(15),
+    logRetention: RetentionDays.ONE_WEEK,
+    vpc: props.vpc,
+    vpcSubnets: selectedSubnets,
+    securityGroups: [props.lambdaSecurityGroup],
+    allowPublicSubnet: publicSubnet,
     environment: {
       AWS_S3_BUCKET: props.s3Bucket,
       AWS_S3_PREFIX: props.prefix,
@@ -282,6 +369,7 @@ export function createServerHealthCheckLambda(
 ): lambda.Function {
   const fn = new lambda.Function(scope, "ServerHealthCheckLambda", {
     runtime: lambda.Runtime.PYTHON_3_9,
+    layers: [getLambdaCommonLayer(scope)],
     code: lambda.Code.fromAsset(path.join(__dirname, "./lambda/health-check/")),
     handler: "app.handler",
     memorySize: 256,
@@ -291,10 +379,53 @@ export function createServerHealthCheckLambda(
       SNS_TOPIC_ARN: snsArn,
     },
   });
+  // publish ingestion probe metrics
+  fn.addToRolePolicy(
+    new iam.PolicyStatement({
+      resources: ["*"],
+      actions: ["cloudwatch:PutMetricData"],
+    })
+  );
 
   return fn;
 }
 
+// sets the PROFILE_* environment of lambda_common/profiling.py on the
+// Python functions and the image function, the Provider framework ones are Node.js
+class LambdaProfilingAspect implements IAspect {
+  constructor(
+    private readonly sampleRate: number,
+    private readonly bucket?: s3.IBucket
+  ) {}
+
+  public visit(node: IConstruct): void {
+    if (!(node instanceof lambda.Function)) {
+      return;
+    }
+    const isPython = node.runtime.family == lambda.RuntimeFamily.PYTHON;
+    if (!isPython && node.runtime != lambda.Runtime.FROM_IMAGE) {
+      return;
+    }
+    node.addEnvironment("PROFILE_SAMPLE_RATE", `${this.sampleRate}`);
+    if (this.bucket) {
+      node.addEnvironment("PROFILE_S3_BUCKET", this.bucket.bucketName);
+      this.bucket.grantPut(node, "lambda-profiles/*");
+    }
+  }
+}
+
+export function addLambdaProfiling(scope: Construct) {
+  const sampleRate = AppConfig.lambdaProfileSampleRate(scope);
+  if (sampleRate <= 0) {
+    return;
+  }
+  const bucketName = AppConfig.lambdaProfileS3Bucket(scope);
+  const bucket = bucketName
+    ? s3.Bucket.fromBucketName(scope, "LambdaProfileBucket", bucketName)
+    : undefined;
+  Aspects.of(scope).add(new LambdaProfilingAspect(sampleRate, bucket));
+}
+
 export interface AlbLoginLambdaProps {
   loginUrl: string;
   oidcProvider: OIDCProvider;
@@ -322,6 +453,12 @@ export interface MetricLambdaPros {
   ecsClusterName?: string;
   ecsServiceName?: string;
   targetGroupArn?: string;
+  // consumer lag of the S3 sink connector, the lambda runs in the vpc
+  vpc?: ec2.IVpc;
+  mskBrokers?: string;
+  mskTopic?: string;
+  mskClusterName?: string;
+  mskSecurityGroup?: ec2.ISecurityGroup;
 }
 
 export function createMetricLambda(
@@ -360,21 +497,50 @@ export function createMetricLambda(
     };
   }
 
+  let mskEnv = {};
+  let vpcProps = {};
+  if (props.vpc && props.mskBrokers && props.mskTopic) {
+    mskEnv = {
+      MSK_BROKERS: props.mskBrokers,
+      MSK_TOPIC: props.mskTopic,
+      MSK_CLUSTER_NAME: props.mskClusterName || "",
+    };
+    const { selectedSubnets, publicSubnet } = getServiceSubnets(
+      props.vpc,
+      "lambda.Function"
+    );
+    vpcProps = {
+      vpc: props.vpc,
+      vpcSubnets: selectedSubnets,
+      allowPublicSubnet: publicSubnet,
+      securityGroups: [
+        createMetricLambdaSecurityGroup(
+          scope,
+          props.vpc,
+          props.mskSecurityGroup
+        ),
+      ],
+    };
+  }
+
   const environment = {
     ...albFullNameEnv,
     ...asgNameEnv,
     ...ecsClusterNameEnv,
     ...ecsServiceNameEnv,
     ...targetGroupArnEnv,
+    ...mskEnv,
   };
 
-  const fn = new lambda.Function(scope, "MetricLambda", {
+  const fn = new lambda_python.PythonFunction(scope, "MetricLambda", {
     runtime: lambda.Runtime.PYTHON_3_9,
-    code: lambda.Code.fromAsset(path.join(__dirname, "./lambda/metric/")),
-    handler: "app.handler",
+    layers: [getLambdaCommonLayer(scope)],
+    entry: path.join(__dirname, "./lambda/metric/"),
+    index: "app.py",
     memorySize: 1024,
     timeout: Duration.seconds(30),
     logRetention: RetentionDays.ONE_WEEK,
+    ...vpcProps,
     environment,
   });
   if (fn.role) {
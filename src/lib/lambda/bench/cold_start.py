@@ -0,0 +1,120 @@
+'''
+Cold start benchmark of the Python Lambdas.
+
+For every function a fresh interpreter imports app.py and then creates the
+boto3 clients the module declares, the import and client init times are
+reported in milliseconds.
+
+    python cold_start.py --out after.json
+    git worktree add /tmp/before <ref>
+    python cold_start.py --src /tmp/before/src/lib/lambda --out before.json
+    python cold_start.py --compare before.json after.json
+'''
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+functions = [
+    'kinesis-to-s3',
+    'metric',
+    'health-check',
+    'cr/create-msk-s3-sink-connector',
+    'cr/create-msk-topic',
+    'cr/delete-ecs-cluster',
+    'cr/get-msk-config-version',
+]
+
+# dummy values for the environment variables read at import time
+stub_env = {
+    'AWS_REGION': 'us-east-1',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'bench',
+    'AWS_SECRET_ACCESS_KEY': 'bench',
+    'AWS_S3_BUCKET': 'bench',
+    'AWS_S3_PREFIX': 'bench',
+    'LOAD_BALANCER_FULL_NAME': 'bench',
+    'AUTO_SCALING_GROUP_NAME': 'bench',
+    'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:bench',
+    'MSK_PLUGIN_S3_BUCKET': 'bench',
+    'MSK_SINK_S3_BUCKET': 'bench',
+    'MSK_SINK_S3_PREFIX': 'bench',
+    'MSK_TOPIC': 'bench',
+    'MSK_BROKERS': 'localhost:9092',
+    'MSK_CLUSTER_NAME': 'bench',
+    'MSK_CONNECTOR_ROLE_ARN': 'bench',
+    'MSK_SECURITY_GROUP_ID': 'bench',
+    'MSK_SUBNET_IDS': 'bench',
+    'MSK_CONFIG_ARN': 'bench',
+    'ECS_CLUSTER_NAME': 'bench',
+    'ECS_SERVICE': 'bench',
+    'ECS_TASK_NAME': 'bench',
+    'ASG_NAME': 'bench',
+}
+
+probe = '''
+import time, json
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+for value in list(vars(app).values()):
+    if type(value).__name__ == 'LazyClient':
+        value.meta
+clients = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "clients_ms": (clients - imported) * 1000}))
+'''
+
+
+def measure(src, function, runs):
+    function_dir = os.path.join(src, function)
+    layer_dir = os.path.join(src, 'layer', 'python')
+    env = {**os.environ, **stub_env,
+           'PYTHONPATH': os.pathsep.join([function_dir, layer_dir])}
+    samples = []
+    for _ in range(runs):
+        res = subprocess.run([sys.executable, '-c', probe], cwd=function_dir,
+                             env=env, capture_output=True, text=True)
+        if res.returncode != 0:
+            return {'error': res.stderr.strip().splitlines()[-1]}
+        samples.append(json.loads(res.stdout.strip().splitlines()[-1]))
+    return {k: round(statistics.median(s[k] for s in samples), 2)
+            for k in ['import_ms', 'clients_ms']}
+
+
+def compare(before_file, after_file):
+    before = json.load(open(before_file))
+    after = json.load(open(after_file))
+    print(f"{'function':36} {'import before':>14} {'import after':>13} {'init before':>12} {'init after':>11}")
+    for function in functions:
+        b, a = before.get(function, {}), after.get(function, {})
+        def total(r): return round(r.get('import_ms', 0) + r.get('clients_ms', 0), 2) if 'error' not in r else None
+        print(f"{function:36} {str(b.get('import_ms')):>14} {str(a.get('import_ms')):>13} "
+              f"{str(total(b)):>12} {str(total(a)):>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--src', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'),
+                        help='the lambda source directory')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--out')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = {function: measure(args.src, function, args.runs)
+               for function in functions}
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,544 @@
+'''
+Capacity benchmark of the ingestion endpoint, the max sustainable request
+rate of a deployed tier.
+
+Requests are sent open-loop: request i is due at start + i / rps whether or
+not the earlier ones were answered, over a pool of keep-alive connections.
+Latency is measured from the due time, so the time a request waits for a
+connection or for the event loop is counted too (coordinated omission
+correction), the service latency from the send is reported next to it.
+The bodies are clickstream events in a mix of single events, batches and
+large batches.
+
+A rate is sustainable when the error ratio, the achieved rate and the
+corrected p99 are within bounds. --search doubles the rate until it is not
+sustainable and then bisects between the last good and the first bad one.
+
+    python ingest_capacity.py --url http://<alb>/collect --rates 500,1000,2000
+    python ingest_capacity.py --url http://<alb>/collect --search --tier SMALL \\
+        --label vector.batch.max_events=200 --out small.json
+    python ingest_capacity.py --stand-in --search --out stand-in.json
+    python ingest_capacity.py --compare small.json medium.json
+
+--stand-in starts a local HTTP server in place of Nginx, its capacity is
+--stand-in-workers / --stand-in-service-ms. One process sends a few
+thousand requests per second, --processes splits the rate over more.
+'''
+import ssl
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+import functools
+import argparse
+import multiprocessing
+from array import array
+from urllib.parse import urlsplit, urlencode
+from concurrent.futures import ProcessPoolExecutor
+
+user_agents = [
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 16_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.5 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Mobile Safari/537.36',
+]
+event_types = ['page_view', 'page_scroll', 'click', 'user_engagement', 'add_to_cart']
+
+# body kind -> number of events
+body_kinds = {'single': 1, 'batch': 10, 'large': 50}
+default_mix = 'single=0.55,batch=0.35,large=0.1'
+
+# distinct bodies generated per kind
+bodies_per_kind = 200
+
+
+## Payloads
+def make_event(rnd, event_type=None):
+    event_type = event_type or rnd.choice(event_types)
+    event = {
+        'event_type': event_type,
+        'event_id': str(uuid.UUID(int=rnd.getrandbits(128))),
+        'app_id': 'bench',
+        'unique_id': f"user-{rnd.randrange(100000)}",
+        'device_id': f"device-{rnd.randrange(100000)}",
+        'timestamp': int(time.time() * 1000),
+        'platform': rnd.choice(['Web', 'Android', 'iOS']),
+        'os_version': rnd.choice(['13', '16.5', '10.0']),
+        'make': rnd.choice(['Apple', 'Google', 'Samsung']),
+        'locale': rnd.choice(['en_US', 'de_DE', 'ja_JP']),
+        'zone_offset': rnd.choice([-18000000, 0, 32400000]),
+        'sdk_version': '0.4.0',
+        'attributes': {
+            '_session_id': f"{rnd.getrandbits(32):08x}",
+            '_page_url': f"https://shop.example.com/p/{rnd.randrange(5000)}",
+            '_page_title': 'Product detail',
+            '_screen_name': 'ProductDetail',
+        },
+        'user': {'_user_id': {'value': f"u{rnd.randrange(100000)}"}},
+    }
+    if event_type == 'add_to_cart':
+        event['attributes']['items'] = [{
+            'id': f"sku-{rnd.randrange(10000)}",
+            'name': 'Item ' + 'x' * rnd.randrange(10, 60),
+            'price': round(rnd.uniform(1, 300), 2),
+            'quantity': rnd.randrange(1, 4),
+        } for _ in range(rnd.randrange(1, 6))]
+    return event
+
+
+def make_bodies(mix, seed=7):
+    '''
+    [(kind, body bytes)] drawn in the proportions of the mix.
+    '''
+    rnd = random.Random(seed)
+    by_kind = {kind: [json.dumps([make_event(rnd) for _ in range(body_kinds[kind])]).encode('utf-8')
+                      for _ in range(bodies_per_kind)]
+               for kind in mix}
+    kinds = rnd.choices(list(mix), weights=list(mix.values()), k=bodies_per_kind * 10)
+    return [(kind, rnd.choice(by_kind[kind])) for kind in kinds]
+
+
+def parse_mix(value):
+    mix = {}
+    for pair in value.split(','):
+        kind, weight = pair.split('=')
+        if kind not in body_kinds:
+            raise ValueError(f"unknown body kind {kind}, one of {list(body_kinds)}")
+        mix[kind] = float(weight)
+    return mix
+
+
+## HTTP client
+class ConnectionPool:
+    '''
+    Keep-alive HTTP/1.1 connections to one host, at most size requests in
+    flight. A connection that fails or is closed by the server is dropped.
+    '''
+
+    def __init__(self, url, size, timeout_sec):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        self.host_header = parts.netloc
+        self.timeout_sec = timeout_sec
+        self.slots = asyncio.Semaphore(size)
+        self.idle = []
+        self.connects = 0
+
+    async def post(self, body, user_agent):
+        '''
+        Returns the status code and the service latency in seconds, from
+        the send to the end of the response.
+        '''
+        async with self.slots:
+            conn = self.idle.pop() if self.idle else None
+            start = time.perf_counter()
+            try:
+                if conn is None:
+                    conn = await asyncio.wait_for(
+                        asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.timeout_sec)
+                    self.connects += 1
+                status, keep_alive = await asyncio.wait_for(
+                    self.send(conn, body, user_agent), self.timeout_sec)
+            except BaseException:
+                if conn is not None:
+                    conn[1].close()
+                raise
+            latency = time.perf_counter() - start
+            if keep_alive:
+                self.idle.append(conn)
+            else:
+                conn[1].close()
+            return status, latency
+
+    async def send(self, conn, body, user_agent):
+        reader, writer = conn
+        writer.write((f"POST {self.path} HTTP/1.1\r\n"
+                      f"Host: {self.host_header}\r\n"
+                      f"User-Agent: {user_agent}\r\n"
+                      "Content-Type: application/json\r\n"
+                      f"Content-Length: {len(body)}\r\n"
+                      "Connection: keep-alive\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+        return await read_response(reader)
+
+    def close(self):
+        for _, writer in self.idle:
+            writer.close()
+        self.idle = []
+
+
+async def read_response(reader):
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+    status = int(head[0].split(' ', 2)[1])
+    headers = {}
+    for line in head[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip().lower()
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers.get('connection') != 'close'
+
+
+## Open-loop load
+async def run_load(url, rps, duration_sec, warmup_sec, bodies, pool_size, timeout_sec,
+                   max_in_flight, seed):
+    '''
+    Sends rps requests per second for warmup_sec + duration_sec, the
+    samples of the requests due after the warmup are returned.
+    '''
+    loop = asyncio.get_running_loop()
+    pool = ConnectionPool(url, pool_size, timeout_sec)
+    rnd = random.Random(seed)
+    total = int(rps * (warmup_sec + duration_sec))
+    start = loop.time() + 0.05
+    measured_from = start + warmup_sec
+    samples = {'latency': array('d'), 'service': array('d'), 'dispatchLag': array('d')}
+    counts = {'ok': 0, 'httpErrors': 0, 'timeouts': 0, 'connectionErrors': 0, 'overflow': 0}
+    kinds = {}
+    last_done = [measured_from]
+    in_flight = set()
+
+    async def fire(due, kind, body, user_agent):
+        measured = due >= measured_from
+        if measured:
+            samples['dispatchLag'].append(loop.time() - due)
+        try:
+            status, service = await pool.post(body, user_agent)
+        except asyncio.TimeoutError:
+            result = 'timeouts'
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            result = 'connectionErrors'
+        else:
+            result = 'ok' if status < 400 else 'httpErrors'
+        if not measured:
+            return
+        done = loop.time()
+        counts[result] += 1
+        if result == 'ok':
+            samples['latency'].append(done - due)
+            samples['service'].append(service)
+            kinds[kind] = kinds.get(kind, 0) + 1
+            last_done[0] = max(last_done[0], done)
+
+    i = 0
+    while i < total:
+        now = loop.time()
+        while i < total and start + i / rps <= now:
+            due = start + i / rps
+            kind, body = bodies[i % len(bodies)]
+            if len(in_flight) >= max_in_flight:
+                # the client can not keep up, the request counts as failed
+                if due >= measured_from:
+                    counts['overflow'] += 1
+            else:
+                task = loop.create_task(fire(due, kind, body, rnd.choice(user_agents)))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            i += 1
+        await asyncio.sleep(max(0, start + i / rps - loop.time()))
+    if in_flight:
+        await asyncio.gather(*in_flight, return_exceptions=True)
+    pool.close()
+    return {
+        'samples': {name: values.tobytes() for name, values in samples.items()},
+        'counts': counts,
+        'kinds': kinds,
+        'measuredSec': max(duration_sec, last_done[0] - measured_from),
+        'connects': pool.connects,
+    }
+
+
+def run_load_process(kwargs):
+    return asyncio.run(run_load(**kwargs))
+
+
+def run_step(args, rps, bodies):
+    share = rps / args.processes
+    jobs = [{
+        'url': args.url,
+        'rps': share,
+        'duration_sec': args.duration,
+        'warmup_sec': args.warmup,
+        'bodies': bodies[p::args.processes] or bodies,
+        'pool_size': args.connections,
+        'timeout_sec': args.timeout,
+        'max_in_flight': args.max_in_flight,
+        'seed': p,
+    } for p in range(args.processes)]
+    if args.processes == 1:
+        results = [run_load_process(jobs[0])]
+    else:
+        with ProcessPoolExecutor(args.processes) as executor:
+            results = list(executor.map(run_load_process, jobs))
+    return summarize_step(args, rps, results)
+
+
+def summarize_step(args, rps, results):
+    samples = {}
+    for name in ['latency', 'service', 'dispatchLag']:
+        values = array('d')
+        for result in results:
+            values.frombytes(result['samples'][name])
+        samples[name] = sorted(values)
+    counts = {name: sum(result['counts'][name] for result in results)
+              for name in results[0]['counts']}
+    kinds = {}
+    for result in results:
+        for kind, count in result['kinds'].items():
+            kinds[kind] = kinds.get(kind, 0) + count
+    sent = sum(counts.values())
+    errors = sent - counts['ok']
+    measured_sec = max(result['measuredSec'] for result in results)
+    achieved_rps = counts['ok'] / measured_sec
+    step = {
+        'targetRps': round(rps, 1),
+        'achievedRps': round(achieved_rps, 1),
+        'sent': sent,
+        **counts,
+        'errorRatio': round(errors / sent, 5) if sent else 0,
+        'latencyMs': percentiles(samples['latency']),
+        'serviceLatencyMs': percentiles(samples['service']),
+        'dispatchLagMs': percentiles(samples['dispatchLag']),
+        'bodies': kinds,
+        'connects': sum(result['connects'] for result in results),
+    }
+    step['sustainable'], step['limitedBy'] = is_sustainable(args, step)
+    # the load generator itself fell behind, the step says little about the server
+    step['clientBound'] = (step['dispatchLagMs']['p99'] or 0) > args.max_dispatch_lag_ms
+    return step
+
+
+def is_sustainable(args, step):
+    if step['errorRatio'] > args.max_error_ratio:
+        return False, 'errors'
+    if step['achievedRps'] < step['targetRps'] * args.min_achieved_ratio:
+        return False, 'throughput'
+    if (step['latencyMs']['p99'] or math.inf) > args.slo_p99_ms:
+        return False, 'latency'
+    return True, None
+
+
+def percentiles(sorted_values):
+    def at(p):
+        if not sorted_values:
+            return None
+        # nearest-rank percentile
+        index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+        return round(sorted_values[index] * 1000, 2)
+    return {'p50': at(50), 'p90': at(90), 'p99': at(99), 'p999': at(99.9), 'max': at(100)}
+
+
+## Saturation search
+def search_saturation(args, bodies, steps):
+    '''
+    Double the rate until it is not sustainable, then bisect until the
+    bounds are within --precision of each other.
+    '''
+    good, bad = None, None
+    rps = args.start_rps
+    while rps <= args.max_rps:
+        step = measure(args, rps, bodies, steps)
+        if not step['sustainable']:
+            bad = rps
+            break
+        good = rps
+        rps *= 2
+    if bad is None:
+        return {'maxSustainableRps': good, 'firstUnsustainableRps': None,
+                'note': f"sustainable up to --max-rps {args.max_rps}"}
+    low = good or 0
+    while bad - low > max(low, args.start_rps) * args.precision:
+        rps = (low + bad) / 2
+        step = measure(args, rps, bodies, steps)
+        if step['sustainable']:
+            low = rps
+        else:
+            bad = rps
+    return {'maxSustainableRps': round(low, 1) if low else None,
+            'firstUnsustainableRps': round(bad, 1)}
+
+
+def measure(args, rps, bodies, steps):
+    step = run_step(args, rps, bodies)
+    steps.append(step)
+    print(f"{step['targetRps']:>10} rps: achieved {step['achievedRps']}, "
+          f"p99 {step['latencyMs']['p99']}ms, errors {step['errorRatio']}, "
+          f"{'ok' if step['sustainable'] else 'limited by ' + step['limitedBy']}"
+          f"{', client bound' if step['clientBound'] else ''}", file=sys.stderr)
+    if args.cooldown:
+        time.sleep(args.cooldown)
+    return step
+
+
+## Local stand-in
+def serve_stand_in(port, workers, service_ms, ready):
+    '''
+    Nginx stand-in: keep-alive POST endpoint answering 200 after
+    service_ms, at most workers requests are served at a time.
+    '''
+    async def handle(slots, reader, writer):
+        try:
+            while True:
+                head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').lower()
+                length = 0
+                for line in head.split('\r\n'):
+                    if line.startswith('content-length:'):
+                        length = int(line.split(':', 1)[1])
+                await reader.readexactly(length)
+                async with slots:
+                    await asyncio.sleep(service_ms / 1000)
+                writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n"
+                             f"rid: {uuid.uuid4().hex}\r\nContent-Length: 0\r\n\r\n".encode('latin-1'))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        slots = asyncio.Semaphore(workers)
+        server = await asyncio.start_server(functools.partial(handle, slots), '127.0.0.1', port,
+                                            backlog=4096)
+        ready.put(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+def start_stand_in(args):
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=serve_stand_in, args=(0, args.stand_in_workers, args.stand_in_service_ms, ready),
+        daemon=True)
+    process.start()
+    port = ready.get(timeout=10)
+    return process, f"http://127.0.0.1:{port}/collect"
+
+
+## Compare
+def compare(paths):
+    rows = []
+    for path in paths:
+        with open(path) as f:
+            result = json.load(f)
+        saturation = result.get('saturation') or {}
+        best = max((s for s in result['steps'] if s['sustainable']),
+                   key=lambda s: s['targetRps'], default=None)
+        rows.append({
+            'file': path,
+            'tier': result['target'].get('tier'),
+            'labels': result['target'].get('labels'),
+            'maxSustainableRps': saturation.get('maxSustainableRps',
+                                                best['targetRps'] if best else None),
+            'p99AtMaxMs': best['latencyMs']['p99'] if best else None,
+            'serviceP99AtMaxMs': best['serviceLatencyMs']['p99'] if best else None,
+        })
+    print(json.dumps(rows, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='ingestion endpoint, e.g. http://<alb>/collect')
+    parser.add_argument('--app-id', default='bench')
+    parser.add_argument('--tier', help='recorded in the results, e.g. SMALL')
+    parser.add_argument('--label', action='append', help='recorded in the results, key=value')
+    parser.add_argument('--rates', help='comma separated rates to run instead of a search')
+    parser.add_argument('--search', action='store_true', help='find the max sustainable rate')
+    parser.add_argument('--start-rps', type=float, default=100)
+    parser.add_argument('--max-rps', type=float, default=100000)
+    parser.add_argument('--precision', type=float, default=0.05,
+                        help='search stops when the bounds are this close, relative')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds per rate')
+    parser.add_argument('--warmup', type=float, default=5, help='unmeasured seconds before')
+    parser.add_argument('--cooldown', type=float, default=5, help='pause between rates')
+    parser.add_argument('--mix', default=default_mix, help='body kinds and weights')
+    parser.add_argument('--connections', type=int, default=256, help='keep-alive pool per process')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=5, help='request timeout seconds')
+    parser.add_argument('--max-in-flight', type=int, default=20000,
+                        help='requests waiting in a process before they count as failed')
+    parser.add_argument('--max-error-ratio', type=float, default=0.001)
+    parser.add_argument('--min-achieved-ratio', type=float, default=0.95)
+    parser.add_argument('--slo-p99-ms', type=float, default=500)
+    parser.add_argument('--max-dispatch-lag-ms', type=float, default=50)
+    parser.add_argument('--stand-in', action='store_true', help='run against a local stand-in')
+    parser.add_argument('--stand-in-workers', type=int, default=8)
+    parser.add_argument('--stand-in-service-ms', type=float, default=4)
+    parser.add_argument('--compare', nargs='+', metavar='RESULT')
+    parser.add_argument('--out')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        return
+    if not args.url and not args.stand_in:
+        parser.error('--url or --stand-in is required')
+    if not args.rates and not args.search:
+        parser.error('--rates or --search is required')
+
+    stand_in = None
+    if args.stand_in:
+        stand_in, args.url = start_stand_in(args)
+    args.url += ('&' if '?' in args.url else '?') + urlencode({'appId': args.app_id, 'platform': 'Web'})
+    mix = parse_mix(args.mix)
+    bodies = make_bodies(mix)
+
+    steps = []
+    saturation = None
+    try:
+        if args.rates:
+            for rps in args.rates.split(','):
+                measure(args, float(rps), bodies, steps)
+        if args.search:
+            saturation = search_saturation(args, bodies, steps)
+    finally:
+        if stand_in:
+            stand_in.terminate()
+
+    results = {
+        'target': {
+            'url': args.url,
+            'tier': args.tier,
+            'labels': dict(pair.split('=', 1) for pair in args.label or []),
+            'standIn': {'workers': args.stand_in_workers, 'serviceMs': args.stand_in_service_ms,
+                        'capacityRps': args.stand_in_workers * 1000 / args.stand_in_service_ms}
+            if args.stand_in else None,
+        },
+        'config': {
+            'durationSec': args.duration,
+            'warmupSec': args.warmup,
+            'mix': mix,
+            'avgBodyBytes': round(sum(len(body) for _, body in bodies) / len(bodies)),
+            'connections': args.connections,
+            'processes': args.processes,
+            'timeoutSec': args.timeout,
+            'maxErrorRatio': args.max_error_ratio,
+            'minAchievedRatio': args.min_achieved_ratio,
+            'sloP99Ms': args.slo_p99_ms,
+        },
+        'startedAt': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'steps': sorted(steps, key=lambda s: s['targetRps']),
+        'saturation': saturation,
+    }
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+'''
+Throughput per dollar of the MSK to S3 sink Lambda against the MSK Connect
+S3 sink connector.
+
+The Lambda side is measured: synthetic MSK events go through msk.handler
+and the processing time per record is priced as Lambda GB-seconds plus
+requests. S3 is a moto in-memory mock unless --endpoint-url points at
+MinIO or a moto server, so the time is mostly the record pipeline. The
+connector side can not run locally, its throughput per MCU is an input.
+
+    python msk_sink_cost.py --ingest-mb-per-sec 2
+    python msk_sink_cost.py --connector-mb-per-sec-per-mcu 4 --connector-min-mcu 2
+'''
+import os
+import sys
+import json
+import time
+import argparse
+
+lambda_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'kinesis-to-s3')
+layer_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'layer', 'python')
+
+# us-east-1 list prices
+lambda_gb_second_usd = 0.0000166667
+lambda_request_usd = 0.0000002
+mcu_hour_usd = 0.11
+s3_put_usd = 0.000005
+hours_per_month = 730
+
+
+def measure_lambda(args):
+    os.environ.setdefault('AWS_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    os.environ['AWS_S3_BUCKET'] = 'bench-msk-sink'
+    os.environ['AWS_S3_PREFIX'] = 'bench'
+    if args.endpoint_url:
+        os.environ['AWS_ENDPOINT_URL'] = args.endpoint_url
+    sys.path[:0] = [lambda_dir, layer_dir]
+
+    def run():
+        import msk
+        try:
+            msk.app.s3.create_bucket(Bucket='bench-msk-sink')
+        except Exception:
+            pass
+        samples = []
+        for i in range(args.runs):
+            event = msk.make_event('bench', args.partitions, args.batch_records,
+                                   start_offset=i * args.batch_records,
+                                   payload_bytes=args.payload_bytes)
+            start = time.perf_counter()
+            result = msk.handler(event, None)
+            samples.append((time.perf_counter() - start, result['records'], len(result['objects'])))
+        return samples
+
+    if args.endpoint_url:
+        return run()
+    from moto import mock_aws
+    with mock_aws():
+        return run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-records', type=int, default=10000)
+    parser.add_argument('--partitions', type=int, default=4)
+    parser.add_argument('--payload-bytes', type=int, default=600)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--memory-mb', type=int, default=1024)
+    parser.add_argument('--ingest-mb-per-sec', type=float, default=1.0,
+                        help='average ingest rate the monthly cost is computed for')
+    parser.add_argument('--connector-mb-per-sec-per-mcu', type=float, default=2.0,
+                        help='assumed S3 sink connector throughput of one MCU')
+    parser.add_argument('--connector-min-mcu', type=int, default=1,
+                        help='minWorkerCount * workerMcuCount of the connector')
+    parser.add_argument('--endpoint-url', help='S3 compatible endpoint instead of the moto mock')
+    parser.add_argument('--out')
+    args = parser.parse_args()
+
+    samples = measure_lambda(args)
+    seconds = sum(s[0] for s in samples)
+    records = sum(s[1] for s in samples)
+    puts = sum(s[2] for s in samples) + len(samples) * 2  # objects, checkpoints and manifest
+    record_mb = args.payload_bytes / 1024 / 1024
+    records_per_sec = records / seconds
+
+    # Lambda, per million records
+    lambda_per_million = (1e6 / records_per_sec * args.memory_mb / 1024 * lambda_gb_second_usd
+                          + 1e6 / args.batch_records * lambda_request_usd
+                          + 1e6 / records * puts * s3_put_usd)
+    monthly_records = args.ingest_mb_per_sec / record_mb * 3600 * hours_per_month
+    lambda_monthly = monthly_records / 1e6 * lambda_per_million
+
+    # connector, billed per MCU hour whether busy or not
+    mcu = max(args.connector_min_mcu, -(-args.ingest_mb_per_sec // args.connector_mb_per_sec_per_mcu))
+    connector_monthly = mcu * mcu_hour_usd * hours_per_month
+    connector_objects_per_month = monthly_records / args.batch_records
+    connector_monthly += connector_objects_per_month * s3_put_usd
+
+    results = {
+        'lambda': {
+            'recordsPerSec': round(records_per_sec, 1),
+            'mbPerSec': round(records_per_sec * record_mb, 3),
+            'usdPerMillionRecords': round(lambda_per_million, 4),
+            'monthlyUsd': round(lambda_monthly, 2),
+            'recordsPerUsd': round(1e6 / lambda_per_million),
+        },
+        'connector': {
+            'mcu': int(mcu),
+            'assumedMbPerSecPerMcu': args.connector_mb_per_sec_per_mcu,
+            'monthlyUsd': round(connector_monthly, 2),
+            'recordsPerUsd': round(monthly_records / connector_monthly),
+        },
+        'ingestMbPerSec': args.ingest_mb_per_sec,
+        'monthlyRecords': round(monthly_records),
+    }
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+'''
+Per record cost of the kinesis-to-s3 record stages.
+
+Synthetic records shaped like the Vector output (date, uri, ua, ip, rid,
+method, appId, platform and the event JSON in "data") are normalized with
+and without each stage, the time per record is reported in microseconds.
+
+    python record_stages.py --records 100000
+    python record_stages.py --projection my-projection.json
+    python record_stages.py --enrichment my-enrichment.json
+
+Without --enrichment a synthetic geo range file and app metadata table are
+generated in a temporary directory.
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'kinesis-to-s3'))
+from projection import compile_stage  # noqa: E402
+from enrichment import compile_enrichment, build_geo_db  # noqa: E402
+
+event_types = ['page_view', 'page_scroll', 'click', 'heartbeat', 'purchase']
+user_agents = [
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 16_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.5 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+]
+
+default_projection = {
+    'dropRules': [{'field': 'ua', 'matches': '(?i)bot|crawler|spider'}],
+    'sampling': {
+        'eventTypeField': 'data.event_type',
+        'keyFields': ['data.user_id', 'rid'],
+        'rates': {'page_scroll': 0.1, 'heartbeat': 0.01},
+    },
+    'keep': ['date', 'ip', 'ua', 'appId', 'platform', 'data'],
+    'drop': ['data.properties.debug'],
+}
+
+
+def make_enrichment(directory, seed=7):
+    rnd = random.Random(seed)
+    ranges_csv = os.path.join(directory, 'ranges.csv')
+    with open(ranges_csv, 'w') as f:
+        # 10.0.0.0/8 split into /20 blocks
+        for block in range(4096):
+            start = (10 << 24) + (block << 12)
+            f.write(f"{start},{start + 4095},{rnd.choice(['US', 'DE', 'JP', 'BR'])},"
+                    f"region-{block % 50},city-{block % 500}\n")
+    geo_db = os.path.join(directory, 'ipv4-ranges.bin')
+    build_geo_db(ranges_csv, geo_db)
+    app_metadata = os.path.join(directory, 'app-metadata.json')
+    with open(app_metadata, 'w') as f:
+        json.dump({'bench': {'name': 'Bench app', 'owner': 'bench'}}, f)
+    return {'userAgent': True, 'geoDbFile': geo_db, 'appMetadataFile': app_metadata}
+
+
+def make_records(count, seed=7):
+    rnd = random.Random(seed)
+    records = []
+    for i in range(count):
+        event = {
+            'event_type': rnd.choice(event_types),
+            'user_id': f"user-{rnd.randint(1, count // 10 + 1)}",
+            'session_id': f"session-{rnd.randint(1, count // 5 + 1)}",
+            'timestamp': 1700000000000 + i,
+            'properties': {'page': f"/page/{rnd.randint(1, 50)}", 'debug': 'x' * 40},
+        }
+        records.append(json.dumps({
+            'date': '2024-01-02T03:04:05Z',
+            'uri': '/collect?appId=bench&platform=Web',
+            'ua': rnd.choice(user_agents),
+            'ip': f"10.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}",
+            'rid': f"{i:032x}",
+            'method': 'POST',
+            'appId': 'bench',
+            'platform': 'Web',
+            'data': json.dumps(event),
+        }))
+    return records
+
+
+def run(records, stage):
+    start = time.perf_counter()
+    kept = 0
+    for raw in records:
+        record = json.loads(raw)
+        if stage is not None:
+            record = stage(record)
+            if record is None:
+                continue
+        json.dumps(record)
+        kept += 1
+    return (time.perf_counter() - start) / len(records) * 1e6, kept
+
+
+def measure(records, stage, runs):
+    samples = [run(records, stage) for _ in range(runs)]
+    return round(statistics.median(s[0] for s in samples), 3), samples[0][1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=50000)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--projection', help='projection config file, a built-in example by default')
+    parser.add_argument('--enrichment', help='enrichment config file, a generated one by default')
+    parser.add_argument('--out')
+    args = parser.parse_args()
+
+    projection = default_projection
+    if args.projection:
+        with open(args.projection) as f:
+            projection = json.load(f)
+
+    directory = tempfile.mkdtemp()
+    enrichment = make_enrichment(directory)
+    if args.enrichment:
+        with open(args.enrichment) as f:
+            enrichment = json.load(f)
+
+    records = make_records(args.records)
+    baseline_us, _ = measure(records, None, args.runs)
+    results = {'records': args.records, 'baseline': {'usPerRecord': baseline_us}}
+    # a new enrichment per stage, so that one does not warm the cache of another
+    stages = {
+        'projection': compile_stage(projection),
+        'enrichment': compile_stage({}, enrich=compile_enrichment(enrichment)),
+        'projection+enrichment': compile_stage(projection, enrich=compile_enrichment(enrichment)),
+    }
+    for name, stage in stages.items():
+        us, kept = measure(records, stage, args.runs)
+        results[name] = {
+            'usPerRecord': us,
+            'overheadUsPerRecord': round(us - baseline_us, 3),
+            'keptRatio': round(kept / args.records, 4),
+        }
+
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
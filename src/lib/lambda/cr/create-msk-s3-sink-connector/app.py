@@ -1,18 +1,16 @@
 # https://github.com/dpkp/kafka-python/blob/master/kafka/admin/client.py
 
-import boto3
+from lambda_common import lazy_client, get_logger, track_cold_start, profiled, custom_resource, s3_transfer
 import os
-import time
-import logging
-import wget
-import json
-from botocore.exceptions import ClientError
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+from botocore.exceptions import ClientError, ParamValidationError
 
-client = boto3.client("kafkaconnect")
-s3 = boto3.client('s3')
+client = lazy_client("kafkaconnect")
+s3 = lazy_client('s3')
 
-log = logging.getLogger()
-log.setLevel('INFO')
+log = get_logger()
 aws_region = os.environ['AWS_REGION']
 
 plugin_s3_bucket = os.environ['MSK_PLUGIN_S3_BUCKET']
@@ -35,25 +33,79 @@ minWorkerCount = int(os.environ.get('MSK_S3_CONNECTOR_WORKER_COUNT_MIN', '1'))
 mcuCount = int(os.environ.get('MSK_S3_CONNECTOR_MCU_COUNT', '1'))
 log_s3_bucket = os.environ.get('MSK_CONNECTOR_LOG_S3_BUCKET', sink_s3_bucket)
 
-timestamp = str(int(time.time()))
+# connector configuration profile: small, medium, large or default
+connector_profile = os.environ.get('MSK_S3_CONNECTOR_PROFILE', 'default')
+topic_partitions = int(os.environ.get('MSK_TOPIC_PARTITIONS', '0'))
+avg_record_bytes = int(os.environ.get('MSK_S3_CONNECTOR_AVG_RECORD_BYTES', '1024'))
+# where parquet and avro get the record schema from, only 'envelope' for
+# now: the producer sends the JsonConverter schema/payload envelope
+schema_source = os.environ.get('MSK_S3_CONNECTOR_SCHEMA_SOURCE', '')
+
+# target_object_mb is the compressed size of an S3 object,
+# tasks_per_mcu caps tasks.max together with the worker capacity.
+connector_profiles = {
+    # the original fixed settings
+    'default': {'tasks_max': 2, 'flush_size': 10000, 'rotate_interval_ms': 30000,
+                'format': 'json', 'compression': 'gzip'},
+    'small': {'target_object_mb': 16, 'rotate_interval_ms': 300000, 'tasks_per_mcu': 1,
+              'format': 'json', 'compression': 'gzip'},
+    'medium': {'target_object_mb': 64, 'rotate_interval_ms': 120000, 'tasks_per_mcu': 2,
+               'format': 'json', 'compression': 'gzip'},
+    'large': {'target_object_mb': 128, 'rotate_interval_ms': 60000, 'tasks_per_mcu': 4,
+              'format': 'json', 'compression': 'gzip'},
+}
+
+# rough compression ratio of clickstream json, used to size flush.size
+compression_ratios = {'none': 1, 'gzip': 5, 'snappy': 3, 'zstd': 6}
+
+format_classes = {
+    'json': 'io.confluent.connect.s3.format.json.JsonFormat',
+    'parquet': 'io.confluent.connect.s3.format.parquet.ParquetFormat',
+    'avro': 'io.confluent.connect.s3.format.avro.AvroFormat',
+}
+
 aws_partition='aws'
 
+max_concurrency = 10
+# a plugin still there after this is left behind, it does not fail the stack
+plugin_delete_timeout_sec = 600
+# every stack using a plugin tags it with owner_tag_prefix + its plugin name,
+# the last one to leave deletes it
+owner_tag_prefix = 'owner:'
+
+# the plugin zip is streamed from the url into a multipart upload
+plugin_part_bytes = 8 * 1024 * 1024
+plugin_upload_concurrency = 4
+
+
+class HashingReader:
+    '''
+    File-like wrapper computing the sha256 of a stream while it is read.
+    '''
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.sha256.update(data)
+        return data
+
 connect_plugin_url = os.environ.get('CLOUDFRONT_KAFKA_CONNECT_S3_PLUGIN_ZIP_URL', 
 'https://d1i4a15mxbxib1.cloudfront.net/api/plugins/confluentinc/kafka-connect-s3/versions/10.2.2/confluentinc-kafka-connect-s3-10.2.2.zip')
+# optional, expected sha256 of the plugin zip
+connect_plugin_sha256 = os.environ.get(
+    'KAFKA_CONNECT_S3_PLUGIN_ZIP_SHA256', '').lower()
 
 def string_to_s3(content, bucket, key):
-    s3.put_object(
-        Body=content.encode("utf-8"),
-        Bucket=bucket,
-        Key=key
-    )
+    s3_transfer.put_text(bucket, key, content)
 
 
 def read_as_json(bucket, key):
     try:
-        obj = s3.get_object(Bucket=bucket, Key=key)
-        return json.loads(obj['Body'].read())
-    except:
+        return s3_transfer.read_json(bucket, key)
+    except Exception:
         return None
 
 
@@ -64,28 +116,18 @@ def delete_obj(bucket, key):
         pass
 
 
-def handler(event, context):
+def run_concurrently(fn, items):
+    items = list(items)
+    if len(items) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(items), max_concurrency)) as executor:
+        return list(executor.map(fn, items))
 
-    log.info(f"plugin_s3_bucket: {plugin_s3_bucket}")
-    log.info(f"sink_s3_bucket: {sink_s3_bucket}")
-    log.info(f"sink_s3_obj_prefix: {sink_s3_obj_prefix}")
-    log.info(f"msk_topic: {msk_topic}")
-    log.info(f"msk_brokers: {msk_brokers}")
-    log.info(f"msk_cluster_name: {msk_cluster_name}")
-    log.info(f"s3_connector_role_arn: {s3_connector_role_arn}")
-    log.info(f"log_s3_bucket: {log_s3_bucket}")
-    log.info(f"msk_security_group_id: {msk_security_group_id}")
-    log.info(f"msk_subnet_ids: {msk_subnet_ids}")
-    log.info(f"maxWorkerCount: {maxWorkerCount}")
-    log.info(f"minWorkerCount: {minWorkerCount}")
-    
-    invoked_function_arn = context.invoked_function_arn
-    global aws_partition
-    aws_partition = invoked_function_arn.split(":")[1]
 
-    RequestType = event.get('RequestType')
-    log.info("RequestType:" + RequestType)
+def get_names(event):
+    global aws_partition
     stack_arn = event.get('StackId', '')
+    aws_partition = stack_arn.split(":")[1]
     unique_stack_id = stack_arn.split('/')[2].split('-')[4]
 
     connector_name = f"{msk_cluster_name}{unique_stack_id}-s3-sink-connector"
@@ -93,48 +135,131 @@ def handler(event, context):
 
     log.info(f"connector_name:{connector_name}")
     log.info(f"plugin_name:{plugin_name}")
+    return connector_name, plugin_name
+
 
+def list_connectors(connector_name):
     list_res = client.list_connectors(
         connectorNamePrefix=connector_name,
         maxResults=10,
     )
-    conn_size = len(list_res['connectors'])
     log.info("find {} connectors, connector_name: {}".format(
-        conn_size, connector_name))
+        len(list_res['connectors']), connector_name))
+    return list_res['connectors']
+
+
+def start_create(event):
+    log.info(f"plugin_s3_bucket: {plugin_s3_bucket}")
+    log.info(f"sink_s3_bucket: {sink_s3_bucket}")
+    log.info(f"sink_s3_obj_prefix: {sink_s3_obj_prefix}")
+    log.info(f"msk_topic: {msk_topic}")
+    log.info(f"msk_brokers: {msk_brokers}")
+    log.info(f"msk_cluster_name: {msk_cluster_name}")
+    log.info(f"s3_connector_role_arn: {s3_connector_role_arn}")
+    log.info(f"log_s3_bucket: {log_s3_bucket}")
+    log.info(f"msk_security_group_id: {msk_security_group_id}")
+    log.info(f"msk_subnet_ids: {msk_subnet_ids}")
+    log.info(f"maxWorkerCount: {maxWorkerCount}")
+    log.info(f"minWorkerCount: {minWorkerCount}")
 
-    if RequestType == 'Create':
-        if conn_size == 0:
-            return create_new_connector(connector_name, plugin_name)
+    connector_name, plugin_name = get_names(event)
+    stale_connector_arns = []
+    for connector in list_connectors(connector_name):
+        connectorState = connector['connectorState']
+        log.info(f"connector: {connector_name} already exists, connectorState: {connectorState}")
+        if connectorState in ['DELETING', 'FAILED']:
+            # is_create_complete creates the new one once it is gone
+            start_delete_connector(connector)
+            stale_connector_arns.append(connector['connectorArn'])
         else:
-            log.info(f"connector: {connector_name} already exists")
-            existing_connector = list_res['connectors'][0]
-            connectorState = existing_connector['connectorState']
-            log.info(f"connectorState: {connectorState}")
-            if connectorState in ['DELETING', 'FAILED']:
-                delete_connector(existing_connector)
-                return create_new_connector(connector_name, plugin_name)
-            return
-
-    if (RequestType == 'Delete'):
-        [delete_connector(connector_info)
-         for connector_info in list_res['connectors']]
-        delete_plugins(plugin_name)
-
-    if (RequestType == 'Update'):
-        [update_connector(connector_info)
-         for connector_info in list_res['connectors']]
-
-
-def create_new_connector(connector_name, plugin_name):
-    log.info("create_new_connector: " + connector_name)
-    # create new
+            return custom_resource.result(connector_name, {"connector_arn": connector['connectorArn']})
+
     plugin_arn = create_s3_sink_plugin(plugin_name)
-    connector_arn = create_s3_connector(plugin_arn, connector_name)
-    connector_config_info = {
+    return custom_resource.result(connector_name, {
         "plugin_arn": plugin_arn,
-        "connector_arn": connector_arn,
-    }
-    return connector_config_info
+        "stale_connector_arns": ",".join(stale_connector_arns),
+    })
+
+
+def is_create_complete(event):
+    connector_name, _ = get_names(event)
+    data = custom_resource.get_data(event)
+    stale_connector_arns = (data.get("stale_connector_arns") or "").split(",")
+    connectors = list_connectors(connector_name)
+    stale = [connector for connector in connectors if connector['connectorArn'] in stale_connector_arns]
+    if stale:
+        log.info(f"waiting for {[connector['connectorArn'] for connector in stale]} deleted")
+        run_concurrently(start_delete_connector, stale)
+        return None
+    if connectors:
+        connector = connectors[0]
+        # 'connectorState': 'RUNNING'|'CREATING'|'UPDATING'|'DELETING'|'FAILED',
+        connectorState = connector['connectorState']
+        log.info(f"connectorState: {connectorState}")
+        if connectorState == 'FAILED':
+            raise Exception('connectorState FAILED')
+        if connectorState != 'RUNNING':
+            return None
+        log.info("Connector created successfully and is running")
+        return custom_resource.complete({
+            "plugin_arn": data.get("plugin_arn"),
+            "connector_arn": connector['connectorArn'],
+        })
+
+    plugin_arn = data["plugin_arn"]
+    if not is_plugin_active(plugin_arn):
+        return None
+    try:
+        create_s3_connector(plugin_arn, connector_name)
+    except client.exceptions.ConflictException as e:
+        # created by an earlier check, not listed yet
+        log.info(repr(e))
+    return None
+
+
+def start_update(event):
+    connector_name, _ = get_names(event)
+    run_concurrently(update_connector, list_connectors(connector_name))
+
+
+def is_update_complete(event):
+    connector_name, _ = get_names(event)
+    states = [connector['connectorState'] for connector in list_connectors(connector_name)]
+    log.info(f"connectorStates: {states}")
+    if 'FAILED' in states:
+        raise Exception('connectorState FAILED')
+    if 'UPDATING' in states:
+        return None
+    return custom_resource.complete()
+
+
+def start_delete(event):
+    connector_name, _ = get_names(event)
+    run_concurrently(start_delete_connector, list_connectors(connector_name))
+
+
+def is_delete_complete(event):
+    connector_name, plugin_name = get_names(event)
+    connectors = list_connectors(connector_name)
+    if connectors:
+        run_concurrently(start_delete_connector, connectors)
+        return None
+    # the plugins can only be deleted once the connector is gone
+    deleting = [custom_plugin['customPluginArn'] for custom_plugin in delete_plugins(plugin_name)]
+    if deleting:
+        if custom_resource.elapsed_sec(event) > plugin_delete_timeout_sec:
+            log.warning(f"timeout waiting for {deleting} deleted")
+            return custom_resource.complete()
+        log.info(f"waiting for {deleting} deleted")
+        return None
+    return custom_resource.complete()
+
+
+handler = track_cold_start(profiled(custom_resource.provider_handler(
+    on_event={'Create': start_create, 'Update': start_update, 'Delete': start_delete},
+    is_complete={'Create': is_create_complete, 'Update': is_update_complete,
+                 'Delete': is_delete_complete},
+    query_interval_sec=10, max_delay_sec=60)))
 
 
 def update_connector(connector_info):
@@ -143,9 +268,7 @@ def update_connector(connector_info):
     update_s3_connector(connector_arn)
 
 
-def delete_connector(connector_info):
-    log.info("delete_connector")
-
+def start_delete_connector(connector_info):
     connectorState = connector_info['connectorState']
     log.info(f"delete_connector  connectorState {connectorState}")
     connector_arn = connector_info['connectorArn']
@@ -157,28 +280,71 @@ def delete_connector(connector_info):
         connectorState = del_res['connectorState']
         log.info(f"connectorState:{connectorState}")
 
-    while True:
-        time.sleep(10)
-        try:
-            descr_res = client.describe_connector(
-                connectorArn=connector_arn
-            )
-            connectorState = descr_res['connectorState']
-            log.info(f"connectorState:{connectorState}")
-        except client.exceptions.NotFoundException:
-            log.info(f"{connector_arn} deleted")
-            break
+
+def list_custom_plugins():
+    paginator = client.get_paginator('list_custom_plugins')
+    return [custom_plugin for page in paginator.paginate()
+            for custom_plugin in page['customPlugins']]
+
+
+def list_plugins_in_use():
+    # plugins can be shared across stacks, see find_active_plugin()
+    paginator = client.get_paginator('list_connectors')
+    return set(plugin['customPlugin']['customPluginArn']
+               for page in paginator.paginate()
+               for connector in page['connectors']
+               for plugin in connector.get('plugins', []))
+
+
+def owner_tag(plugin_name):
+    return f"{owner_tag_prefix}{plugin_name}"
+
+
+def get_owners(custom_plugin):
+    tags = client.list_tags_for_resource(
+        resourceArn=custom_plugin['customPluginArn']).get('tags', {})
+    return set(key for key in tags if key.startswith(owner_tag_prefix))
 
 
 def delete_plugins(plugin_name):
-    list_plugin_res = client.list_custom_plugins(
-        maxResults=10,
-    )
-    custom_plugins = [custom_plugin for custom_plugin in list_plugin_res['customPlugins'] if str(
-        custom_plugin['name']) == plugin_name]
+    '''
+    Remove the stack from the owners of its plugins and start deleting the
+    ones no other stack owns and no connector uses, returns the ones of the
+    stack not deleted yet.
+    '''
+    custom_plugins = [custom_plugin for custom_plugin in list_custom_plugins()
+                      if custom_plugin['customPluginState'] != 'DELETE_FAILED']
+    owners = dict(zip([custom_plugin['customPluginArn'] for custom_plugin in custom_plugins],
+                      run_concurrently(get_owners, custom_plugins)))
+    my_tag = owner_tag(plugin_name)
+    # by name, also the ones created before the owner tags
+    my_custom_plugins = [custom_plugin for custom_plugin in custom_plugins
+                         if custom_plugin['name'] == plugin_name
+                         or my_tag in owners[custom_plugin['customPluginArn']]]
     log.info("find plugin_name: {} , count: {}".format(
-        plugin_name, len(custom_plugins)))
-    [delete_plugin(custom_plugin) for custom_plugin in custom_plugins]
+        plugin_name, len(my_custom_plugins)))
+
+    # untag first, of two stacks leaving at once the last one sees no owner
+    for custom_plugin in my_custom_plugins:
+        plugin_arn = custom_plugin['customPluginArn']
+        if my_tag in owners[plugin_arn]:
+            client.untag_resource(resourceArn=plugin_arn, tagKeys=[my_tag])
+    plugins_in_use = list_plugins_in_use()
+    deleting = []
+    for custom_plugin in my_custom_plugins:
+        plugin_arn = custom_plugin['customPluginArn']
+        other_owners = get_owners(custom_plugin) - {my_tag}
+        if other_owners:
+            log.info(f"{plugin_arn} is owned by {sorted(other_owners)}, skip delete")
+        elif plugin_arn in plugins_in_use:
+            log.info(f"{plugin_arn} is used by other connectors, skip delete")
+        else:
+            deleting.append(custom_plugin)
+    run_concurrently(delete_plugin, [custom_plugin for custom_plugin in deleting
+                                     if custom_plugin['customPluginState'] != 'DELETING'])
+    # a shared plugin is not ours any more once untagged, only wait for
+    # the ones named after the stack
+    return [custom_plugin for custom_plugin in deleting if custom_plugin['name'] == plugin_name]
 
 
 def delete_plugin(custom_plugin):
@@ -191,44 +357,71 @@ def delete_plugin(custom_plugin):
         client.delete_custom_plugin(
             customPluginArn=plugin_arn
         )
-        time.sleep(10)
     except Exception as e:
         log.error(repr(e))
 
-    descr_res = client.describe_custom_plugin(
-        customPluginArn=plugin_arn
-    )
-    customPluginState = descr_res['customPluginState']
-    log.info(f"customPluginState:{customPluginState}")
-
 
-def download_plugin_to_s3():
+def get_plugin_s3_key():
+    '''
+    The plugin is stored content addressed, by its checksum when it is
+    known up front, by its (versioned) source url otherwise.
+    '''
     file_name = os.path.basename(connect_plugin_url)
-    download_file = "/tmp/" + file_name
-    log.info("download " + connect_plugin_url)
-    wget.download(connect_plugin_url, out=download_file)
-    s3_key = "msk-plugin/{}/".format(timestamp) + file_name
+    if connect_plugin_sha256:
+        return f"msk-plugin/sha256={connect_plugin_sha256}/{file_name}"
+    url_hash = hashlib.sha256(connect_plugin_url.encode('utf-8')).hexdigest()[:16]
+    return f"msk-plugin/url={url_hash}/{file_name}"
 
+
+def download_plugin_to_s3(s3_key):
+    if s3_transfer.exists(plugin_s3_bucket, s3_key):
+        log.info("plugin already in s3, skip download, s3_key=" + s3_key)
+        return s3_key
+
+    log.info("download " + connect_plugin_url)
+    metadata = {'source-url': connect_plugin_url}
+    if connect_plugin_sha256:
+        metadata['sha256'] = connect_plugin_sha256
     try:
-        s3.upload_file(download_file, plugin_s3_bucket, s3_key, ExtraArgs={
-            'ContentType': 'application/zip'
-        })
+        with urlopen(connect_plugin_url, timeout=60) as response:
+            reader = HashingReader(response)
+            s3_transfer.upload_stream(reader, plugin_s3_bucket, s3_key,
+                                      content_type='application/zip', metadata=metadata,
+                                      part_bytes=plugin_part_bytes,
+                                      concurrency=plugin_upload_concurrency)
     except ClientError as e:
-        logging.error(e)
+        log.error(e)
         raise e
-    finally:
-        os.remove(download_file)
+
+    checksum = reader.sha256.hexdigest()
+    log.info(f"plugin sha256: {checksum}")
+    if connect_plugin_sha256 and checksum != connect_plugin_sha256:
+        delete_obj(plugin_s3_bucket, s3_key)
+        raise Exception(
+            f"plugin checksum mismatch, expected: {connect_plugin_sha256}, actual: {checksum}")
     log.info("download_plugin_to_s3 done, s3_key=" + s3_key)
     return s3_key
 
 
+def find_active_plugin(custom_plugins, bucket_arn, s3_key):
+    '''
+    Find an ACTIVE plugin, possibly created by another stack, built from
+    the same plugin object.
+    '''
+    for custom_plugin in custom_plugins:
+        location = custom_plugin.get('latestRevision', {}).get(
+            'location', {}).get('s3Location', {})
+        if custom_plugin['customPluginState'] == 'ACTIVE' \
+                and location.get('bucketArn') == bucket_arn \
+                and location.get('fileKey') == s3_key:
+            return custom_plugin
+    return None
+
+
 def create_s3_sink_plugin(plugin_name):
-    list_plugin_res = client.list_custom_plugins(
-        maxResults=10,
-    )
-    log.info("find {} custom_plugins".format(
-        len(list_plugin_res['customPlugins'])))
-    my_custom_plugins = [custom_plugin for custom_plugin in list_plugin_res['customPlugins']
+    custom_plugins = list_custom_plugins()
+    log.info("find {} custom_plugins".format(len(custom_plugins)))
+    my_custom_plugins = [custom_plugin for custom_plugin in custom_plugins
                          if custom_plugin['name'] == plugin_name]
 
     if len(my_custom_plugins) > 0:
@@ -240,8 +433,18 @@ def create_s3_sink_plugin(plugin_name):
                 f"{plugin_name} already exists, State: {customPluginState}")
         return my_custom_plugins[0]['customPluginArn']
 
-    plugin_s3_key = download_plugin_to_s3()
+    plugin_s3_key = get_plugin_s3_key()
     plugin_bucket_arn = "arn:{}:s3:::{}".format(aws_partition, plugin_s3_bucket)
+    shared_plugin = find_active_plugin(
+        custom_plugins, plugin_bucket_arn, plugin_s3_key)
+    if shared_plugin:
+        log.info(f"reuse plugin {shared_plugin['name']}, s3_key={plugin_s3_key}")
+        # keeps it until this stack is deleted too
+        client.tag_resource(resourceArn=shared_plugin['customPluginArn'],
+                            tags={owner_tag(plugin_name): 'true'})
+        return shared_plugin['customPluginArn']
+
+    download_plugin_to_s3(plugin_s3_key)
     plugin_response = client.create_custom_plugin(
         contentType="ZIP",
         description=f"s3://{plugin_s3_bucket}/{plugin_s3_key}",
@@ -252,23 +455,24 @@ def create_s3_sink_plugin(plugin_name):
             }
         },
         name=plugin_name,
+        tags={owner_tag(plugin_name): 'true'},
     )
     plugin_arn = plugin_response["customPluginArn"]
-
-    while plugin_response["customPluginState"] != "ACTIVE":
-        log.info("customPluginState: {}".format(
-            plugin_response["customPluginState"]))
-        time.sleep(10)
-        plugin_response = client.describe_custom_plugin(
-            customPluginArn=plugin_arn)
-        if plugin_response["customPluginState"] == "CREATE_FAILED":
-            log.error("Plugin failed to activate")
-            raise Exception("Plugin failed to activate")
-
-    log.info("Plugin created successfully, plugin_arn:" + plugin_arn)
+    log.info("Plugin created, plugin_arn:" + plugin_arn)
     return plugin_arn
 
 
+def is_plugin_active(plugin_arn):
+    plugin_response = client.describe_custom_plugin(
+        customPluginArn=plugin_arn)
+    customPluginState = plugin_response["customPluginState"]
+    log.info("customPluginState: {}".format(customPluginState))
+    if customPluginState == "CREATE_FAILED":
+        log.error("Plugin failed to activate")
+        raise Exception("Plugin failed to activate")
+    return customPluginState == "ACTIVE"
+
+
 def create_s3_connector(plugin_arn, connector_name):
     log.info("create_s3_connector() plugin_arn:" +
              plugin_arn + ", connector_name:" + connector_name)
@@ -285,7 +489,7 @@ def create_s3_connector(plugin_arn, connector_name):
         capacity={
             'autoScaling': {
                 'maxWorkerCount': maxWorkerCount,
-                'mcuCount': 1,
+                'mcuCount': mcuCount,
                 'minWorkerCount': minWorkerCount,
                 'scaleInPolicy': {
                     'cpuUtilizationPercentage': 20
@@ -328,25 +532,6 @@ def create_s3_connector(plugin_arn, connector_name):
 
     connectorArn = connector_response['connectorArn']
     log.info(f"connectorArn={connectorArn}")
-    # 'connectorState': 'RUNNING'|'CREATING'|'UPDATING'|'DELETING'|'FAILED',
-    n = 0
-    while True:
-        time.sleep(20)
-        response = client.describe_connector(connectorArn=connectorArn)
-        connectorState = response['connectorState']
-        log.info(f"connectorState: {connectorState},  n={n}")
-
-        if connectorState == 'RUNNING':
-            log.info("Connector created successfully and is running")
-            break
-        if connectorState == 'FAILED':
-            raise Exception('connectorState FAILED')
-        # wait at most 10 mins, if not failed.
-        if n > 30:
-            log.info("wait too long, break")
-            break
-        n = n + 1
-
     return connectorArn
 
 
@@ -365,39 +550,113 @@ def update_s3_connector(connector_arn):
     log.info(
         f"connectorState: {connectorState}, currentVersion: {currentVersion}")
 
-    update_res = client.update_connector(
-        capacity={
-            'autoScaling': {
-                'maxWorkerCount': maxWorkerCount,
-                'mcuCount': mcuCount,
-                'minWorkerCount': minWorkerCount,
-                'scaleInPolicy': {
-                    'cpuUtilizationPercentage': 20
-                },
-                'scaleOutPolicy': {
-                    'cpuUtilizationPercentage': 80
-                }
+    capacity = {
+        'autoScaling': {
+            'maxWorkerCount': maxWorkerCount,
+            'mcuCount': mcuCount,
+            'minWorkerCount': minWorkerCount,
+            'scaleInPolicy': {
+                'cpuUtilizationPercentage': 20
+            },
+            'scaleOutPolicy': {
+                'cpuUtilizationPercentage': 80
             }
-        },
-        connectorArn=connector_arn,
-        currentVersion=currentVersion
-    )
+        }
+    }
+    try:
+        client.update_connector(
+            capacity=capacity,
+            connectorConfiguration=getConnectorConfiguration(),
+            connectorArn=connector_arn,
+            currentVersion=currentVersion
+        )
+    except ParamValidationError as e:
+        # older boto3 can only update the capacity
+        log.warning(f"can not update connectorConfiguration: {repr(e)}")
+        client.update_connector(
+            capacity=capacity,
+            connectorArn=connector_arn,
+            currentVersion=currentVersion
+        )
+
+
+def getProfileSettings():
+    '''
+    Resolve the connector profile into tasks.max, flush.size,
+    rotate.interval.ms, format and compression, explicit
+    MSK_S3_CONNECTOR_* environment variables win over the profile.
+    '''
+    if connector_profile not in connector_profiles:
+        raise Exception(f"unknown connector profile: {connector_profile}")
+    profile = dict(connector_profiles[connector_profile])
+
+    if 'tasks_per_mcu' in profile:
+        tasks_max = maxWorkerCount * mcuCount * profile['tasks_per_mcu']
+        if topic_partitions > 0:
+            # a task without a partition is idle
+            tasks_max = min(tasks_max, topic_partitions)
+        profile['tasks_max'] = tasks_max
+    if 'target_object_mb' in profile:
+        ratio = compression_ratios.get(profile['compression'], 1)
+        profile['flush_size'] = profile['target_object_mb'] * 1024 * 1024 * ratio // avg_record_bytes
+
+    overrides = {
+        'tasks_max': os.environ.get('MSK_S3_CONNECTOR_TASKS_MAX'),
+        'flush_size': os.environ.get('MSK_S3_CONNECTOR_FLUSH_SIZE'),
+        'rotate_interval_ms': os.environ.get('MSK_S3_CONNECTOR_ROTATE_INTERVAL_MS'),
+        'format': os.environ.get('MSK_S3_CONNECTOR_FORMAT'),
+        'compression': os.environ.get('MSK_S3_CONNECTOR_COMPRESSION'),
+    }
+    profile.update({k: v for k, v in overrides.items() if v})
+    for k in ['tasks_max', 'flush_size', 'rotate_interval_ms']:
+        profile[k] = max(1, int(profile[k]))
+    return profile
+
+
+def getFormatConfiguration(output_format, compression):
+    if output_format not in format_classes:
+        raise Exception(f"unknown connector format: {output_format}")
+    configuration = {
+        "format.class": format_classes[output_format],
+    }
+    if output_format == 'json':
+        if compression not in ['gzip', 'none']:
+            raise Exception(f"json format does not support compression: {compression}")
+        configuration["s3.compression.type"] = compression
+        configuration["value.converter.schemas.enable"] = "false"
+    else:
+        # parquet and avro need records with a schema, the ingestion servers
+        # send plain json, without a schema every record would fail
+        if schema_source != 'envelope':
+            raise Exception(f"{output_format} format needs a schema source, "
+                            "set MSK_S3_CONNECTOR_SCHEMA_SOURCE=envelope once the "
+                            "producer sends the JsonConverter schema/payload envelope")
+        if output_format == 'parquet':
+            configuration["parquet.codec"] = compression
+        else:
+            avro_codecs = {'none': 'null', 'gzip': 'deflate', 'snappy': 'snappy', 'zstd': 'zstandard'}
+            if compression not in avro_codecs:
+                raise Exception(f"avro format does not support compression: {compression}")
+            configuration["avro.codec"] = avro_codecs[compression]
+        configuration["value.converter.schemas.enable"] = "true"
+    return configuration
+
 
 def getConnectorConfiguration():
     # https://docs.confluent.io/kafka-connectors/s3-sink/current/overview.html#amazon-s3-sink-connector-for-cp
     # https://docs.confluent.io/kafka-connectors/s3-sink/current/configuration_options.html#connector
+    profile = getProfileSettings()
+    log.info(f"connector profile: {connector_profile}, settings: {profile}")
     configuration =  {
         "connector.class": "io.confluent.connect.s3.S3SinkConnector",
-        "tasks.max": "2",
+        "tasks.max": str(profile['tasks_max']),
         "topics": f"{msk_topic}",
         "s3.region": aws_region,
         "s3.bucket.name": sink_s3_bucket,
         "topics.dir": sink_s3_obj_prefix,
-        "flush.size": "10000",
-        "rotate.interval.ms": "30000",
-        "s3.compression.type": "gzip",
+        "flush.size": str(profile['flush_size']),
+        "rotate.interval.ms": str(profile['rotate_interval_ms']),
         "storage.class": "io.confluent.connect.s3.storage.S3Storage",
-        "format.class": "io.confluent.connect.s3.format.json.JsonFormat",
         "partitioner.class": "io.confluent.connect.storage.partitioner.TimeBasedPartitioner",
         "path.format": "'year'=YYYY/'month'=MM/'day'=dd/'hour'=HH",
         "partition.duration.ms": "60000",
@@ -405,9 +664,9 @@ def getConnectorConfiguration():
         "locale": "en-US",
         "key.converter": "org.apache.kafka.connect.storage.StringConverter",
         "value.converter" : "org.apache.kafka.connect.json.JsonConverter",
-        "value.converter.schemas.enable": "false",
         "schema.compatibility": "NONE",
         "errors.log.enable": "true",
     }
+    configuration.update(getFormatConfiguration(profile['format'], profile['compression']))
     log.info(f"ConnectorConfiguration:{configuration}")
-    return configuration
\ No newline at end of file
+    return configuration
@@ -1,12 +1,15 @@
+from lambda_common import get_logger, track_cold_start, profiled
 import os
+import sys
+import math
 import time
 import logging
+import json
 from kafka import KafkaAdminClient
-from kafka.admin import NewTopic
+from kafka.admin import NewTopic, NewPartitions, ConfigResource, ConfigResourceType
 from kafka.errors import TopicAlreadyExistsError
 
-log = logging.getLogger()
-log.setLevel('INFO')
+log = get_logger()
 aws_region = os.environ['AWS_REGION']
 timestamp = str(int(time.time()))
 
@@ -18,7 +21,34 @@ msk_topic_partitions = os.environ.get('MSK_TOPIC_PARTITIONS', 10)
 msk_topic_replication_factor = os.environ.get(
     'MSK_TOPIC_REPLICATION_FACTOR', min(replication_factor, 3))
 
+# partition planning, the topic gets enough partitions to carry the target
+# ingest rate, never less than MSK_TOPIC_PARTITIONS. A new topic is rounded
+# up to a multiple of the broker count, an existing one only grows to the
+# planned count.
+target_ingest_mb_per_sec = float(
+    os.environ.get('MSK_TOPIC_TARGET_MB_PER_SEC', '0'))
+partition_mb_per_sec = float(
+    os.environ.get('MSK_TOPIC_PARTITION_MB_PER_SEC', '5'))
+max_partitions_per_broker = int(
+    os.environ.get('MSK_MAX_PARTITIONS_PER_BROKER', '1000'))
 
+# throughput relevant topic configs, empty means broker default
+segment_bytes = os.environ.get('MSK_TOPIC_SEGMENT_BYTES', '')
+compression_type = os.environ.get('MSK_TOPIC_COMPRESSION_TYPE', 'producer')
+min_insync_replicas = os.environ.get('MSK_TOPIC_MIN_INSYNC_REPLICAS', '')
+
+# extra topics, a json list of
+#   {"name": "{topic}-dlq", "partitions": 3, "replicationFactor": 3, "configs": {...}}
+# "{topic}" is replaced with MSK_TOPIC, an entry named MSK_TOPIC overrides
+# the planned settings of the main topic.
+msk_topic_specs = os.environ.get('MSK_TOPIC_SPECS', '')
+
+# config_source of a topic override in DescribeConfigs v1+
+dynamic_topic_config = 1
+
+
+@track_cold_start
+@profiled
 def handler(event, context):
     RequestType = event.get('RequestType')
     log.info(f"RequestType={RequestType}")
@@ -27,28 +57,187 @@ def handler(event, context):
     log.info(f"replication_factor={replication_factor}")
     log.info(f"msk_topic_partitions={msk_topic_partitions}")
     log.info(f"msk_topic_replication_factor={msk_topic_replication_factor}")
+    log.info(f"target_ingest_mb_per_sec={target_ingest_mb_per_sec}")
+    log.info(f"msk_topic_specs={msk_topic_specs}")
 
-    if RequestType == 'Create':
-        create_msk_topic()
-    else:
+    if RequestType == 'Delete':
         log.info(f"Do nothing RequestType: {RequestType}")
+        return {"Data": {"topics": [msk_topic]}}
 
-    return {"Data": {"topics": [msk_topic]}}
-
-
-def create_msk_topic():
+    # one admin connection for all the topics
     admin_client = KafkaAdminClient(bootstrap_servers=msk_brokers)
     try:
-        res = admin_client.create_topics(
-            new_topics=[
+        broker_count = get_broker_count(admin_client)
+        specs = get_topic_specs(broker_count)
+        result = apply_topic_specs(admin_client, specs)
+    finally:
+        admin_client.close()
+
+    log.info(f"topics result: {result}")
+    # partitions of the main topic after the change, read by the S3 sink
+    # connector stack to cap tasks.max
+    return {"Data": {"topics": [spec['name'] for spec in specs], "brokers": broker_count,
+                     "partitions": result.pop('partitions')[msk_topic], **result}}
+
+
+def get_broker_count(admin_client):
+    return len(admin_client.describe_cluster()['brokers'])
+
+
+def plan_partitions(broker_count, rf):
+    '''
+    (partitions, create partitions): the count for the target ingest rate,
+    and the count of a new topic, rounded up to a multiple of the broker
+    count so that leaders are spread evenly. An existing topic is never
+    grown to the rounded count, a broker added later would grow it again.
+    '''
+    partitions = int(msk_topic_partitions)
+    if target_ingest_mb_per_sec > 0:
+        partitions = max(partitions, math.ceil(
+            target_ingest_mb_per_sec / partition_mb_per_sec))
+    if broker_count <= 0:
+        return partitions, partitions
+    # keep partition replicas per broker within the recommended limit
+    max_partitions = broker_count * max_partitions_per_broker // rf
+    create_partitions = math.ceil(partitions / broker_count) * broker_count
+    return min(partitions, max_partitions), min(create_partitions, max_partitions)
+
+
+def get_topic_configs(rf):
+    configs = {'compression.type': compression_type}
+    if segment_bytes:
+        configs['segment.bytes'] = segment_bytes
+    if min_insync_replicas:
+        configs['min.insync.replicas'] = min_insync_replicas
+    elif rf >= 3:
+        configs['min.insync.replicas'] = str(rf - 1)
+    return configs
+
+
+def get_topic_specs(broker_count):
+    rf = min(int(msk_topic_replication_factor), broker_count)
+    partitions, create_partitions = plan_partitions(broker_count, rf)
+    specs = {msk_topic: {
+        'name': msk_topic,
+        'partitions': partitions,
+        'createPartitions': create_partitions,
+        'replicationFactor': rf,
+        'configs': get_topic_configs(rf),
+    }}
+    for extra in json.loads(msk_topic_specs) if msk_topic_specs else []:
+        name = extra['name'].format(topic=msk_topic)
+        spec_rf = min(int(extra.get('replicationFactor', rf)), broker_count)
+        spec = specs.get(name, {
+            'name': name,
+            'partitions': 1,
+            'replicationFactor': spec_rf,
+            'configs': get_topic_configs(spec_rf),
+        })
+        if 'partitions' in extra:
+            spec['partitions'] = spec['createPartitions'] = int(extra['partitions'])
+        spec['replicationFactor'] = spec_rf
+        spec['configs'] = {**spec['configs'], **
+                           {k: str(v) for k, v in extra.get('configs', {}).items()}}
+        specs[name] = spec
+    return list(specs.values())
+
+
+def apply_topic_specs(admin_client, specs):
+    '''
+    Create the missing topics, expand the partitions (Kafka can not shrink
+    them) and alter the configs that differ, one batched request each.
+    AlterConfigs replaces all the overrides of a topic, the current ones
+    are sent along with the changed ones.
+    '''
+    names = [spec['name'] for spec in specs]
+    existing = {topic['topic']: topic for topic in admin_client.describe_topics(names)
+                if topic['error_code'] == 0}
+    new_specs = [spec for spec in specs if spec['name'] not in existing]
+    existing_specs = [spec for spec in specs if spec['name'] in existing]
+
+    created = []
+    if new_specs:
+        try:
+            res = admin_client.create_topics(new_topics=[
                 NewTopic(
-                    name=msk_topic,
-                    num_partitions=int(msk_topic_partitions),
-                    replication_factor=int(msk_topic_replication_factor)),
-            ])
-        log.info(f"created topics: {msk_topic}")
-        log.info(res)
-    except TopicAlreadyExistsError as e:
-        log.info("topic already exists.")
-        log.warning(repr(e))
-        return
+                    name=spec['name'],
+                    num_partitions=spec.get('createPartitions', spec['partitions']),
+                    replication_factor=spec['replicationFactor'],
+                    topic_configs=spec['configs'])
+                for spec in new_specs])
+            log.info(res)
+        except TopicAlreadyExistsError as e:
+            # created concurrently, the next Update diffs it
+            log.warning(repr(e))
+        created = [spec['name'] for spec in new_specs]
+        log.info(f"created topics: {created}")
+
+    altered = set()
+    expand = {}
+    partitions = {spec['name']: spec.get('createPartitions', spec['partitions']) for spec in new_specs}
+    for spec in existing_specs:
+        current_partitions = len(existing[spec['name']]['partitions'])
+        partitions[spec['name']] = max(current_partitions, spec['partitions'])
+        if spec['partitions'] > current_partitions:
+            expand[spec['name']] = NewPartitions(total_count=spec['partitions'])
+        elif spec['partitions'] < current_partitions:
+            log.warning(f"{spec['name']} has {current_partitions} partitions, can not shrink to {spec['partitions']}")
+    if expand:
+        admin_client.create_partitions(expand)
+        altered.update(expand.keys())
+        log.info(f"expanded partitions: { {k: v.total_count for k, v in expand.items()} }")
+
+    current_configs, overrides = describe_topic_configs(
+        admin_client, [spec['name'] for spec in existing_specs])
+    changed_specs = [spec for spec in existing_specs
+                     if any(current_configs.get(spec['name'], {}).get(k) != v
+                            for k, v in spec['configs'].items())]
+    if changed_specs:
+        admin_client.alter_configs([
+            ConfigResource(ConfigResourceType.TOPIC, spec['name'],
+                           configs={**overrides.get(spec['name'], {}), **spec['configs']})
+            for spec in changed_specs])
+        altered.update(spec['name'] for spec in changed_specs)
+        log.info(f"altered configs: {[spec['name'] for spec in changed_specs]}")
+
+    return {
+        "created": created,
+        "altered": [name for name in names if name in altered],
+        "unchanged": [spec['name'] for spec in existing_specs if spec['name'] not in altered],
+        "partitions": partitions,
+    }
+
+
+def describe_topic_configs(admin_client, names):
+    '''
+    ({topic: {name: value}}, {topic: {name: value of the topic overrides}})
+    '''
+    if not names:
+        return {}, {}
+    configs = {}
+    overrides = {}
+    responses = admin_client.describe_configs([
+        ConfigResource(ConfigResourceType.TOPIC, name) for name in names], include_synonyms=True)
+    for response in responses:
+        for resource in response.resources:
+            # (error_code, error_message, resource_type, resource_name, config_entries)
+            configs[resource[3]] = {entry[0]: entry[1] for entry in resource[4]}
+            overrides[resource[3]] = {entry[0]: entry[1] for entry in resource[4]
+                                      if config_source(entry) == dynamic_topic_config and entry[1] is not None}
+    return configs, overrides
+
+
+def config_source(entry):
+    # v2 entries have the config_source, v1 ones is_default and the synonyms
+    # in order of precedence, the first one is the value in effect
+    if not isinstance(entry[3], bool):
+        return entry[3]
+    synonyms = entry[5]
+    return synonyms[0][2] if synonyms else None
+
+
+if __name__ == '__main__':
+    # Run against a local Kafka stand-in, e.g.
+    #   PYTHONPATH=../../layer/python AWS_REGION=local MSK_BROKERS=localhost:9092 MSK_TOPIC=test python app.py Update
+    logging.basicConfig()
+    print(handler({'RequestType': sys.argv[1] if len(sys.argv) > 1 else 'Create'}, None))
@@ -1,47 +1,119 @@
-import boto3
+from lambda_common import lazy_client, get_logger, track_cold_start, profiled, custom_resource
 import os
-import logging
-import time
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-log = logging.getLogger()
-log.setLevel('INFO')
+log = get_logger()
 aws_region = os.environ['AWS_REGION']
 ecs_cluster_name = os.environ['ECS_CLUSTER_NAME']
 ecs_service = os.environ['ECS_SERVICE']
 ecs_task_name = os.environ['ECS_TASK_NAME']
 asg_name = os.environ['ASG_NAME']
 
-ecs_client = boto3.client('ecs')
-asg_client = boto3.client('autoscaling')
+ecs_client = lazy_client('ecs')
+asg_client = lazy_client('autoscaling')
+
+max_concurrency = 10
+# the Provider fails the stack delete after its 30 min totalTimeout, the
+# teardown gives up before and lets the stack delete finish
+delete_timeout_sec = 20 * 60
+
+
+def run_concurrently(fn, items):
+    items = list(items)
+    if len(items) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(items), max_concurrency)) as executor:
+        return list(executor.map(fn, items))
+
+
+class PhaseTimer:
+    '''
+    Records how long each teardown phase takes.
+    '''
+
+    def __init__(self, timings=None):
+        self.timings = dict(timings or {})
+
+    def run(self, phase, fn, *args):
+        start = time.time()
+        try:
+            return fn(*args)
+        finally:
+            self.timings[phase] = round(time.time() - start, 2)
+            log.info(f"phase {phase} took {self.timings[phase]}s")
+
+
+def get_data(error_message=None, timings=None):
+    return {
+        "cluster_name": ecs_cluster_name,
+        "deleted_service": ecs_service,
+        "autoscaling_group_name": asg_name,
+        "error_message": error_message,
+        "timings": timings or {},
+    }
 
 
-def handler(event, context):
+def start_delete(event):
     log.info("ecs_cluster_name:" + ecs_cluster_name)
     log.info("ecs_service:" + ecs_service)
-    log.info("ecs_task_name:" + ecs_service)
+    log.info("ecs_task_name:" + ecs_task_name)
     log.info("asg_name:" + asg_name)
-    RequestType = event.get('RequestType')
-    if RequestType != 'Delete':
-        return
-
+    timer = PhaseTimer()
+    # the ASG is deleted while ECS is drained
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        asg_future = executor.submit(timer.run, 'delete_asg', del_asg)
+        try:
+            timer.run('drain_service', update_service)
+        except Exception as e:
+            log.error(repr(e))
+        asg_future.result()
+    # the timings of the onEvent phases reach the checks in the event Data
+    return custom_resource.result(data=get_data(timings=timer.timings))
+
+
+def is_deleted(event):
+    '''
+    One step of the teardown per check, from the current state: wait for the
+    tasks to stop, delete the service, then the cluster once it is empty.
+    After delete_timeout_sec the error is reported and the delete completes.
+    The timings of the result are the onEvent phases, the delete_service and
+    delete_cluster calls of the checks that ran them, and delete_ecs, the
+    whole ECS teardown with the waits between the checks.
+    '''
+    timer = PhaseTimer(custom_resource.get_data(event).get('timings'))
     error_message = None
     try:
-        del_ecs_resource()
+        waiting_for = None
+        service = describe_service()
+        if service and service['status'] == 'ACTIVE':
+            log.info(
+                f"service runningCount: {service['runningCount']}, desiredCount: {service['desiredCount']}, pendingCount: {service['pendingCount']}")
+            if service['runningCount'] > 0:
+                stop_tasks()
+                waiting_for = f"{service['runningCount']} running tasks"
+            else:
+                timer.run('delete_service', delete_service)
+        if waiting_for is None and not timer.run('delete_cluster', del_cluster):
+            waiting_for = f"cluster {ecs_cluster_name} to be empty"
+        if waiting_for is not None:
+            if custom_resource.elapsed_sec(event) < delete_timeout_sec:
+                return None
+            error_message = f"timeout waiting for {waiting_for}"
+            log.error(error_message)
     except Exception as e:
         log.error(repr(e))
         error_message = repr(e)
+    timer.timings['delete_ecs'] = round(custom_resource.elapsed_sec(event), 2)
+    log.info(f"timings: {json.dumps(timer.timings)}")
+    return custom_resource.complete(get_data(error_message, timer.timings))
 
-    del_asg()
 
-    return {
-        "Data": {
-            "cluster_name": ecs_cluster_name,
-            "deleted_service": ecs_service,
-            "autoscaling_group_name": asg_name,
-            "error_message": error_message
-        }
-    }
+handler = track_cold_start(profiled(custom_resource.provider_handler(
+    on_event={'Delete': start_delete},
+    is_complete={'Delete': is_deleted},
+    query_interval_sec=10, max_delay_sec=30)))
 
 
 def del_asg():
@@ -52,49 +124,48 @@ def del_asg():
             ForceDelete=True)
     except Exception as e:
         log.error(repr(e))
-    time.sleep(10)
 
 
-def del_ecs_resource():
-    log.info("del_ecs_resource ...")
+def describe_service():
     res = ecs_client.describe_services(
         cluster=ecs_cluster_name,
         services=[ecs_service])
-    status = res['services'][0]['status']
-    ecs_service_active = status != 'INACTIVE'
-    if ecs_service_active:
-        update_service()
-    delete_service()
-    del_cluster()
-    time.sleep(10)
+    return res['services'][0] if res['services'] else None
 
 
 def del_cluster():
-    log.info(f"delete_cluster ...")
+    log.info("delete_cluster ...")
     try:
-        log.info(f"list_container_instances ...")
-        res = ecs_client.list_container_instances(cluster=ecs_cluster_name)
-        containerInstanceArns = res['containerInstanceArns']
+        log.info("list_container_instances ...")
+        paginator = ecs_client.get_paginator('list_container_instances')
+        containerInstanceArns = [arn for page in paginator.paginate(cluster=ecs_cluster_name)
+                                 for arn in page['containerInstanceArns']]
         log.info(f"containerInstanceArns = {containerInstanceArns}")
-        log.info(f"deregister_container_instance ...")
+        log.info("deregister_container_instance ...")
         def deregister_instance(arn): return ecs_client.deregister_container_instance(
             cluster=ecs_cluster_name, containerInstance=arn, force=True)
-        [deregister_instance(arn) for arn in containerInstanceArns]
-        time.sleep(10)
-        ecs_client.delete_cluster(cluster=ecs_cluster_name)
+        run_concurrently(deregister_instance, containerInstanceArns)
+
+        try:
+            ecs_client.delete_cluster(cluster=ecs_cluster_name)
+            return True
+        except (ecs_client.exceptions.ClusterContainsContainerInstancesException,
+                ecs_client.exceptions.ClusterContainsServicesException,
+                ecs_client.exceptions.ClusterContainsTasksException) as e:
+            log.info(repr(e))
+            return False
     except ecs_client.exceptions.ClusterNotFoundException as e:
         log.error(repr(e))
-        pass
+        return True
 
 
 def update_service():
     log.info(f"update_service {ecs_service}, set desiredCount=0")
     try:
-        res = ecs_client.update_service(
+        ecs_client.update_service(
             cluster=ecs_cluster_name,
             service=ecs_service,
             desiredCount=0)
-        time.sleep(15)
     except ecs_client.exceptions.ServiceNotActiveException as e:
         log.error(repr(e))
         return
@@ -102,32 +173,13 @@ def update_service():
     stop_tasks()
     show_tasks()
 
-    while True:
-        res = ecs_client.describe_services(
-            cluster=ecs_cluster_name,
-            services=[ecs_service])
-
-        runningCount = res['services'][0]['runningCount']
-        desiredCount = res['services'][0]['desiredCount']
-        pendingCount = res['services'][0]['pendingCount']
-        status = res['services'][0]['status']
-
-        log.info(
-            f"service status: {status}, runningCount: {runningCount}, desiredCount: {desiredCount}, pendingCount: {pendingCount}")
-        if runningCount == 0:
-            break
-        else:
-            time.sleep(20)
-    show_tasks()
-
 
 def stop_tasks():
-    log.info(f"stop_tasks ...")
+    log.info("stop_tasks ...")
     try:
-        res = ecs_client.list_tasks(
-            cluster=ecs_cluster_name,
-            serviceName=ecs_service)
-        taskArns = res['taskArns']
+        paginator = ecs_client.get_paginator('list_tasks')
+        taskArns = [arn for page in paginator.paginate(cluster=ecs_cluster_name, serviceName=ecs_service)
+                    for arn in page['taskArns']]
         log.info(f"find {len(taskArns)} tasks")
 
         def stop_task(task_arn): return ecs_client.stop_task(
@@ -135,7 +187,7 @@ def stop_tasks():
             task=task_arn,
             reason='stop by cloudformation custom resource')
 
-        [stop_task(arn) for arn in taskArns]
+        run_concurrently(stop_task, taskArns)
     except Exception as e:
         log.error(repr(e))
 
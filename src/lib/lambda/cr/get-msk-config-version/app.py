@@ -1,27 +1,38 @@
-import boto3
+from lambda_common import lazy_client, get_logger, track_cold_start, profiled, custom_resource
 import os
-import logging
-import time
 
-kafka = boto3.client('kafka')
+kafka = lazy_client('kafka')
 
-log = logging.getLogger()
-log.setLevel('INFO')
+log = get_logger()
 aws_region = os.environ['AWS_REGION']
 
 msk_config_arn = os.environ['MSK_CONFIG_ARN']
 
 
-def handler(event, context):
+def start(event):
     log.info("msk_config_arn:" + msk_config_arn)
-    RequestType = event.get('RequestType')
-    log.info("RequestType:" + RequestType)
-    if RequestType != 'Delete':
-        time.sleep(5) # add sleep here to wait the config ready.
+    return custom_resource.result(msk_config_arn)
+
+
+def is_config_ready(event):
+    # the configuration is not readable right after it is created
+    try:
         response = kafka.describe_configuration(
             Arn=msk_config_arn
         )
-        res = {"Data": {"version":  response['LatestRevision']['Revision']}}
-        log.info("return {}".format(res))
-        return res
-    return None
+    except kafka.exceptions.NotFoundException as e:
+        log.info(repr(e))
+        return None
+    state = response.get('State', 'ACTIVE')
+    log.info(f"configuration state: {state}")
+    if state != 'ACTIVE' or 'LatestRevision' not in response:
+        return None
+    res = {"version": response['LatestRevision']['Revision']}
+    log.info("return {}".format(res))
+    return custom_resource.complete(res)
+
+
+handler = track_cold_start(profiled(custom_resource.provider_handler(
+    on_event={'Create': start, 'Update': start},
+    is_complete={'Create': is_config_ready, 'Update': is_config_ready},
+    query_interval_sec=5, max_delay_sec=20)))
@@ -0,0 +1,142 @@
+'''
+Local harness for the cr/* custom resources.
+
+A CloudFormation event is sent through a resource handler the way the CDK
+Provider does it: on_event first, then is_complete with the on_event
+result merged in, polled until it completes or the timeout is reached.
+
+    PYTHONPATH=../layer/python AWS_REGION=us-east-1 \\
+        python harness.py get-msk-config-version Create --env MSK_CONFIG_ARN=arn:...
+    python harness.py delete-ecs-cluster Delete --physical-id my-cluster-cr \\
+        --env ECS_CLUSTER_NAME=c --env ECS_SERVICE=s --env ECS_TASK_NAME=t --env ASG_NAME=a
+
+Set AWS_ENDPOINT_URL to run against a moto server or LocalStack. The
+packages of the resource Pipfile have to be installed.
+'''
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import importlib.util
+
+cr_dir = os.path.dirname(os.path.abspath(__file__))
+layer_dir = os.path.join(cr_dir, '..', 'layer', 'python')
+
+
+class FakeContext:
+
+    def __init__(self, function_name, timeout_sec=900, region='us-east-1'):
+        self.function_name = function_name
+        self.invoked_function_arn = f"arn:aws:lambda:{region}:000000000000:function:{function_name}"
+        self.deadline = time.time() + timeout_sec
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.time()) * 1000)
+
+
+class ProviderError(Exception):
+    pass
+
+
+def make_event(request_type, properties=None, old_properties=None, physical_id=None,
+               stack_id=None, resource_type='Custom::Harness'):
+    region = os.environ.get('AWS_REGION', 'us-east-1')
+    stack_id = stack_id or (f"arn:aws:cloudformation:{region}:000000000000:stack/harness/"
+                            f"{uuid.uuid4()}")
+    event = {
+        'RequestType': request_type,
+        'ServiceToken': f"arn:aws:lambda:{region}:000000000000:function:harness-provider",
+        'ResponseURL': 'http://localhost/',
+        'StackId': stack_id,
+        'RequestId': str(uuid.uuid4()),
+        'LogicalResourceId': 'HarnessResource',
+        'ResourceType': resource_type,
+        'ResourceProperties': {'ServiceToken': 'harness', **(properties or {})},
+    }
+    if request_type != 'Create':
+        event['PhysicalResourceId'] = physical_id or 'harness-physical-id'
+    if request_type == 'Update':
+        event['OldResourceProperties'] = {'ServiceToken': 'harness', **(old_properties or {})}
+    return event
+
+
+def simulate(handler, event, interval_sec=10, timeout_sec=1800, context=None):
+    '''
+    Returns the response the Provider would send to CloudFormation and the
+    number of is_complete calls.
+    '''
+    context = context or FakeContext('harness')
+    result = handler(event, context) or {}
+    physical_id = result.get('PhysicalResourceId') or event.get('PhysicalResourceId') or event['RequestId']
+    if event['RequestType'] == 'Delete' and physical_id != event['PhysicalResourceId']:
+        raise ProviderError('DELETE: cannot change the physical resource ID')
+    if event['RequestType'] == 'Update' and physical_id != event['PhysicalResourceId']:
+        print(f"physical id changed, CloudFormation sends a Delete for {event['PhysicalResourceId']}",
+              file=sys.stderr)
+
+    complete_event = {**event, **result, 'PhysicalResourceId': physical_id}
+    data = dict(result.get('Data') or {})
+    start = time.time()
+    polls = 0
+    while True:
+        polls += 1
+        res = handler(complete_event, context) or {}
+        if res.get('IsComplete'):
+            data.update(res.get('Data') or {})
+            break
+        if time.time() - start + interval_sec > timeout_sec:
+            raise ProviderError(f"timeout after {polls} is_complete calls")
+        time.sleep(interval_sec)
+    return {'Status': 'SUCCESS', 'PhysicalResourceId': physical_id, 'Data': data}, polls
+
+
+def load_handler(resource):
+    sys.path.insert(0, layer_dir)
+    path = os.path.join(cr_dir, resource, 'app.py')
+    spec = importlib.util.spec_from_file_location(f"cr_{resource.replace('-', '_')}", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module.handler
+
+
+def parse_pairs(pairs):
+    return dict(pair.split('=', 1) for pair in pairs or [])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('resource', help='directory of the resource, e.g. delete-ecs-cluster')
+    parser.add_argument('request_type', choices=['Create', 'Update', 'Delete'])
+    parser.add_argument('--property', action='append', help='ResourceProperties key=value')
+    parser.add_argument('--old-property', action='append', help='OldResourceProperties key=value')
+    parser.add_argument('--physical-id')
+    parser.add_argument('--stack-id')
+    parser.add_argument('--env', action='append', help='environment of the function, KEY=value')
+    parser.add_argument('--interval', type=float, default=10, help='Provider queryInterval seconds')
+    parser.add_argument('--timeout', type=float, default=1800, help='Provider totalTimeout seconds')
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_REGION', 'us-east-1')
+    os.environ.update(parse_pairs(args.env))
+    handler = load_handler(args.resource)
+    event = make_event(args.request_type, parse_pairs(args.property), parse_pairs(args.old_property),
+                       args.physical_id, args.stack_id)
+    start = time.time()
+    try:
+        response, polls = simulate(handler, event, args.interval, args.timeout,
+                                   FakeContext(args.resource))
+    except Exception as e:
+        response, polls = {'Status': 'FAILED', 'Reason': repr(e)}, None
+    response['seconds'] = round(time.time() - start, 1)
+    response['isCompleteCalls'] = polls
+    print(json.dumps(response, indent=2, default=str))
+    if response['Status'] != 'SUCCESS':
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
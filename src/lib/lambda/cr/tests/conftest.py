@@ -0,0 +1,18 @@
+'''
+The custom resources run through harness.simulate, the way the CDK Provider
+calls them, against moto.
+
+    cd src/lib/lambda/cr && python -m pytest tests
+'''
+import os
+import sys
+
+cr_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [cr_dir, os.path.join(cr_dir, '..', 'layer', 'python')]
+
+os.environ.update({
+    'AWS_REGION': 'us-east-1',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'test',
+    'AWS_SECRET_ACCESS_KEY': 'test',
+})
@@ -0,0 +1,219 @@
+import os
+import importlib.util
+
+import pytest
+
+import harness
+
+stack_id = 'arn:aws:cloudformation:us-east-1:123456789012:stack/cs/0000-0000-0000-0000-abc'
+
+
+@pytest.fixture
+def load(monkeypatch):
+    def load(**env):
+        for name, value in {
+            'MSK_PLUGIN_S3_BUCKET': 'plugins', 'MSK_SINK_S3_BUCKET': 'sink', 'MSK_SINK_S3_PREFIX': 'raw',
+            'MSK_TOPIC': 'clicks', 'MSK_BROKERS': 'b1:9092', 'MSK_CLUSTER_NAME': 'cs-msk',
+            'MSK_CONNECTOR_ROLE_ARN': 'arn:aws:iam::123456789012:role/connector',
+            'MSK_SECURITY_GROUP_ID': 'sg-1', 'MSK_SUBNET_IDS': 'subnet-1,subnet-2', **env,
+        }.items():
+            monkeypatch.setenv(name, value)
+        path = os.path.join(harness.cr_dir, 'create-msk-s3-sink-connector', 'app.py')
+        spec = importlib.util.spec_from_file_location('cr_create_msk_s3_sink_connector', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    return load
+
+
+def test_without_a_profile_the_settings_stay_the_original_ones(load):
+    configuration = load(MSK_S3_CONNECTOR_WORKER_COUNT_MAX='3').getConnectorConfiguration()
+
+    assert configuration['tasks.max'] == '2'
+    assert configuration['flush.size'] == '10000'
+    assert configuration['rotate.interval.ms'] == '30000'
+    assert configuration['s3.compression.type'] == 'gzip'
+
+
+def test_profile_tasks_are_capped_by_the_partitions(load):
+    configuration = load(MSK_S3_CONNECTOR_PROFILE='large', MSK_S3_CONNECTOR_WORKER_COUNT_MAX='5',
+                         MSK_TOPIC_PARTITIONS='12').getConnectorConfiguration()
+
+    assert configuration['tasks.max'] == '12'
+    assert configuration['rotate.interval.ms'] == '60000'
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'avro'])
+def test_schema_formats_need_a_schema_source(load, output_format):
+    with pytest.raises(Exception, match='schema source'):
+        load(MSK_S3_CONNECTOR_FORMAT=output_format).getConnectorConfiguration()
+
+    configuration = load(MSK_S3_CONNECTOR_FORMAT=output_format, MSK_S3_CONNECTOR_COMPRESSION='zstd',
+                         MSK_S3_CONNECTOR_SCHEMA_SOURCE='envelope').getConnectorConfiguration()
+    assert configuration['value.converter.schemas.enable'] == 'true'
+
+
+class FakeConnect:
+    '''
+    kafkaconnect client with custom plugins {arn: plugin} and their tags.
+    '''
+
+    def __init__(self):
+        self.plugins = {}
+        self.tags = {}
+        self.connectors = []
+        self.deleted = []
+        self.calls = []
+
+    def add_plugin(self, name, file_key, tags=None):
+        arn = f"arn:aws:kafkaconnect:us-east-1:123456789012:custom-plugin/{name}/1"
+        self.plugins[arn] = {'customPluginArn': arn, 'name': name, 'customPluginState': 'ACTIVE',
+                             'latestRevision': {'location': {'s3Location': {
+                                 'bucketArn': 'arn:aws:s3:::plugins', 'fileKey': file_key}}}}
+        self.tags[arn] = dict(tags or {})
+        return arn
+
+    def get_paginator(self, operation):
+        pages = {'list_custom_plugins': [{'customPlugins': list(self.plugins.values())}],
+                 'list_connectors': [{'connectors': self.connectors}]}[operation]
+        return type('Paginator', (), {'paginate': lambda _: pages})()
+
+    def list_tags_for_resource(self, resourceArn):
+        return {'tags': dict(self.tags[resourceArn])}
+
+    def tag_resource(self, resourceArn, tags):
+        self.tags[resourceArn].update(tags)
+
+    def untag_resource(self, resourceArn, tagKeys):
+        for key in tagKeys:
+            self.tags[resourceArn].pop(key, None)
+
+    def delete_custom_plugin(self, customPluginArn):
+        self.deleted.append(customPluginArn)
+        self.plugins.pop(customPluginArn)
+
+    def add_connector(self, name, state='RUNNING', next_state=None):
+        arn = f"arn:aws:kafkaconnect:us-east-1:123456789012:connector/{name}/1"
+        self.connectors.append({'connectorArn': arn, 'connectorName': name, 'connectorState': state,
+                                **({'next': next_state} if next_state else {})})
+        return arn
+
+    def list_connectors(self, connectorNamePrefix, maxResults):
+        # a change started by the previous call is done by the next one
+        self.connectors = [dict(c, connectorState=c.pop('next', c['connectorState']))
+                           for c in self.connectors if c.get('next') != 'DELETED']
+        return {'connectors': [dict(c) for c in self.connectors
+                               if c['connectorName'].startswith(connectorNamePrefix)]}
+
+    def change(self, operation, connectorArn, state, next_state):
+        self.calls.append((operation, connectorArn))
+        connector = next(c for c in self.connectors if c['connectorArn'] == connectorArn)
+        connector.update(connectorState=state, next=next_state)
+        return {'connectorState': state}
+
+    def delete_connector(self, connectorArn):
+        return self.change('delete', connectorArn, 'DELETING', 'DELETED')
+
+    def describe_connector(self, connectorArn):
+        return {'connectorState': 'RUNNING', 'currentVersion': '1'}
+
+    def update_connector(self, connectorArn, **kwargs):
+        return self.change('update', connectorArn, 'UPDATING', self.update_result)
+
+
+@pytest.fixture
+def shared(load):
+    module = load()
+    module.client = FakeConnect()
+    arn = module.client.add_plugin('stack-a-plugin', module.get_plugin_s3_key(),
+                                   {'owner:stack-a-plugin': 'true'})
+    assert module.create_s3_sink_plugin('stack-b-plugin') == arn
+    return module, arn
+
+
+def test_shared_plugin_is_kept_while_another_stack_owns_it(shared):
+    module, arn = shared
+
+    assert module.delete_plugins('stack-a-plugin') == []
+
+    assert module.client.deleted == []
+    assert module.client.tags[arn] == {'owner:stack-b-plugin': 'true'}
+
+
+def test_last_owner_deletes_the_shared_plugin(shared):
+    module, arn = shared
+    module.delete_plugins('stack-a-plugin')
+
+    module.delete_plugins('stack-b-plugin')
+
+    assert module.client.deleted == [arn]
+
+
+def test_untagged_plugin_of_the_stack_is_deleted(load):
+    module = load()
+    module.client = FakeConnect()
+    arn = module.client.add_plugin('stack-a-plugin', 'msk-plugin/old.zip')
+
+    assert [p['customPluginArn'] for p in module.delete_plugins('stack-a-plugin')] == [arn]
+    assert module.client.deleted == [arn]
+
+
+@pytest.fixture
+def stack(load):
+    module = load(MSK_CLUSTER_NAME='cs-msk')
+    module.client = FakeConnect()
+    module.client.update_result = 'RUNNING'
+    return module, module.client
+
+
+def test_delete_removes_every_connector_then_the_plugin(stack):
+    module, connect = stack
+    running = connect.add_connector('cs-mskabc-s3-sink-connector')
+    connect.add_connector('cs-mskabc-s3-sink-connector-2', 'DELETING', 'DELETED')
+    other = connect.add_connector('cs-mskxyz-s3-sink-connector')
+    plugin = connect.add_plugin('cs-mskabc-connector-s3-plugin', 'msk-plugin/a.zip')
+
+    response, polls = harness.simulate(
+        module.handler, harness.make_event('Delete', stack_id=stack_id), interval_sec=0)
+
+    assert response['Status'] == 'SUCCESS'
+    # the one already deleting is not deleted again
+    assert connect.calls == [('delete', running)]
+    assert [c['connectorArn'] for c in connect.connectors] == [other]
+    assert connect.deleted == [plugin]
+
+
+def test_delete_gives_up_on_a_stuck_plugin_after_the_deadline(stack):
+    module, connect = stack
+    stuck = connect.add_plugin('cs-mskabc-connector-s3-plugin', 'msk-plugin/a.zip')
+    connect.plugins[stuck]['customPluginState'] = 'DELETING'
+    event = harness.make_event('Delete', stack_id=stack_id)
+
+    with pytest.raises(harness.ProviderError):
+        harness.simulate(module.handler, event, interval_sec=0.01, timeout_sec=0.1)
+
+    module.plugin_delete_timeout_sec = 0
+    response, polls = harness.simulate(module.handler, event, interval_sec=0)
+    assert response['Status'] == 'SUCCESS'
+
+
+def test_update_waits_for_every_connector(stack):
+    module, connect = stack
+    arns = [connect.add_connector(f"cs-mskabc-s3-sink-connector-{n}") for n in range(3)]
+
+    response, polls = harness.simulate(
+        module.handler, harness.make_event('Update', stack_id=stack_id), interval_sec=0)
+
+    assert response['Status'] == 'SUCCESS'
+    assert sorted(connect.calls) == [('update', arn) for arn in arns]
+    assert {c['connectorState'] for c in connect.connectors} == {'RUNNING'}
+
+
+def test_update_fails_with_a_failed_connector(stack):
+    module, connect = stack
+    connect.update_result = 'FAILED'
+    connect.add_connector('cs-mskabc-s3-sink-connector')
+
+    with pytest.raises(Exception, match='FAILED'):
+        harness.simulate(module.handler, harness.make_event('Update', stack_id=stack_id),
+                         interval_sec=0)
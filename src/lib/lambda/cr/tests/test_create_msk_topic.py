@@ -0,0 +1,154 @@
+import os
+import json
+import importlib.util
+from types import SimpleNamespace
+
+import pytest
+
+import harness
+
+
+class FakeAdmin:
+    '''
+    KafkaAdminClient of a cluster, topics {name: {"partitions", "overrides"}}.
+    '''
+
+    def __init__(self, brokers, topics=None):
+        self.brokers = brokers
+        self.topics = topics or {}
+        self.altered = []
+        self.requests = []
+
+    def __call__(self, **kwargs):
+        return self
+
+    def describe_cluster(self):
+        return {'brokers': [{'node_id': i} for i in range(self.brokers)]}
+
+    def describe_topics(self, names):
+        return [{'topic': name, 'error_code': 0 if name in self.topics else 3,
+                 'partitions': list(range(self.topics[name]['partitions'])) if name in self.topics else []}
+                for name in names]
+
+    def create_topics(self, new_topics):
+        self.requests.append(('create_topics', sorted(topic.name for topic in new_topics)))
+        for topic in new_topics:
+            self.topics[topic.name] = {'partitions': topic.num_partitions, 'overrides': dict(topic.topic_configs)}
+
+    def create_partitions(self, expand):
+        self.requests.append(('create_partitions', sorted(expand)))
+        for name, new_partitions in expand.items():
+            self.topics[name]['partitions'] = new_partitions.total_count
+
+    def describe_configs(self, resources, include_synonyms=False):
+        # DescribeConfigs v1 entries, source 1 is a topic override, 5 the default
+        def entry(name, value, source):
+            return (name, value, False, source != 1, False, [(name, value, source)])
+        defaults = {'compression.type': 'producer', 'retention.ms': '604800000', 'cleanup.policy': 'delete',
+                    'min.insync.replicas': '1'}
+        return [SimpleNamespace(resources=[
+            (0, None, 2, resource.name,
+             [entry(name, self.topics[resource.name]['overrides'].get(name, value),
+                    1 if name in self.topics[resource.name]['overrides'] else 5)
+              for name, value in defaults.items()])
+            for resource in resources])]
+
+    def alter_configs(self, resources):
+        self.requests.append(('alter_configs', sorted(resource.name for resource in resources)))
+        # AlterConfigs replaces all the overrides
+        for resource in resources:
+            self.altered.append(resource.name)
+            self.topics[resource.name]['overrides'] = dict(resource.configs)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def load(monkeypatch):
+    def load(**env):
+        for name, value in {'MSK_TOPIC': 'clicks', 'MSK_BROKERS': 'b1:9092,b2:9092,b3:9092', **env}.items():
+            monkeypatch.setenv(name, value)
+        path = os.path.join(harness.cr_dir, 'create-msk-topic', 'app.py')
+        spec = importlib.util.spec_from_file_location('cr_create_msk_topic', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    return load
+
+
+def run(module, admin, request_type):
+    module.KafkaAdminClient = admin
+    return module.handler({'RequestType': request_type}, None)['Data']
+
+
+def test_create_rounds_up_to_the_brokers(load):
+    admin = FakeAdmin(3)
+
+    data = run(load(MSK_TOPIC_PARTITIONS='10'), admin, 'Create')
+
+    assert admin.topics['clicks']['partitions'] == 12
+    assert data['partitions'] == 12
+
+
+def test_update_does_not_grow_to_the_brokers(load):
+    admin = FakeAdmin(3, {'clicks': {'partitions': 10, 'overrides': {
+        'compression.type': 'producer', 'min.insync.replicas': '2'}}})
+
+    data = run(load(MSK_TOPIC_PARTITIONS='10'), admin, 'Update')
+
+    assert admin.topics['clicks']['partitions'] == 10
+    assert data['partitions'] == 10
+    assert data['unchanged'] == ['clicks']
+
+
+def test_update_grows_to_the_planned_count(load):
+    admin = FakeAdmin(3, {'clicks': {'partitions': 10, 'overrides': {
+        'compression.type': 'producer', 'min.insync.replicas': '2'}}})
+
+    data = run(load(MSK_TOPIC_PARTITIONS='14'), admin, 'Update')
+
+    assert admin.topics['clicks']['partitions'] == 14
+    assert data['partitions'] == 14
+
+
+def test_config_change_keeps_the_other_overrides(load):
+    admin = FakeAdmin(3, {'clicks': {'partitions': 12, 'overrides': {
+        'compression.type': 'producer', 'retention.ms': '3600000'}}})
+
+    run(load(MSK_TOPIC_PARTITIONS='12', MSK_TOPIC_COMPRESSION_TYPE='zstd'), admin, 'Update')
+
+    assert admin.altered == ['clicks']
+    assert admin.topics['clicks']['overrides'] == {
+        'compression.type': 'zstd', 'min.insync.replicas': '2', 'retention.ms': '3600000'}
+
+
+def test_topic_specs_are_applied_in_one_request_each(load):
+    admin = FakeAdmin(3, {
+        'clicks': {'partitions': 12, 'overrides': {'compression.type': 'producer', 'min.insync.replicas': '2'}},
+        'clicks-retry': {'partitions': 3, 'overrides': {'compression.type': 'producer', 'min.insync.replicas': '2'}},
+        'clicks-audit': {'partitions': 3, 'overrides': {'compression.type': 'producer', 'min.insync.replicas': '2'}},
+    })
+    specs = [
+        {'name': '{topic}-dlq', 'partitions': 2, 'configs': {'retention.ms': 86400000}},
+        {'name': '{topic}-retry', 'partitions': 6, 'configs': {'retention.ms': 3600000}},
+        {'name': '{topic}-audit', 'partitions': 6},
+        {'name': '{topic}', 'configs': {'compression.type': 'zstd'}},
+    ]
+
+    data = run(load(MSK_TOPIC_PARTITIONS='12', MSK_TOPIC_SPECS=json.dumps(specs)), admin, 'Update')
+
+    assert admin.requests == [
+        ('create_topics', ['clicks-dlq']),
+        ('create_partitions', ['clicks-audit', 'clicks-retry']),
+        ('alter_configs', ['clicks', 'clicks-retry']),
+    ]
+    assert data['created'] == ['clicks-dlq']
+    assert data['altered'] == ['clicks', 'clicks-retry', 'clicks-audit']
+    assert data['partitions'] == 12
+    assert admin.topics['clicks-dlq'] == {
+        'partitions': 2, 'overrides': {'compression.type': 'producer', 'min.insync.replicas': '2',
+                                       'retention.ms': '86400000'}}
+    assert admin.topics['clicks-retry']['partitions'] == 6
+    assert admin.topics['clicks-retry']['overrides']['retention.ms'] == '3600000'
+    assert admin.topics['clicks']['overrides']['compression.type'] == 'zstd'
@@ -0,0 +1,62 @@
+import sys
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import harness
+
+env = {'ECS_CLUSTER_NAME': 'cs-cluster', 'ECS_SERVICE': 'cs-service',
+       'ECS_TASK_NAME': 'cs-task', 'ASG_NAME': 'cs-asg'}
+
+
+@pytest.fixture
+def resources(monkeypatch):
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    with mock_aws():
+        ecs = boto3.client('ecs')
+        ecs.create_cluster(clusterName=env['ECS_CLUSTER_NAME'])
+        ecs.register_task_definition(family=env['ECS_TASK_NAME'], containerDefinitions=[
+            {'name': 'server', 'image': 'nginx', 'memory': 128}])
+        ecs.create_service(cluster=env['ECS_CLUSTER_NAME'], serviceName=env['ECS_SERVICE'],
+                           taskDefinition=env['ECS_TASK_NAME'], desiredCount=0)
+        ec2 = boto3.client('ec2')
+        ec2.create_launch_template(LaunchTemplateName='cs-lt',
+                                   LaunchTemplateData={'ImageId': 'ami-12c6146b', 'InstanceType': 't3.micro'})
+        autoscaling = boto3.client('autoscaling')
+        autoscaling.create_auto_scaling_group(
+            AutoScalingGroupName=env['ASG_NAME'], MinSize=0, MaxSize=1, DesiredCapacity=0,
+            LaunchTemplate={'LaunchTemplateName': 'cs-lt'}, AvailabilityZones=['us-east-1a'])
+        yield ecs, autoscaling
+
+
+def test_delete_reports_the_phase_timings(resources):
+    ecs, autoscaling = resources
+    handler = harness.load_handler('delete-ecs-cluster')
+
+    response, polls = harness.simulate(
+        handler, harness.make_event('Delete', physical_id='cs-cluster-cr'), interval_sec=0)
+
+    assert response['Status'] == 'SUCCESS'
+    assert response['Data']['error_message'] is None
+    timings = response['Data']['timings']
+    assert {'delete_asg', 'drain_service', 'delete_service', 'delete_cluster', 'delete_ecs'} <= set(timings)
+    assert autoscaling.describe_auto_scaling_groups()['AutoScalingGroups'] == []
+    assert ecs.describe_clusters(clusters=[env['ECS_CLUSTER_NAME']])['clusters'][0]['status'] == 'INACTIVE'
+
+
+def test_stuck_tasks_do_not_fail_the_stack_delete(resources):
+    handler = harness.load_handler('delete-ecs-cluster')
+    module = sys.modules['cr_delete_ecs_cluster']
+    module.delete_timeout_sec = 0
+    # a task that never stops
+    module.describe_service = lambda: {'status': 'ACTIVE', 'runningCount': 1,
+                                       'desiredCount': 0, 'pendingCount': 0}
+
+    response, polls = harness.simulate(
+        handler, harness.make_event('Delete', physical_id='cs-cluster-cr'), interval_sec=0)
+
+    assert response['Status'] == 'SUCCESS'
+    assert polls == 1
+    assert response['Data']['error_message'] == 'timeout waiting for 1 running tasks'
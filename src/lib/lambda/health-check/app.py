@@ -1,49 +1,364 @@
+from lambda_common import lazy_client, get_logger, track_cold_start, profiled, env_int, env_float, env_str
 import os
-import logging
-from urllib.request import urlopen
+from urllib.request import urlopen, Request
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
 import time
-import boto3
+import json
+import gzip
+import math
+import uuid
+import random
+import socket
+from datetime import datetime, timezone
 
-log = logging.getLogger()
-log.setLevel('INFO')
+log = get_logger()
 aws_region = os.environ['AWS_REGION']
 topic_arn = os.environ['SNS_TOPIC_ARN']
-sns = boto3.client('sns', region_name=aws_region)
+sns = lazy_client('sns', region_name=aws_region)
+cloudwatch = lazy_client('cloudwatch', region_name=aws_region)
+s3 = lazy_client('s3', region_name=aws_region)
 
+probe_metric_namespace = env_str(
+    'PROBE_METRIC_NAMESPACE', 'ClickStream/IngestionProbe')
+probe_app_id = 'clickstream-probe'
+
+max_attempts = env_int('HEALTH_CHECK_MAX_ATTEMPTS', 10)
+check_timeout_sec = env_float('HEALTH_CHECK_TIMEOUT_SEC', 10)
+slow_threshold_sec = env_float('HEALTH_CHECK_SLOW_THRESHOLD_SEC', 3)
+backoff_base_sec = env_float('HEALTH_CHECK_BACKOFF_BASE_SEC', 1)
+backoff_max_sec = env_float('HEALTH_CHECK_BACKOFF_MAX_SEC', 20)
+# time kept back from the Lambda deadline to send the notification
+notify_reserve_sec = 5
+
+
+@track_cold_start
+@profiled
 def handler(event, context):
     url = event['serverUrl']
-    isOk = False
-    n = 0
-    while n < 10:
-        if (isServerUpAdnRunning(url)):
-            isOk = True
+    if 'probe' in event:
+        return runIngestionProbe(url, event['probe'] or {}, context)
+
+    deadline = time.time() + getRemainingSeconds(context) - notify_reserve_sec
+    state = 'DOWN'
+    detail = None
+    attempt = 0
+    while attempt < max_attempts:
+        timeout = min(check_timeout_sec, deadline - time.time())
+        if timeout <= 0:
+            break
+        state, detail = checkServerState(url, timeout)
+        if state in ('UP', 'DEGRADED'):
+            # the server answered, no point in retrying
+            break
+        attempt = attempt + 1
+        sleep = backoffDelay(attempt)
+        if time.time() + sleep >= deadline:
+            log.info('Server %s: deadline reached after %s attempts', url, attempt)
             break
-        time.sleep(6)
-        n = n + 1
-    if not isOk:
-        sendNotificationToSNS(url)
+        time.sleep(sleep)
+
+    if state == 'SLOW':
+        # no attempt got an answer, the server is as unreachable as when it
+        # refuses the connection
+        state = 'DOWN'
+        detail = f"{detail}, {attempt} attempts"
+
+    if state == 'DOWN':
+        sendNotificationToSNS(url, detail)
+    elif state == 'DEGRADED':
+        sendDegradedNotificationToSNS(url, detail)
+    return {'serverUrl': url, 'state': state, 'detail': detail}
+
+
+def getRemainingSeconds(context):
+    if context is None:
+        return max_attempts * (check_timeout_sec + backoff_max_sec)
+    return context.get_remaining_time_in_millis() / 1000
+
+
+def backoffDelay(attempt):
+    # exponential backoff with full jitter
+    return random.uniform(0, min(backoff_max_sec, backoff_base_sec * (2 ** attempt)))
 
 
-def isServerUpAdnRunning(url):
+def checkServerState(url, timeout):
+    '''
+    Returns (state, detail), state is one of:
+      UP       - HTTP 200 within slow_threshold_sec
+      DEGRADED - HTTP 200, but slower than slow_threshold_sec
+      SLOW     - no response within timeout, retried, DOWN if it is the last attempt
+      DOWN     - connection refused, DNS failure or non 200 status
+    '''
+    start = time.perf_counter()
     try:
-        with urlopen(url, timeout=10) as response:
-            if response.status == 200:
-                log.info('Server %s is up and running', url)
-                return True
-            else:
+        with urlopen(url, timeout=timeout) as response:
+            elapsed = time.perf_counter() - start
+            if response.status != 200:
                 log.error('Server %s is down, status: %s',
                           url, response.status)
-                return False
+                return 'DOWN', f"status: {response.status}"
     except Exception as error:
+        reason = getattr(error, 'reason', error)
+        if isinstance(reason, (socket.timeout, TimeoutError)):
+            log.error('Server %s did not respond within %ss', url, timeout)
+            return 'SLOW', f"no response within {timeout:.1f}s"
         log.error('Server %s is down, error: %s', url, str(error))
-        return False
+        return 'DOWN', f"error: {str(error)}"
 
+    if elapsed > slow_threshold_sec:
+        log.warning('Server %s is up but slow, response time: %.2fs', url, elapsed)
+        return 'DEGRADED', f"response time: {elapsed:.2f}s"
+    log.info('Server %s is up and running', url)
+    return 'UP', f"response time: {elapsed:.2f}s"
 
-def sendNotificationToSNS(url):
+
+def sendNotificationToSNS(url, detail=None):
     log.error('Server %s is down, sending notification to SNS', url)
     sns.publish(
         Subject="ClickStream ingestion server is down",
         TopicArn=topic_arn,
-        Message='Server ' + url + ' is down'
+        Message='Server ' + url + ' is down' + (', ' + detail if detail else '')
+    )
+    return
+
+
+def sendDegradedNotificationToSNS(url, detail):
+    log.warning('Server %s is degraded, sending notification to SNS', url)
+    sns.publish(
+        Subject="ClickStream ingestion server is degraded",
+        TopicArn=topic_arn,
+        Message='Server ' + url + ' is degraded, ' + detail
     )
     return
+
+
+## Ingestion probe
+def runIngestionProbe(url, probe, context=None):
+    '''
+    Post a burst of tagged synthetic events to the ingestion endpoint at a
+    target rate and measure how long the server takes to accept them.
+
+    probe: {
+        "count": 50,                # number of events to send
+        "rps": 10,                  # target send rate, requests per second
+        "timeoutSec": 5,            # per request timeout
+        "sinkS3Bucket": "...",      # optional, verify arrival in S3
+        "sinkS3Prefix": "...",      # parent of the year=/month=/day=/hour= partitions
+        "verifyTimeoutSec": 90,     # deadline for arrival in the sink
+        "publishMetrics": true
+    }
+
+    The arrival check also stops notify_reserve_sec before the end of the
+    invocation, so the result is still published.
+    '''
+    deadline = time.time() + getRemainingSeconds(context) - notify_reserve_sec
+    count = int(probe.get('count', 50))
+    rps = float(probe.get('rps', 10))
+    timeout = float(probe.get('timeoutSec', 5))
+    probe_id = str(uuid.uuid4())
+    probe_url = url + ('&' if '?' in url else '?') + urlencode({
+        'appId': probe.get('appId', probe_app_id),
+        'platform': 'Probe',
+    })
+    log.info(f"probe {probe_id}: send {count} events to {url} at {rps} rps")
+
+    started_at = time.time()
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, min(count, int(rps) * 2, 64))) as executor:
+        futures = []
+        for seq in range(count):
+            # open-loop schedule: a slow response does not delay later sends
+            delay = started_at + seq / rps - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(executor.submit(
+                postProbeEvent, probe_url, probe_id, seq, timeout))
+        results = [f.result() for f in futures]
+    finished_at = time.time()
+
+    latencies = sorted([r['latency'] for r in results if r['ok']])
+    accepted = len(latencies)
+    duration = max(finished_at - started_at, 0.001)
+    summary = {
+        'probeId': probe_id,
+        'serverUrl': url,
+        'sent': count,
+        'accepted': accepted,
+        'errors': count - accepted,
+        'durationSec': round(duration, 3),
+        'acceptedRps': round(accepted / duration, 2),
+        'acceptLatencyMs': {
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': percentile(latencies, 100),
+        },
+    }
+
+    if probe.get('sinkS3Bucket') and accepted > 0:
+        summary['sink'] = verifyArrivalInS3(
+            probe['sinkS3Bucket'],
+            probe.get('sinkS3Prefix', ''),
+            probe_id,
+            accepted,
+            started_at,
+            finished_at,
+            min(finished_at + float(probe.get('verifyTimeoutSec', 90)), deadline))
+
+    log.info(f"probe result: {json.dumps(summary)}")
+    if probe.get('publishMetrics', True):
+        publishProbeMetrics(url, summary)
+    return summary
+
+
+def postProbeEvent(url, probe_id, seq, timeout):
+    body = json.dumps({
+        'event_type': '_clickstream_probe',
+        'probe_id': probe_id,
+        'seq': seq,
+        'timestamp': int(time.time() * 1000),
+    }).encode('utf-8')
+    req = Request(url, data=body, method='POST',
+                  headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    try:
+        with urlopen(req, timeout=timeout) as response:
+            response.read()
+            ok = response.status == 200
+    except Exception as error:
+        log.warning('probe event %s failed: %s', seq, str(error))
+        ok = False
+    return {'ok': ok, 'latency': (time.perf_counter() - start) * 1000}
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    # nearest-rank percentile
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return round(sorted_values[index], 2)
+
+
+def iterObjectLines(bucket, key):
+    '''
+    Yield the lines of an object as they are read, gzip objects are
+    decompressed on the fly.
+    '''
+    body = s3.get_object(Bucket=bucket, Key=key)['Body']
+    try:
+        if key.endswith('.gz'):
+            with gzip.GzipFile(fileobj=body) as lines:
+                yield from lines
+        else:
+            yield from body.iter_lines()
+    finally:
+        body.close()
+
+
+def hourPrefixes(prefix, started_at, until):
+    '''
+    The hour partitions from started_at up to until (epoch seconds).
+    '''
+    hour = int(started_at) // 3600 * 3600
+    prefixes = []
+    while hour <= until:
+        prefixes.append(datetime.fromtimestamp(hour, timezone.utc).strftime(
+            f"{prefix}year=%Y/month=%m/day=%d/hour=%H/"))
+        hour += 3600
+    return prefixes
+
+
+def verifyArrivalInS3(bucket, prefix, probe_id, expected, started_at, finished_at, deadline):
+    '''
+    Poll the sink bucket for objects written after the probe started and
+    count the probe events found in them, until all of them have arrived or
+    the deadline (epoch seconds) expires. Objects are read line by line and
+    reading stops as soon as the last expected event is found.
+    '''
+    if prefix and not prefix.endswith('/'):
+        prefix = prefix + '/'
+    started = datetime.fromtimestamp(started_at, timezone.utc)
+    seen_keys = set()
+    arrived = 0
+    arrived_at = None
+    probe_tag = probe_id.encode('utf-8')
+    paginator = s3.get_paginator('list_objects_v2')
+    while arrived < expected and time.time() < deadline:
+        for hour_prefix in hourPrefixes(prefix, started_at, min(time.time(), deadline)):
+            for page in paginator.paginate(Bucket=bucket, Prefix=hour_prefix):
+                for obj in page.get('Contents', []):
+                    if arrived >= expected:
+                        break
+                    if obj['Key'] in seen_keys or obj['LastModified'] < started:
+                        continue
+                    seen_keys.add(obj['Key'])
+                    for line in iterObjectLines(bucket, obj['Key']):
+                        if probe_tag not in line:
+                            continue
+                        arrived = arrived + 1
+                        # an event arrived when the object holding it was written
+                        modified = obj['LastModified'].timestamp()
+                        arrived_at = max(arrived_at or modified, modified)
+                        if arrived >= expected:
+                            break
+        if arrived < expected:
+            time.sleep(min(10, max(0, deadline - time.time())))
+    log.info(f"probe {probe_id}: {arrived}/{expected} events arrived in s3://{bucket}/{prefix}")
+    return {
+        'expected': expected,
+        'arrived': arrived,
+        'complete': arrived >= expected,
+        'lagSec': round(arrived_at - finished_at, 3) if arrived_at else None,
+    }
+
+
+def publishProbeMetrics(url, summary):
+    dimensions = [{'Name': 'ServerUrl', 'Value': url}]
+    metrics = [
+        ('ProbeAcceptedRps', summary['acceptedRps'], 'Count/Second'),
+        ('ProbeErrors', summary['errors'], 'Count'),
+    ]
+    for p, value in summary['acceptLatencyMs'].items():
+        if value is not None:
+            metrics.append((f"ProbeAcceptLatency{p.upper()}", value, 'Milliseconds'))
+    sink = summary.get('sink')
+    if sink:
+        metrics.append(('ProbeSinkArrivedRatio',
+                        sink['arrived'] / sink['expected'] * 100, 'Percent'))
+        if sink['lagSec'] is not None:
+            metrics.append(('ProbeSinkLag', sink['lagSec'], 'Seconds'))
+
+    cloudwatch.put_metric_data(
+        Namespace=probe_metric_namespace,
+        MetricData=[{
+            'MetricName': name,
+            'Dimensions': dimensions,
+            'Value': value,
+            'Unit': unit,
+        } for name, value, unit in metrics])
+
+
+if __name__ == '__main__':
+    # Run a probe against a local HTTP stand-in of the ingestion server:
+    #   PYTHONPATH=../layer/python AWS_REGION=us-east-1 SNS_TOPIC_ARN=local python app.py
+    import logging
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    import threading
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    logging.basicConfig()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stand_in_url = f"http://127.0.0.1:{server.server_address[1]}/collect"
+    print(json.dumps(runIngestionProbe(stand_in_url, {
+        'count': 100, 'rps': 50, 'publishMetrics': False}), indent=2))
+    server.shutdown()
@@ -0,0 +1,57 @@
+'''
+app reads its configuration at import, the environment is set first.
+
+    cd src/lib/lambda/health-check && python -m pytest tests
+'''
+import os
+import sys
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+lambda_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [lambda_dir, os.path.join(lambda_dir, '..', 'layer', 'python')]
+
+os.environ.update({
+    'AWS_REGION': 'us-east-1',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'test',
+    'AWS_SECRET_ACCESS_KEY': 'test',
+    'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:alerts',
+})
+
+
+class FakeContext:
+
+    def __init__(self, timeout_sec):
+        self.deadline = time.time() + timeout_sec
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.time()) * 1000)
+
+
+@pytest.fixture
+def stand_in():
+    '''
+    Ingestion server stand-in, server.delay_sec delays every response.
+    '''
+    class Handler(BaseHTTPRequestHandler):
+        def respond(self):
+            time.sleep(server.delay_sec)
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self.send_response(200)
+            self.end_headers()
+
+        do_GET = do_POST = respond
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.delay_sec = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/collect"
+    yield server
+    server.shutdown()
@@ -0,0 +1,40 @@
+from unittest import mock
+
+import app
+from conftest import FakeContext
+
+
+def run(url, context_sec=20):
+    with mock.patch.object(app, 'sns') as sns, \
+            mock.patch.object(app, 'backoffDelay', return_value=0.01):
+        result = app.handler({'serverUrl': url}, FakeContext(context_sec))
+    return result, [call.kwargs['Subject'] for call in sns.publish.call_args_list]
+
+
+def test_timeout_on_every_attempt_is_down(stand_in, monkeypatch):
+    stand_in.delay_sec = 0.5
+    monkeypatch.setattr(app, 'check_timeout_sec', 0.1)
+    monkeypatch.setattr(app, 'max_attempts', 3)
+
+    result, subjects = run(stand_in.url)
+
+    assert result['state'] == 'DOWN'
+    assert result['detail'].endswith('3 attempts')
+    assert subjects == ['ClickStream ingestion server is down']
+
+
+def test_slow_answer_is_degraded(stand_in, monkeypatch):
+    stand_in.delay_sec = 0.3
+    monkeypatch.setattr(app, 'slow_threshold_sec', 0.1)
+
+    result, subjects = run(stand_in.url)
+
+    assert result['state'] == 'DEGRADED'
+    assert subjects == ['ClickStream ingestion server is degraded']
+
+
+def test_up(stand_in):
+    result, subjects = run(stand_in.url)
+
+    assert result['state'] == 'UP'
+    assert subjects == []
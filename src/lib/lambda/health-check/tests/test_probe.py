@@ -0,0 +1,53 @@
+import gzip
+import time
+from datetime import datetime, timezone
+
+from moto import mock_aws
+
+import app
+from conftest import FakeContext
+
+
+def test_sink_poll_ends_before_the_invocation(stand_in):
+    with mock_aws():
+        app.s3.create_bucket(Bucket='probe-sink')
+        context = FakeContext(app.notify_reserve_sec + 3)
+        start = time.time()
+
+        summary = app.runIngestionProbe(stand_in.url, {
+            'count': 5, 'rps': 50, 'sinkS3Bucket': 'probe-sink', 'sinkS3Prefix': 'raw',
+            'verifyTimeoutSec': 90, 'publishMetrics': False}, context)
+
+    assert summary['accepted'] == 5
+    assert summary['sink']['complete'] is False
+    assert time.time() - start < 4
+    assert context.get_remaining_time_in_millis() > 0
+
+
+def test_sink_poll_covers_every_hour_since_the_probe_started():
+    probe_id = 'probe-1'
+    started_at = time.time() - 2 * 3600
+    lines = '\n'.join(f'{{"probe":"{probe_id}","seq":{seq}}}' for seq in range(3))
+    with mock_aws():
+        app.s3.create_bucket(Bucket='probe-sink')
+        for at, name, body in [
+                (started_at, 'part.gz', gzip.compress(lines.encode())),
+                (started_at + 3600, 'part', b'{"probe":"other"}\n' + lines.encode()),
+                (time.time(), 'part', lines.encode())]:
+            hour = datetime.fromtimestamp(at, timezone.utc).strftime(
+                'year=%Y/month=%m/day=%d/hour=%H')
+            app.s3.put_object(Bucket='probe-sink', Key=f"raw/{hour}/{name}", Body=body)
+        read = []
+        iter_lines = app.iterObjectLines
+        app.iterObjectLines = lambda bucket, key: read.append(key) or iter_lines(bucket, key)
+        try:
+            result = app.verifyArrivalInS3(
+                'probe-sink', 'raw', probe_id, 5, started_at, started_at, time.time() + 5)
+        finally:
+            app.iterObjectLines = iter_lines
+
+    assert result['arrived'] == 5
+    assert result['complete'] is True
+    # the last expected event is in the second hour, the current one is not read
+    assert len(read) == 2
+    assert result['lagSec'] >= 2 * 3600 - 60
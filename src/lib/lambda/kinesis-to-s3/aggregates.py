@@ -0,0 +1,267 @@
+'''
+Hourly aggregates of the kinesis-to-s3 records.
+
+While a batch is processed the records are counted per dimension set:
+
+    {
+        "dimensions": [["appId"], ["appId", "data.event_type"]],
+        "userField": "data.user_id",
+        "precision": 12
+    }
+
+Each group keeps the event count, the byte total of the written lines and
+a HyperLogLog sketch of the distinct users. Every invocation writes one
+_agg-<id>.json.gz file into the raw hour partition (Athena skips files
+starting with "_"), compact_hour() merges them into _agg-rollup.json.gz:
+
+    python aggregates.py compact --bucket <bucket> --prefix <prefix> \\
+        --partition year=2024/month=01/day=02/hour=03
+'''
+import math
+import gzip
+import json
+import base64
+import hashlib
+import argparse
+import logging
+
+log = logging.getLogger()
+
+aggregate_file_prefix = '_agg-'
+rollup_file_name = '_agg-rollup.json.gz'
+
+
+class HyperLogLog:
+
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = registers if registers is not None else bytearray(self.m)
+
+    @staticmethod
+    def hash(value):
+        return int.from_bytes(hashlib.blake2b(
+            str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+    def add_hash(self, h):
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('can not merge sketches of different precision')
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros > 0:
+            # linear counting for small cardinalities
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+    def to_str(self):
+        return base64.b64encode(bytes(self.registers)).decode('ascii')
+
+    @classmethod
+    def from_str(cls, precision, value):
+        return cls(precision, bytearray(base64.b64decode(value)))
+
+
+def split_path(path):
+    return tuple(path.split('.'))
+
+
+class Aggregator:
+    '''
+    Streaming counters per dimension set, add() is called once per record.
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.dimension_sets = [[split_path(p) for p in dimensions]
+                               for dimensions in config.get('dimensions', [])]
+        self.user_path = split_path(config['userField']) if config.get('userField') else None
+        self.precision = int(config.get('precision', 12))
+        self.set_names = [tuple('.'.join(path) for path in dimensions)
+                          for dimensions in self.dimension_sets]
+        # one dict per dimension set: values tuple -> [events, bytes, sketch]
+        self.groups = [{} for _ in self.dimension_sets]
+        self.sources = []
+
+    def get_value(self, record, path, parsed):
+        value = record
+        for i, name in enumerate(path):
+            if isinstance(value, str) and i > 0:
+                # JSON text of a top level field, like "data", parsed once per record
+                if path[:i] not in parsed:
+                    try:
+                        parsed[path[:i]] = json.loads(value)
+                    except ValueError:
+                        parsed[path[:i]] = None
+                value = parsed[path[:i]]
+            if not isinstance(value, dict):
+                return None
+            value = value.get(name)
+        return value if not isinstance(value, (dict, list)) else json.dumps(value)
+
+    def add(self, record, size):
+        if not isinstance(record, dict):
+            record = {}
+        parsed = {}
+        user_hash = None
+        if self.user_path is not None:
+            user = self.get_value(record, self.user_path, parsed)
+            if user is not None:
+                user_hash = HyperLogLog.hash(user)
+        for dimensions, groups in zip(self.dimension_sets, self.groups):
+            key = tuple(self.get_value(record, path, parsed) for path in dimensions)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = [0, 0, HyperLogLog(self.precision) if self.user_path else None]
+            group[0] += 1
+            group[1] += size
+            if user_hash is not None:
+                group[2].add_hash(user_hash)
+
+    def mismatch(self, data):
+        '''
+        Why an aggregate file written with another configuration can not be
+        merged, None when it can.
+        '''
+        if data.get('userField') != self.config.get('userField'):
+            return f"userField {data.get('userField')}, not {self.config.get('userField')}"
+        if self.user_path is not None and data.get('precision') != self.precision:
+            return f"precision {data.get('precision')}, not {self.precision}"
+        set_names = sorted(tuple(dimension_set['dimensions']) for dimension_set in data['sets'])
+        if set_names != sorted(self.set_names):
+            return f"dimension sets {set_names}, not {sorted(self.set_names)}"
+        return None
+
+    def merge(self, data):
+        '''
+        Merge the content of an aggregate file, the sets are matched by their
+        dimensions. Raises ValueError when the file does not match.
+        '''
+        reason = self.mismatch(data)
+        if reason is not None:
+            raise ValueError(f"can not merge an aggregate of {reason}")
+        for dimension_set in data['sets']:
+            groups = self.groups[self.set_names.index(tuple(dimension_set['dimensions']))]
+            for item in dimension_set['groups']:
+                key = tuple(item['dimensions'][name] for name in dimension_set['dimensions'])
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = [0, 0, HyperLogLog(self.precision) if self.user_path else None]
+                group[0] += item['events']
+                group[1] += item['bytes']
+                if group[2] is not None and item.get('hll'):
+                    group[2].merge(HyperLogLog.from_str(data['precision'], item['hll']))
+
+    def to_dict(self, partition):
+        return {
+            'partition': partition,
+            'userField': self.config.get('userField'),
+            'precision': self.precision,
+            'sources': self.sources,
+            'sets': [{
+                'dimensions': ['.'.join(path) for path in dimensions],
+                'groups': [{
+                    'dimensions': dict(zip(['.'.join(path) for path in dimensions], key)),
+                    'events': events,
+                    'bytes': size,
+                    'users': sketch.count() if sketch is not None else None,
+                    'hll': sketch.to_str() if sketch is not None else None,
+                } for key, (events, size, sketch) in groups.items()],
+            } for dimensions, groups in zip(self.dimension_sets, self.groups)],
+        }
+
+    def to_bytes(self, partition):
+        return gzip.compress(json.dumps(self.to_dict(partition)).encode('utf-8'))
+
+
+def read_aggregate(s3, bucket, key):
+    res = s3.get_object(Bucket=bucket, Key=key)
+    return json.loads(gzip.decompress(res['Body'].read())), res['ETag']
+
+
+def compact_hour(s3, bucket, prefix, partition):
+    '''
+    Merge the per invocation aggregate files of an hour partition into the
+    rollup. The rollup lists the files merged into it, they are skipped if
+    seen again, and it is written with a conditional put so that concurrent
+    compactions can not lose each other's files, the one that loses the race
+    fails and is simply run again. The merged files are deleted once the
+    rollup is stored. Files written with other dimension sets, user field
+    or precision than the rollup are left in place and returned in skipped.
+    '''
+    directory = f"{prefix}/{partition}/"
+    rollup_key = directory + rollup_file_name
+    paginator = s3.get_paginator('list_objects_v2')
+    keys = [obj['Key'] for page in paginator.paginate(Bucket=bucket, Prefix=directory + aggregate_file_prefix)
+            for obj in page.get('Contents', []) if obj['Key'] != rollup_key]
+
+    try:
+        rollup, etag = read_aggregate(s3, bucket, rollup_key)
+    except s3.exceptions.NoSuchKey:
+        rollup, etag = None, None
+
+    aggregator = None
+    merged = set(rollup['sources']) if rollup else set()
+    new_keys = [key for key in keys if key not in merged]
+    # files of another configuration, left in place
+    skipped = {}
+    for key in new_keys:
+        data, _ = read_aggregate(s3, bucket, key)
+        if aggregator is None:
+            # the dimensions of the rollup win over later configuration changes
+            first = rollup or data
+            aggregator = Aggregator({
+                'dimensions': [d['dimensions'] for d in first['sets']],
+                'userField': first['userField'], 'precision': first['precision']})
+            if rollup is not None:
+                aggregator.merge(rollup)
+                aggregator.sources = list(rollup['sources'])
+        reason = aggregator.mismatch(data)
+        if reason is not None:
+            log.warning(f"skip {key}, written with {reason}")
+            skipped[key] = reason
+            continue
+        aggregator.merge(data)
+        aggregator.sources.append(key)
+    new_keys = [key for key in new_keys if key not in skipped]
+
+    if new_keys:
+        condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+        s3.put_object(Bucket=bucket, Key=rollup_key, Body=aggregator.to_bytes(partition),
+                      ContentType='application/x-gzip', **condition)
+        log.info(f"compacted {len(new_keys)} aggregate files into s3://{bucket}/{rollup_key}")
+
+    # files merged before, left behind by an interrupted compaction, included
+    done = [key for key in keys if key in merged or key in new_keys]
+    for i in range(0, len(done), 1000):
+        s3.delete_objects(Bucket=bucket, Delete={
+            'Objects': [{'Key': key} for key in done[i:i + 1000]], 'Quiet': True})
+    return {'partition': partition, 'merged': len(new_keys), 'deleted': len(done), 'skipped': skipped}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['compact'])
+    parser.add_argument('--bucket', required=True)
+    parser.add_argument('--prefix', required=True)
+    parser.add_argument('--partition', required=True, action='append',
+                        help='year=YYYY/month=MM/day=DD/hour=HH, can be repeated')
+    parser.add_argument('--endpoint-url', help='S3 compatible endpoint, e.g. MinIO')
+    args = parser.parse_args()
+
+    import boto3
+    logging.basicConfig(level=logging.INFO)
+    s3 = boto3.client('s3', endpoint_url=args.endpoint_url)
+    for partition in args.partition:
+        print(json.dumps(compact_hour(s3, args.bucket, args.prefix.rstrip('/'), partition)))
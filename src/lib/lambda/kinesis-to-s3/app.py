@@ -1,16 +1,20 @@
-import boto3
+from lambda_common import lazy_client, get_logger, track_cold_start, profiled, s3_transfer, env_float, env_bool, env_str, env_int
 import os
-import logging
 import base64
 import json
 import uuid
 import gzip
-from datetime import datetime
+import zlib
+import hashlib
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+from projection import compile_stage
+from enrichment import compile_enrichment
+from aggregates import Aggregator, aggregate_file_prefix
 
-s3 = boto3.client('s3')
+s3 = lazy_client('s3')
 
-log = logging.getLogger()
-log.setLevel('INFO')
+log = get_logger()
 aws_region = os.environ['AWS_REGION']
 
 s3_bucket = os.environ['AWS_S3_BUCKET']
@@ -19,43 +23,345 @@ s3_prefix = os.environ['AWS_S3_PREFIX']
 if s3_prefix.endswith('/'):
     s3_prefix = s3_prefix[:-1]
 
+# a new object is started once the compressed size reaches the target
+target_object_bytes = int(env_float('AWS_S3_TARGET_OBJECT_MB', 64) * 1024 * 1024)
+compression_level = 6
+# one manifest per invocation, listing the objects it wrote, so that
+# loaders do not have to LIST the hour partitions. The "_" prefix keeps it
+# out of Athena/Glue tables defined on s3_prefix.
+write_manifest_enabled = env_bool('AWS_S3_WRITE_MANIFEST', True)
+manifest_prefix = env_str('AWS_S3_MANIFEST_PREFIX', f"{s3_prefix}/_manifest").rstrip('/')
 
+# per shard index of the objects written, consumers read the objects after
+# their last checkpoint instead of rescanning the hour partitions
+checkpoint_prefix = env_str('AWS_S3_CHECKPOINT_PREFIX', f"{s3_prefix}/_checkpoint").rstrip('/')
+checkpoint_max_entries = env_int('AWS_S3_CHECKPOINT_MAX_ENTRIES', 500)
+# skip the records of a retried batch the checkpoint shows as written, this
+# relies on the shard being read in order (ParallelizationFactor 1)
+skip_checkpointed = env_bool('AWS_S3_SKIP_CHECKPOINTED', True)
+
+# sampling, field projection and enrichment, see projection.py and enrichment.py
+record_projection = compile_stage(
+    json.loads(env_str('RECORD_PROJECTION', '{}')),
+    enrich=compile_enrichment(json.loads(env_str('RECORD_ENRICHMENT', '{}'))))
+
+# hourly counters written next to the raw objects, see aggregates.py
+aggregate_config = json.loads(env_str('RECORD_AGGREGATES', '{}'))
+
+
+@track_cold_start
+@profiled
 def handler(event, context):
-    partition = datetime.utcnow().strftime('year=%Y/month=%m/day=%d/hour=%H')
-    lines = [process(record) for record in event['Records']]
-    lines = [line for line in lines if line is not None]
-    log.info("get records count: {}".format(len(lines)))
-    if (len(lines) == 0):
+    # keys only depend on the batch: a retry of the batch, even in a later
+    # hour, writes the same keys
+    partition = get_partition(event['Records'])
+    aggregator = Aggregator(aggregate_config) if aggregate_config.get('dimensions') else None
+    objects = []
+    records_count = 0
+    checkpoints = []
+    for (stream_name, shard_id), records in group_by_shard(event['Records']).items():
+        written = []
+        if skip_checkpointed:
+            records, written = skip_written_records(stream_name, shard_id, records, aggregator)
+        writer = ObjectWriter(partition, shard_id=shard_id)
+        for record in records:
+            line = process(record, aggregator)
+            if line is not None:
+                writer.add(line, record['kinesis'].get('approximateArrivalTimestamp'),
+                           record['kinesis']['sequenceNumber'])
+        shard_objects = writer.close()
+        records_count += writer.total_records
+        if shard_objects:
+            checkpoints.append((stream_name, shard_id, shard_objects))
+        objects.extend(written + shard_objects)
+    log.info("get records count: {}".format(records_count))
+    if (len(objects) == 0):
+         log_s3_stats()
          return
-    
-    file_name = f"{uuid.uuid4()}.log.gz"
-    file_content = "\n".join(lines)
-    key = f"{s3_prefix}/{partition}/{file_name}"
-    string_to_s3(file_content, s3_bucket, key, True)
 
+    # named after the objects, so a retry overwrites them as well
+    batch_id = hashlib.sha256("\n".join(obj["key"] for obj in objects).encode("utf-8")).hexdigest()[:32]
+    aggregate_key = None
+    if aggregator is not None:
+        aggregate_key = f"{s3_prefix}/{partition}/{aggregate_file_prefix}{batch_id}.json.gz"
+        bytes_to_s3(aggregator.to_bytes(partition), s3_bucket, aggregate_key)
+    if write_manifest_enabled:
+        write_manifest(objects, partition, batch_id, aggregate_key)
+    # the checkpoints go last, a retry after a failure before this point
+    # writes the aggregate and the manifest again
+    for stream_name, shard_id, shard_objects in checkpoints:
+        update_checkpoint(stream_name, shard_id, partition, shard_objects)
+    log_s3_stats()
+
+
+def get_partition(records):
+    # the hour the first record arrived in Kinesis
+    arrivals = [record['kinesis']['approximateArrivalTimestamp'] for record in records
+                if record['kinesis'].get('approximateArrivalTimestamp') is not None]
+    arrived = datetime.fromtimestamp(min(arrivals), timezone.utc) if arrivals else datetime.utcnow()
+    return arrived.strftime('year=%Y/month=%m/day=%d/hour=%H')
+
+
+def skip_written_records(stream_name, shard_id, records, aggregator=None):
+    '''
+    Drop the records up to the last sequence number of the shard index, they
+    were written by an earlier attempt of this batch (or of a part of it,
+    after BisectBatchOnFunctionError), writing them again would duplicate
+    them under different keys. Returns the remaining records and the index
+    entries of the objects holding the dropped ones, those stay part of the
+    batch: the manifest lists them and the aggregate counts their records.
+    '''
+    index, _ = read_checkpoint(stream_name, shard_id)
+    if not index["objects"]:
+        return records, []
+    last_sequence = int(index["lastSequenceNumber"])
+    remaining = [record for record in records
+                 if int(record['kinesis']['sequenceNumber']) > last_sequence]
+    skipped = records[:len(records) - len(remaining)]
+    if not skipped:
+        return records, []
+    log.info(f"{shard_id}: skip {len(skipped)} records already written")
+    if aggregator is not None:
+        for record in skipped:
+            process(record, aggregator)
+    written = written_entries(index, int(skipped[0]['kinesis']['sequenceNumber']),
+                              int(skipped[-1]['kinesis']['sequenceNumber']))
+    return remaining, [entry for entries in written.values() for entry in entries]
+
+
+def written_entries(index, first_sequence, last_sequence):
+    '''
+    Objects of the checkpoint index overlapping the sequence number range,
+    as the manifest entries they were written with: {partition: entries}
+    '''
+    written = {}
+    for entry in index["objects"]:
+        if int(entry["firstSequenceNumber"]) <= last_sequence and int(entry["lastSequenceNumber"]) >= first_sequence:
+            entry = dict(entry)
+            written.setdefault(entry.pop("partition"), []).append(entry)
+    return written
+
+
+def group_by_shard(records):
+    '''
+    {(stream name, shard id): records ordered by sequence number}
+    '''
+    shards = {}
+    for record in records:
+        # eventID is "<shard id>:<sequence number>"
+        shard_id = record.get('eventID', 'unknown').split(':')[0]
+        stream_name = record.get('eventSourceARN', 'unknown').split('/')[-1]
+        shards.setdefault((stream_name, shard_id), []).append(record)
+    for shard_records in shards.values():
+        shard_records.sort(key=lambda record: int(record['kinesis']['sequenceNumber']))
+    return shards
+
+
+def write_lines(lines, partition, prefix=None, file_name=None):
+    '''
+    Write normalized lines as gzip objects under the hour partition, shared
+    by the Kinesis handler and the replay tool. Returns the objects written.
+    '''
+    writer = ObjectWriter(partition, prefix=prefix, file_name=file_name)
+    for line in lines:
+        writer.add(line)
+    return writer.close()
+
+
+class ObjectWriter:
+    '''
+    Streams lines into a gzip object and rolls over to a new object when the
+    compressed size reaches target_object_bytes.
+    '''
+
+    def __init__(self, partition, prefix=None, file_name=None, target_bytes=None, shard_id=None):
+        self.partition = partition
+        self.prefix = prefix or s3_prefix
+        self.file_name = file_name
+        self.shard_id = shard_id
+        self.target_bytes = target_bytes or target_object_bytes
+        self.objects = []
+        self.total_records = 0
+        self.start_object()
+
+    def start_object(self):
+        # wbits 31: gzip container, readable by gzip.decompress and Athena
+        self.compressor = zlib.compressobj(compression_level, zlib.DEFLATED, 31)
+        self.chunks = []
+        self.compressed_bytes = 0
+        self.records = 0
+        self.raw_bytes = 0
+        self.min_arrival = None
+        self.max_arrival = None
+        self.first_sequence = None
+        self.last_sequence = None
+        self.content_hash = hashlib.sha256()
+
+    def add(self, line, arrival_time=None, sequence_number=None):
+        # lines are joined with "\n", no trailing newline
+        data = (line if self.records == 0 else "\n" + line).encode("utf-8")
+        self.content_hash.update(data)
+        chunk = self.compressor.compress(data)
+        if chunk:
+            self.chunks.append(chunk)
+            self.compressed_bytes += len(chunk)
+        self.records += 1
+        self.total_records += 1
+        self.raw_bytes += len(data)
+        if arrival_time is not None:
+            self.min_arrival = arrival_time if self.min_arrival is None else min(self.min_arrival, arrival_time)
+            self.max_arrival = arrival_time if self.max_arrival is None else max(self.max_arrival, arrival_time)
+        if sequence_number is not None:
+            # added in sequence order
+            if self.first_sequence is None:
+                self.first_sequence = sequence_number
+            self.last_sequence = sequence_number
+        if self.compressed_bytes >= self.target_bytes:
+            self.flush()
+
+    def object_name(self):
+        if self.file_name is None and self.first_sequence is not None:
+            return f"{self.shard_id}-{self.first_sequence}-{self.last_sequence}-{self.content_hash.hexdigest()[:16]}.log.gz"
+        if self.file_name is None:
+            return f"{uuid.uuid4()}.log.gz"
+        if len(self.objects) == 0:
+            return self.file_name
+        # later parts of a named object
+        base = self.file_name[:-len('.log.gz')] if self.file_name.endswith('.log.gz') else self.file_name
+        return f"{base}-{len(self.objects)}.log.gz"
+
+    def object_metadata(self):
+        if self.first_sequence is None:
+            return {}
+        return {
+            "shard-id": self.shard_id,
+            "first-sequence-number": self.first_sequence,
+            "last-sequence-number": self.last_sequence,
+        }
 
-def string_to_s3(content, bucket, key, zip=False):
+    def flush(self):
+        if self.records == 0:
+            return
+        self.chunks.append(self.compressor.flush())
+        body = b''.join(self.chunks)
+        key = f"{self.prefix}/{self.partition}/{self.object_name()}"
+        metadata = self.object_metadata()
+        if self.first_sequence is not None:
+            # deterministic key, a retry that wrote it already makes this a no-op
+            bytes_to_s3(body, s3_bucket, key, metadata=metadata, if_absent=True)
+        else:
+            bytes_to_s3(body, s3_bucket, key, metadata=metadata)
+        self.objects.append({
+            "key": key,
+            "shardId": self.shard_id,
+            "firstSequenceNumber": self.first_sequence,
+            "lastSequenceNumber": self.last_sequence,
+            "records": self.records,
+            "bytes": len(body),
+            "uncompressedBytes": self.raw_bytes,
+            "minArrivalTime": format_arrival_time(self.min_arrival),
+            "maxArrivalTime": format_arrival_time(self.max_arrival),
+        })
+        self.start_object()
+
+    def close(self):
+        self.flush()
+        return self.objects
+
+
+def format_arrival_time(arrival_time):
+    if arrival_time is None:
+        return None
+    return datetime.fromtimestamp(arrival_time, timezone.utc).isoformat(timespec='milliseconds')
+
+
+def write_manifest(objects, partition, batch_id, aggregate_key=None):
+    '''
+    The manifest is a Redshift COPY manifest ("entries" with url, mandatory
+    and meta.content_length) extended with the record counts and arrival
+    time range of each object.
+    '''
+    manifest = {
+        "partition": partition,
+        "aggregateKey": aggregate_key,
+        "records": sum(obj["records"] for obj in objects),
+        # entries recovered from an older checkpoint have no bytes nor arrival times
+        "bytes": sum(obj.get("bytes", 0) for obj in objects),
+        "minArrivalTime": min((obj["minArrivalTime"] for obj in objects if obj.get("minArrivalTime")), default=None),
+        "maxArrivalTime": max((obj["maxArrivalTime"] for obj in objects if obj.get("maxArrivalTime")), default=None),
+        "entries": [{
+            "url": f"s3://{s3_bucket}/{obj['key']}",
+            "mandatory": True,
+            "meta": {"content_length": obj.get("bytes", 0)},
+            **obj,
+        } for obj in objects],
+    }
+    key = f"{manifest_prefix}/{partition}/{batch_id}.manifest.json"
+    string_to_s3(json.dumps(manifest), s3_bucket, key, content_type='application/json')
+    return key
+
+
+def get_checkpoint_key(stream_name, shard_id):
+    return f"{checkpoint_prefix}/{stream_name}/{shard_id}.json"
+
+
+def read_checkpoint(stream_name, shard_id):
+    '''
+    Returns the shard index and the condition to update it with.
+    '''
+    body, etag = s3_transfer.read_object(s3_bucket, get_checkpoint_key(stream_name, shard_id))
+    if body is None:
+        return {"streamName": stream_name, "shardId": shard_id, "objects": []}, {'IfNoneMatch': '*'}
+    return json.loads(body), {'IfMatch': etag}
+
+
+def update_checkpoint(stream_name, shard_id, partition, objects):
+    '''
+    Append the objects to the shard index:
+        {"streamName", "shardId", "lastSequenceNumber", "updatedAt",
+         "objects": [{"key", "partition", "firstSequenceNumber", "lastSequenceNumber", "records",
+                      "bytes", ... the other fields of the manifest entry}]}
+    Only the latest checkpoint_max_entries objects are kept. The index is
+    updated with a conditional put, retried when a concurrent invocation of
+    the same shard (ParallelizationFactor > 1) updated it first.
+    '''
+    entries = [{**obj, "partition": partition} for obj in objects]
+    key = get_checkpoint_key(stream_name, shard_id)
+    for attempt in range(5):
+        index, condition = read_checkpoint(stream_name, shard_id)
+        known = {entry["key"] for entry in index["objects"]}
+        index["objects"] = sorted(index["objects"] + [e for e in entries if e["key"] not in known],
+                                  key=lambda entry: int(entry["firstSequenceNumber"]))[-checkpoint_max_entries:]
+        index["lastSequenceNumber"] = index["objects"][-1]["lastSequenceNumber"]
+        index["updatedAt"] = datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+        try:
+            s3_transfer.put_json(s3_bucket, key, index, **condition)
+            return key
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise
+            log.info(f"checkpoint {key} changed concurrently, attempt {attempt + 1}")
+    raise RuntimeError(f"can not update checkpoint {key}")
+
+
+def string_to_s3(content, bucket, key, zip=False, content_type='text/plain'):
     if zip:
-        bin_body = gzip.compress(content.encode("utf-8"))
-        s3.put_object(
-            Body=bin_body,
-            Bucket=bucket,
-            Key=key,
-            ContentType='application/x-gzip'
-            # ContentType='binary/octet-stream'
-        )
-    else:
-        bin_body = content.encode("utf-8")
-        s3.put_object(
-            Body=bin_body,
-            Bucket=bucket,
-            Key=key,
-            ContentType='text/plain'
-        )
-    log.info("put_object: s3://{}/{}".format(bucket, key))
-
-
-def process(record):
+        bytes_to_s3(gzip.compress(content.encode("utf-8")), bucket, key)
+        return
+    s3_transfer.put_text(bucket, key, content, content_type=content_type)
+
+
+def bytes_to_s3(bin_body, bucket, key, content_type='application/x-gzip', metadata=None, if_absent=False):
+    s3_transfer.put_bytes(bucket, key, bin_body, content_type=content_type, metadata=metadata,
+                          if_absent=if_absent)
+
+
+def log_s3_stats():
+    # S3 calls of the invocation: calls, bytes, time per operation
+    log.info(f"s3: {json.dumps(s3_transfer.take_stats())}")
+
+
+def process(record, aggregator=None):
     data_b64 = record['kinesis']['data']
     try:
         data_raw = decode(data_b64)
@@ -63,14 +369,31 @@ def process(record):
         log.error(error)
         log.error("can not decode data_b64:" + data_b64)
         return None
+    return normalize(data_raw, aggregator)
+
 
+def normalize(data_raw, aggregator=None):
+    '''
+    Returns the record as one line, None if the projection drops it.
+    '''
     # make source one line
     try:
-        return json.dumps(json.loads(data_raw))
+        record = json.loads(data_raw)
     except:
         # remove new line from string
         data_raw = data_raw.replace('\n', '')
+        if aggregator is not None:
+            aggregator.add(None, len(data_raw.encode('utf-8')))
         return data_raw
+    if record_projection is not None:
+        record = record_projection(record)
+        if record is None:
+            return None
+    line = json.dumps(record)
+    if aggregator is not None:
+        # json.dumps escapes non ASCII characters, len() is the byte size
+        aggregator.add(record, len(line))
+    return line
 
 
 def decode(base64_str):
@@ -0,0 +1,250 @@
+'''
+Record enrichment of the kinesis-to-s3 records.
+
+    {
+        "userAgent": true,                      # adds "ua_parsed"
+        "geoDbFile": "geo/ipv4-ranges.bin",     # adds "geo", see below
+        "appMetadataFile": "app-metadata.json", # adds "app", {"<appId>": {...}}
+        "cacheSize": 4096                       # LRU entries per lookup
+    }
+
+The geo database is memory-mapped, so only the pages the lookups touch
+are read. Two formats are supported: MaxMind .mmdb files when the
+maxminddb package is available, and the sorted IPv4 range file built from
+a CSV of start_ip,end_ip,country[,region[,city]] rows:
+
+    python enrichment.py build-geo ranges.csv geo/ipv4-ranges.bin
+
+User agents and IPs repeat a lot within a batch, both lookups are cached.
+The cached dicts are shared, every record gets its own copy so that the
+later stages (e.g. a projection dropping geo.city) can change it.
+'''
+import re
+import sys
+import csv
+import copy
+import json
+import mmap
+import struct
+import socket
+import logging
+from functools import lru_cache
+
+log = logging.getLogger()
+
+geo_magic = b'IPGEO001'
+# magic, range count, offset of the locations table
+geo_header = struct.Struct('<8sII')
+# start ip, end ip, location index
+geo_range = struct.Struct('<III')
+
+## User agent
+bot_pattern = re.compile(r'(?i)bot|crawler|spider|slurp|curl|wget|python-requests|headless')
+browser_patterns = [
+    ('Edge', re.compile(r'Edg(?:e|A|iOS)?/([\d.]+)')),
+    ('Opera', re.compile(r'(?:OPR|Opera)/([\d.]+)')),
+    ('Samsung Internet', re.compile(r'SamsungBrowser/([\d.]+)')),
+    ('Chrome', re.compile(r'(?:Chrome|CriOS)/([\d.]+)')),
+    ('Firefox', re.compile(r'(?:Firefox|FxiOS)/([\d.]+)')),
+    ('Safari', re.compile(r'Version/([\d.]+).*Safari/')),
+    ('IE', re.compile(r'(?:MSIE |Trident/.*rv:)([\d.]+)')),
+]
+os_patterns = [
+    ('Windows', re.compile(r'Windows NT ([\d.]+)')),
+    ('iOS', re.compile(r'(?:iPhone|iPad|iPod).*? OS ([\d_]+)')),
+    ('Android', re.compile(r'Android ([\d.]+)')),
+    ('Mac OS X', re.compile(r'Mac OS X ([\d_.]+)')),
+    ('Chrome OS', re.compile(r'CrOS \S+ ([\d.]+)')),
+    ('Linux', re.compile(r'Linux()')),
+]
+tablet_pattern = re.compile(r'(?i)iPad|Tablet|Android(?!.*Mobile)')
+mobile_pattern = re.compile(r'(?i)Mobile|iPhone|iPod|Android')
+
+
+def parse_user_agent(ua):
+    result = {'browser': None, 'browser_version': None,
+              'os': None, 'os_version': None, 'device': 'Desktop'}
+    if not ua:
+        result['device'] = None
+        return result
+    if bot_pattern.search(ua):
+        result['device'] = 'Bot'
+    elif tablet_pattern.search(ua):
+        result['device'] = 'Tablet'
+    elif mobile_pattern.search(ua):
+        result['device'] = 'Mobile'
+    for name, pattern in browser_patterns:
+        match = pattern.search(ua)
+        if match:
+            result['browser'] = name
+            result['browser_version'] = match.group(1)
+            break
+    for name, pattern in os_patterns:
+        match = pattern.search(ua)
+        if match:
+            result['os'] = name
+            result['os_version'] = match.group(1).replace('_', '.') or None
+            break
+    return result
+
+
+## Geo
+class RangeGeoDb:
+    '''
+    Sorted IPv4 ranges in a memory-mapped file, binary searched.
+    '''
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, locations_offset = geo_header.unpack_from(self.data, 0)
+        if magic != geo_magic:
+            raise ValueError(f"{path} is not a geo range file")
+        self.locations = json.loads(self.data[locations_offset:].decode('utf-8'))
+
+    def lookup(self, ip):
+        try:
+            value = struct.unpack('!I', socket.inet_aton(ip))[0]
+        except (OSError, TypeError):
+            # not an IPv4 address
+            return None
+        low, high = 0, self.count - 1
+        while low <= high:
+            middle = (low + high) // 2
+            start, end, location = geo_range.unpack_from(
+                self.data, geo_header.size + middle * geo_range.size)
+            if value < start:
+                high = middle - 1
+            elif value > end:
+                low = middle + 1
+            else:
+                country, region, city = self.locations[location]
+                return {'country': country, 'region': region, 'city': city}
+        return None
+
+
+class MaxMindGeoDb:
+
+    def __init__(self, path):
+        import maxminddb
+        self.reader = maxminddb.open_database(path, maxminddb.MODE_MMAP)
+
+    def lookup(self, ip):
+        try:
+            found = self.reader.get(ip)
+        except ValueError:
+            return None
+        if not found:
+            return None
+        subdivisions = found.get('subdivisions') or [{}]
+        return {
+            'country': found.get('country', {}).get('iso_code'),
+            'region': subdivisions[0].get('names', {}).get('en'),
+            'city': found.get('city', {}).get('names', {}).get('en'),
+        }
+
+
+def open_geo_db(path):
+    if path.endswith('.mmdb'):
+        return MaxMindGeoDb(path)
+    return RangeGeoDb(path)
+
+
+def build_geo_db(csv_path, output_path):
+    '''
+    Convert start_ip,end_ip,country[,region[,city]] rows into the range file.
+    '''
+    def to_int(ip):
+        return int(ip) if ip.isdigit() else struct.unpack('!I', socket.inet_aton(ip))[0]
+
+    locations = {}
+    ranges = []
+    with open(csv_path, newline='') as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith('#') or not row[0][:1].isdigit():
+                continue
+            location = tuple((row[2:5] + [None, None, None])[:3])
+            index = locations.setdefault(location, len(locations))
+            ranges.append((to_int(row[0]), to_int(row[1]), index))
+    ranges.sort()
+    with open(output_path, 'wb') as f:
+        f.write(geo_header.pack(geo_magic, len(ranges),
+                                geo_header.size + len(ranges) * geo_range.size))
+        for r in ranges:
+            f.write(geo_range.pack(*r))
+        f.write(json.dumps([list(location) for location in locations]).encode('utf-8'))
+    return len(ranges)
+
+
+## Stage
+def compile_enrichment(config):
+    '''
+    Compile the configuration into enrich(record) -> record, None for an
+    empty configuration.
+    '''
+    if not config:
+        return None
+    cache_size = int(config.get('cacheSize', 4096))
+    steps = []
+
+    if config.get('userAgent'):
+        parse_ua = lru_cache(maxsize=cache_size)(parse_user_agent)
+
+        def enrich_ua(record):
+            ua = record.get('ua')
+            if isinstance(ua, str):
+                record['ua_parsed'] = dict(parse_ua(ua))
+        steps.append(enrich_ua)
+
+    if config.get('geoDbFile'):
+        try:
+            geo_db = open_geo_db(config['geoDbFile'])
+        except Exception as e:
+            log.error(f"geo enrichment disabled, can not open {config['geoDbFile']}: {repr(e)}")
+            geo_db = None
+        if geo_db is not None:
+            lookup_geo = lru_cache(maxsize=cache_size)(geo_db.lookup)
+
+            def enrich_geo(record):
+                ip = record.get('ip')
+                if isinstance(ip, str):
+                    # X-Forwarded-For style lists, the first address is the client
+                    geo = lookup_geo(ip.split(',')[0].strip())
+                    record['geo'] = None if geo is None else dict(geo)
+            steps.append(enrich_geo)
+
+    if config.get('appMetadataFile'):
+        try:
+            with open(config['appMetadataFile']) as f:
+                app_metadata = json.load(f)
+            if not isinstance(app_metadata, dict):
+                raise ValueError('not a {"<appId>": {...}} object')
+        except Exception as e:
+            log.error(f"app enrichment disabled, can not read {config['appMetadataFile']}: {repr(e)}")
+            app_metadata = None
+        if app_metadata is not None:
+
+            def enrich_app(record):
+                metadata = app_metadata.get(record.get('appId'))
+                if metadata is not None:
+                    # nested objects too, the table is shared by every record
+                    record['app'] = copy.deepcopy(metadata)
+            steps.append(enrich_app)
+
+    if not steps:
+        return None
+
+    def enrich(record):
+        if isinstance(record, dict):
+            for step in steps:
+                step(record)
+        return record
+
+    return enrich
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != 'build-geo':
+        print('usage: python enrichment.py build-geo <ranges.csv> <output.bin>')
+        sys.exit(1)
+    print(f"{build_geo_db(sys.argv[2], sys.argv[3])} ranges written to {sys.argv[3]}")
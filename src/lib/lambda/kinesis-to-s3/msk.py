@@ -0,0 +1,231 @@
+'''
+MSK to S3 sink, a Lambda alternative to the MSK Connect S3 sink connector.
+
+It is deployed from the kinesis-to-s3 code with handler msk.handler and
+shares its record pipeline (projection, enrichment, aggregates, rollover,
+manifest, checkpoints). The output has the connector layout, the
+TimeBasedPartitioner path on the record timestamp and the connector file
+names:
+
+    <prefix>/<topic>/year=YYYY/month=MM/day=dd/hour=HH/<topic>+<partition>+<start offset>.json.gz
+
+Records are batched per topic-partition and hour, the names only depend on
+the offsets, so a redelivered batch overwrites nothing new. Each topic hour
+of the batch gets its own aggregate, next to its objects, and manifest:
+
+    <prefix>/<topic>/year=YYYY/month=MM/day=dd/hour=HH/_agg-<batch id>.json.gz
+    <manifest prefix>/<topic>/year=YYYY/month=MM/day=dd/hour=HH/<batch id>.manifest.json
+
+Run against synthetic MSK events, e.g. with a moto server or MinIO:
+
+    PYTHONPATH=../layer/python AWS_REGION=us-east-1 AWS_S3_BUCKET=sink AWS_S3_PREFIX=msk \\
+        AWS_ENDPOINT_URL=http://127.0.0.1:5000 python msk.py --records 20000 --partitions 4
+'''
+import json
+import base64
+import hashlib
+from datetime import datetime, timezone
+from lambda_common import track_cold_start, profiled
+
+import app
+from aggregates import Aggregator, aggregate_file_prefix
+
+log = app.log
+
+
+class TopicPartitionWriter(app.ObjectWriter):
+    '''
+    ObjectWriter named like the S3 sink connector output, the sequence
+    numbers are the Kafka offsets.
+    '''
+
+    def __init__(self, partition, topic, kafka_partition):
+        super().__init__(partition, prefix=f"{app.s3_prefix}/{topic}",
+                         shard_id=f"{topic}+{kafka_partition}")
+        self.topic = topic
+        self.kafka_partition = kafka_partition
+
+    def object_name(self):
+        return f"{self.topic}+{self.kafka_partition}+{self.first_sequence}.json.gz"
+
+    def object_metadata(self):
+        return {
+            "topic": self.topic,
+            "kafka-partition": str(self.kafka_partition),
+            "start-offset": self.first_sequence,
+            "end-offset": self.last_sequence,
+        }
+
+
+@track_cold_start
+@profiled
+def handler(event, context):
+    # {(topic, hour): {"objects", "aggregator"}}, each written to its own directory
+    partitions = {}
+    checkpoints = []
+    records_count = 0
+    # "records": {"<topic>-<partition>": [records ordered by offset]}
+    for records in event['records'].values():
+        if not records:
+            continue
+        topic, kafka_partition = records[0]['topic'], records[0]['partition']
+        checkpoint_name = f"partition-{kafka_partition}"
+        if app.skip_checkpointed:
+            records, skipped, written = skip_written_records(topic, checkpoint_name, records)
+            for hour, hour_records in group_by_hour(skipped).items():
+                aggregator = topic_hour(partitions, topic, hour)["aggregator"]
+                if aggregator is not None:
+                    for record in hour_records:
+                        process(record, aggregator)
+            for hour, entries in written.items():
+                topic_hour(partitions, topic, hour)["objects"].extend(entries)
+        for hour, hour_records in group_by_hour(records).items():
+            batch = topic_hour(partitions, topic, hour)
+            writer = TopicPartitionWriter(hour, topic, kafka_partition)
+            for record in hour_records:
+                line = process(record, batch["aggregator"])
+                if line is not None:
+                    writer.add(line, record['timestamp'] / 1000, str(record['offset']))
+            tp_objects = writer.close()
+            records_count += writer.total_records
+            if tp_objects:
+                checkpoints.append((topic, checkpoint_name, hour, tp_objects))
+            batch["objects"].extend(tp_objects)
+    objects = [obj for batch in partitions.values() for obj in batch["objects"]]
+    log.info("get records count: {}".format(records_count))
+    if (len(objects) == 0):
+         app.log_s3_stats()
+         return {'records': 0, 'objects': []}
+
+    batch_id = hashlib.sha256("\n".join(obj["key"] for obj in objects).encode("utf-8")).hexdigest()[:32]
+    for (topic, hour), batch in partitions.items():
+        if not batch["objects"]:
+            continue
+        aggregate_key = None
+        if batch["aggregator"] is not None:
+            aggregate_key = f"{app.s3_prefix}/{topic}/{hour}/{aggregate_file_prefix}{batch_id}.json.gz"
+            app.bytes_to_s3(batch["aggregator"].to_bytes(hour), app.s3_bucket, aggregate_key)
+        if app.write_manifest_enabled:
+            app.write_manifest(batch["objects"], f"{topic}/{hour}", batch_id, aggregate_key)
+    # the checkpoints go last, a retry after a failure before this point
+    # writes the aggregates and the manifests again
+    for topic, checkpoint_name, hour, tp_objects in checkpoints:
+        app.update_checkpoint(topic, checkpoint_name, hour, tp_objects)
+    app.log_s3_stats()
+    return {'records': records_count, 'objects': [obj['key'] for obj in objects]}
+
+
+def topic_hour(partitions, topic, hour):
+    if (topic, hour) not in partitions:
+        partitions[(topic, hour)] = {
+            "objects": [],
+            "aggregator": Aggregator(app.aggregate_config) if app.aggregate_config.get('dimensions') else None,
+        }
+    return partitions[(topic, hour)]
+
+
+def group_by_hour(records):
+    '''
+    TimeBasedPartitioner with the record timestamp: {hour path: records}
+    '''
+    hours = {}
+    for record in sorted(records, key=lambda record: record['offset']):
+        hour = datetime.fromtimestamp(record['timestamp'] / 1000, timezone.utc).strftime(
+            'year=%Y/month=%m/day=%d/hour=%H')
+        hours.setdefault(hour, []).append(record)
+    return hours
+
+
+def skip_written_records(topic, checkpoint_name, records):
+    '''
+    Split off the records up to the last offset of the checkpoint index,
+    written by an earlier attempt. Returns the remaining records, the
+    skipped ones and the index entries of the objects holding those,
+    {hour: entries}, which stay part of the batch like in app.
+    '''
+    index, _ = app.read_checkpoint(topic, checkpoint_name)
+    if not index["objects"]:
+        return records, [], {}
+    last_offset = int(index["lastSequenceNumber"])
+    remaining = [record for record in records if record['offset'] > last_offset]
+    skipped = [record for record in records if record['offset'] <= last_offset]
+    if not skipped:
+        return records, [], {}
+    log.info(f"{topic}/{checkpoint_name}: skip {len(skipped)} records already written")
+    offsets = [record['offset'] for record in skipped]
+    return remaining, skipped, app.written_entries(index, min(offsets), max(offsets))
+
+
+def process(record, aggregator=None):
+    if record.get('value') is None:
+        return None
+    try:
+        data_raw = app.decode(record['value'])
+    except Exception as error:
+        log.error(error)
+        log.error(f"can not decode value of {record['topic']}-{record['partition']}@{record['offset']}")
+        return None
+    return app.normalize(data_raw, aggregator)
+
+
+def make_event(topic, partitions, records, start_offset=0, timestamp_ms=None, payload_bytes=600):
+    '''
+    A synthetic MSK event source event with records spread over partitions.
+    '''
+    timestamp_ms = timestamp_ms or int(datetime.now(timezone.utc).timestamp() * 1000)
+    padding = 'x' * max(0, payload_bytes - 200)
+    batches = {}
+    for i in range(records):
+        partition = i % partitions
+        value = json.dumps({
+            'date': datetime.fromtimestamp(timestamp_ms / 1000, timezone.utc).isoformat(),
+            'ua': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/114.0.0.0',
+            'ip': f"10.0.{i % 256}.{i % 250 + 1}",
+            'appId': 'synthetic',
+            'platform': 'Web',
+            'data': json.dumps({'event_type': 'page_view', 'user_id': f"user-{i % 997}", 'pad': padding}),
+        })
+        batches.setdefault(f"{topic}-{partition}", []).append({
+            'topic': topic,
+            'partition': partition,
+            'offset': start_offset + i // partitions,
+            'timestamp': timestamp_ms + i,
+            'timestampType': 'CREATE_TIME',
+            'key': None,
+            'value': base64.b64encode(value.encode('utf-8')).decode('ascii'),
+            'headers': [],
+        })
+    return {
+        'eventSource': 'aws:kafka',
+        'eventSourceArn': 'arn:aws:kafka:us-east-1:000000000000:cluster/synthetic/0',
+        'bootstrapServers': 'localhost:9092',
+        'records': batches,
+    }
+
+
+if __name__ == '__main__':
+    import time
+    import logging
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--topic', default='clickstream')
+    parser.add_argument('--partitions', type=int, default=4)
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--payload-bytes', type=int, default=600)
+    args = parser.parse_args()
+
+    logging.basicConfig()
+    bucket = app.s3_bucket
+    try:
+        app.s3.create_bucket(Bucket=bucket)
+    except Exception:
+        pass
+    event = make_event(args.topic, args.partitions, args.records, payload_bytes=args.payload_bytes)
+    start = time.perf_counter()
+    result = handler(event, None)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'records': result['records'], 'objects': len(result['objects']),
+                      'seconds': round(elapsed, 3),
+                      'recordsPerSec': round(result['records'] / elapsed, 1)}, indent=2))
@@ -0,0 +1,187 @@
+'''
+Sampling and field projection of the kinesis-to-s3 records.
+
+The configuration is compiled once into a single function that is applied
+to every parsed record before it is serialized:
+
+    {
+        "dropRules": [
+            {"field": "ua", "matches": "(?i)bot|crawler|spider"},
+            {"field": "appId", "in": ["load-test"]},
+            {"field": "data.event_type", "equals": "_clickstream_probe"},
+            {"field": "data.user_id", "missing": true}
+        ],
+        "sampling": {
+            "eventTypeField": "data.event_type",
+            "keyFields": ["data.user_id", "data.session_id", "rid"],
+            "rates": {"page_scroll": 0.1, "heartbeat": 0.01},
+            "defaultRate": 1.0
+        },
+        "keep": ["date", "ip", "ua", "appId", "platform", "data"],
+        "drop": ["data.properties.debug"]
+    }
+
+Fields are dotted paths. A top level field holding a JSON string, like
+"data", is parsed when a path reaches into it. It is serialized back only
+when the keep/drop lists changed it, else the original string is kept.
+Sampling hashes the first present key field, so a user or session is
+either kept or dropped as a whole, on every run.
+'''
+import re
+import json
+import zlib
+
+
+def split_path(path):
+    return tuple(path.split('.'))
+
+
+def get_path(record, path):
+    value = record
+    for name in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(name)
+    return value
+
+
+def remove_path(record, path):
+    # True when there was something to remove
+    parent = get_path(record, path[:-1])
+    if isinstance(parent, dict) and path[-1] in parent:
+        del parent[path[-1]]
+        return True
+    return False
+
+
+def build_keep_tree(paths):
+    # {"data": {"event_type": None}, "ip": None}, None keeps the whole value
+    tree = {}
+    for path in paths:
+        node = tree
+        for name in path[:-1]:
+            child = node.setdefault(name, {})
+            if child is None:
+                break
+            node = child
+        else:
+            node[path[-1]] = None
+    return tree
+
+
+def project(value, tree):
+    if not isinstance(value, dict):
+        return value
+    return {name: value[name] if sub is None else project(value[name], sub)
+            for name, sub in tree.items() if name in value}
+
+
+def compile_drop_rule(rule):
+    path = split_path(rule['field'])
+    if 'matches' in rule:
+        pattern = re.compile(rule['matches'])
+        return lambda record: isinstance(get_path(record, path), str) \
+            and pattern.search(get_path(record, path)) is not None
+    if 'in' in rule:
+        values = set(rule['in'])
+        return lambda record: get_path(record, path) in values
+    if 'equals' in rule:
+        value = rule['equals']
+        return lambda record: get_path(record, path) == value
+    if 'missing' in rule:
+        missing = bool(rule['missing'])
+        return lambda record: (get_path(record, path) is None) == missing
+    raise ValueError(f"unsupported drop rule: {rule}")
+
+
+def compile_sampler(sampling):
+    '''
+    Returns a function telling whether a record is kept, or None when every
+    record is kept.
+    '''
+    type_path = split_path(sampling.get('eventTypeField', 'data.event_type'))
+    key_paths = [split_path(p) for p in sampling.get('keyFields', ['rid'])]
+    # rates as thresholds on the 32 bit hash
+    thresholds = {event_type: int(float(rate) * 0x100000000)
+                  for event_type, rate in sampling.get('rates', {}).items()}
+    default_threshold = int(float(sampling.get('defaultRate', 1.0)) * 0x100000000)
+    if not thresholds and default_threshold >= 0x100000000:
+        return None
+
+    def sample(record):
+        threshold = thresholds.get(get_path(record, type_path), default_threshold)
+        if threshold >= 0x100000000:
+            return True
+        if threshold <= 0:
+            return False
+        for path in key_paths:
+            key = get_path(record, path)
+            if key is not None:
+                break
+        else:
+            # no key field, hash the record itself to stay deterministic
+            key = json.dumps(record, sort_keys=True)
+        return zlib.crc32(str(key).encode('utf-8')) < threshold
+
+    return sample
+
+
+def compile_stage(config, enrich=None):
+    '''
+    Compile the configuration into stage(record) -> record or None when the
+    record is dropped. Returns None when there is nothing to do.
+
+    enrich(record) runs on the records that pass the drop rules and the
+    sampling, before the keep/drop lists, so the lists apply to the
+    enriched fields too.
+    '''
+    if not config:
+        return enrich
+    drop_rules = [compile_drop_rule(rule) for rule in config.get('dropRules', [])]
+    sampler = compile_sampler(config['sampling']) if config.get('sampling') else None
+    keep_paths = [split_path(p) for p in config.get('keep', [])]
+    keep_tree = build_keep_tree(keep_paths) if keep_paths else None
+    drop_paths = [split_path(p) for p in config.get('drop', [])]
+
+    # top level fields a path reaches into, parsed when they hold JSON text
+    paths = keep_paths + drop_paths + [split_path(rule['field']) for rule in config.get('dropRules', [])]
+    if config.get('sampling'):
+        paths.append(split_path(config['sampling'].get('eventTypeField', 'data.event_type')))
+        paths.extend(split_path(p) for p in config['sampling'].get('keyFields', ['rid']))
+    json_fields = sorted({path[0] for path in paths if len(path) > 1})
+    # the ones the keep list reaches into, the drop list only when it removes
+    projected_fields = {name for name, sub in (keep_tree or {}).items() if sub is not None}
+
+    def stage(record):
+        if not isinstance(record, dict):
+            return record
+        originals = {}
+        for name in json_fields:
+            value = record.get(name)
+            if isinstance(value, str) and value[:1] in ('{', '['):
+                try:
+                    record[name] = json.loads(value)
+                    originals[name] = value
+                except ValueError:
+                    pass
+
+        for rule in drop_rules:
+            if rule(record):
+                return None
+        if sampler is not None and not sampler(record):
+            return None
+        if enrich is not None:
+            record = enrich(record)
+        if keep_tree is not None:
+            record = project(record, keep_tree)
+        changed = set(projected_fields)
+        for path in drop_paths:
+            if remove_path(record, path) and len(path) > 1:
+                changed.add(path[0])
+
+        for name, original in originals.items():
+            if name in record:
+                record[name] = json.dumps(record[name]) if name in changed else original
+        return record
+
+    return stage
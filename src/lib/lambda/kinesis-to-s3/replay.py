@@ -0,0 +1,219 @@
+'''
+Replay the raw event files of the Kinesis to S3 sink.
+
+Every .log.gz object under the source prefix is streamed back through
+s3_transfer.read_stream with incremental gzip decompression, its lines go through the same
+normalization, compression and hour partitioning as app.py and are written
+under the destination prefix. The objects are processed concurrently, the
+manifest records the finished ones so that an interrupted replay resumes
+where it stopped, it is written every --manifest-flush-every objects and at
+the end.
+
+    python replay.py --source-bucket raw --source-prefix clickstream/ \\
+        --dest-bucket raw --dest-prefix replayed --manifest replay.json
+
+Against MinIO or a moto server:
+
+    python replay.py --endpoint-url http://127.0.0.1:9000 ...
+'''
+import os
+import re
+import sys
+import json
+import zlib
+import hashlib
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'layer', 'python'))
+from lambda_common import get_client, s3_transfer
+
+partition_pattern = re.compile(
+    r'year=\d{4}/month=\d{2}/day=\d{2}/hour=\d{2}')
+
+
+def iter_object_lines(bucket, key, chunk_size):
+    '''
+    Yield the decompressed lines of a gzip object, read chunk_size bytes at
+    a time. Concatenated gzip members are decompressed one after another.
+    '''
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pending = b''
+    for data in s3_transfer.read_stream(bucket, key, chunk_size):
+        while data:
+            pending += decompressor.decompress(data)
+            data = decompressor.unused_data
+            if decompressor.eof:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            yield line
+    pending += decompressor.flush()
+    if pending:
+        yield pending
+
+
+class Manifest:
+    '''
+    {"done": {source_key: [output_key]}}, kept in a local file or s3://bucket/key.
+    Written every flush_every records, an interrupted replay redoes at most
+    that many objects.
+    '''
+
+    def __init__(self, location, flush_every=100):
+        self.location = location
+        self.flush_every = flush_every
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.done = {}
+        if location:
+            self.done = self.load().get('done', {})
+
+    def s3_location(self):
+        bucket, _, key = self.location[len('s3://'):].partition('/')
+        return bucket, key
+
+    def load(self):
+        if self.location.startswith('s3://'):
+            return s3_transfer.read_json(*self.s3_location()) or {}
+        try:
+            with open(self.location) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def record(self, source_key, output_keys):
+        with self.lock:
+            self.done[source_key] = output_keys
+            self.pending += 1
+            if self.pending >= self.flush_every:
+                self.write()
+
+    def flush(self):
+        with self.lock:
+            if self.pending:
+                self.write()
+
+    def write(self):
+        self.pending = 0
+        if not self.location:
+            return
+        content = json.dumps({'done': self.done}, indent=2)
+        if self.location.startswith('s3://'):
+            s3_transfer.put_text(*self.s3_location(), content, content_type='application/json')
+        else:
+            tmp = self.location + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(content)
+            os.replace(tmp, self.location)
+
+
+def list_source_keys(bucket, prefix):
+    paginator = get_client('s3').get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('.log.gz'):
+                yield obj['Key']
+
+
+def replay_object(app, source_bucket, key, dest_prefix, chunk_size):
+    match = partition_pattern.search(key)
+    partition = match.group(0) if match else \
+        datetime.utcnow().strftime('year=%Y/month=%m/day=%d/hour=%H')
+    count = 0
+
+    def normalized_lines():
+        # streamed into the writer, an object is never held decompressed
+        nonlocal count
+        for line in iter_object_lines(source_bucket, key, chunk_size):
+            if not line.strip():
+                continue
+            line = app.normalize(line.decode('utf-8', errors='replace'))
+            # None: dropped by the projection
+            if line is not None:
+                count += 1
+                yield line
+
+    # a deterministic name, a replay that is repeated overwrites its output
+    file_name = f"replay-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}.log.gz"
+    objects = app.write_lines(normalized_lines(), partition, prefix=dest_prefix, file_name=file_name)
+    return [obj['key'] for obj in objects], count
+
+
+def replay(app, args):
+    manifest = Manifest(args.manifest, args.manifest_flush_every)
+    keys = [key for key in list_source_keys(args.source_bucket, args.source_prefix)
+            if key not in manifest.done]
+    skipped = len(manifest.done)
+    app.log.info(f"replay {len(keys)} objects, {skipped} already done")
+
+    failed = {}
+    records = 0
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            running = {}
+            for key in keys:
+                # bounded: never more than concurrency objects in flight
+                if len(running) >= args.concurrency:
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    records += collect(finished, running, manifest, failed, app)
+                running[executor.submit(replay_object, app, args.source_bucket, key,
+                                        args.dest_prefix, args.chunk_size)] = key
+            records += collect(list(running), running, manifest, failed, app)
+    finally:
+        manifest.flush()
+
+    return {'replayed': len(keys) - len(failed), 'records': records,
+            'skipped': skipped,
+            'failed': failed}
+
+
+def collect(finished, running, manifest, failed, app):
+    records = 0
+    for future in finished:
+        key = running.pop(future)
+        try:
+            output_keys, count = future.result()
+        except Exception as e:
+            app.log.error(f"replay {key} failed: {repr(e)}")
+            failed[key] = repr(e)
+            continue
+        manifest.record(key, output_keys)
+        records += count
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source-bucket', required=True)
+    parser.add_argument('--source-prefix', default='')
+    parser.add_argument('--dest-bucket', help='defaults to the source bucket')
+    parser.add_argument('--dest-prefix', required=True)
+    parser.add_argument('--manifest', help='local path or s3://bucket/key')
+    parser.add_argument('--manifest-flush-every', type=int, default=100,
+                        help='objects replayed between manifest writes')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--chunk-size', type=int, default=8 * 1024 * 1024,
+                        help='bytes read at a time')
+    parser.add_argument('--endpoint-url', help='S3 compatible endpoint, e.g. MinIO')
+    args = parser.parse_args()
+    args.dest_prefix = args.dest_prefix.rstrip('/')
+
+    if args.endpoint_url:
+        os.environ['AWS_ENDPOINT_URL'] = args.endpoint_url
+    os.environ.setdefault('AWS_REGION', os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+    os.environ['AWS_S3_BUCKET'] = args.dest_bucket or args.source_bucket
+    os.environ['AWS_S3_PREFIX'] = args.dest_prefix
+    import logging
+    import app
+    logging.basicConfig()
+
+    print(json.dumps(replay(app, args), indent=2))
+
+
+if __name__ == '__main__':
+    main()
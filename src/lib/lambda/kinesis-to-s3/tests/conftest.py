@@ -0,0 +1,81 @@
+'''
+The kinesis-to-s3 modules read their configuration at import, the
+environment is set before app is imported. S3 is a moto mock, reset for
+every test.
+
+    cd src/lib/lambda/kinesis-to-s3 && python -m pytest tests
+'''
+import os
+import sys
+import json
+import time
+import base64
+
+import pytest
+
+lambda_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+layer_dir = os.path.join(lambda_dir, '..', 'layer', 'python')
+sys.path[:0] = [lambda_dir, layer_dir]
+
+bucket = 'test-sink'
+os.environ.update({
+    'AWS_REGION': 'us-east-1',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'test',
+    'AWS_SECRET_ACCESS_KEY': 'test',
+    'AWS_S3_BUCKET': bucket,
+    'AWS_S3_PREFIX': 'raw',
+})
+
+
+@pytest.fixture
+def s3():
+    from moto import mock_aws
+    with mock_aws():
+        from lambda_common import get_client
+        client = get_client('s3')
+        client.create_bucket(Bucket=bucket)
+        yield client
+
+
+@pytest.fixture
+def app(s3, monkeypatch):
+    import app
+    monkeypatch.setattr(app, 'aggregate_config', {})
+    return app
+
+
+def list_keys(s3, prefix=''):
+    res = s3.list_objects_v2(Bucket=bucket, Prefix=prefix)
+    return sorted(obj['Key'] for obj in res.get('Contents', []))
+
+
+def read_json(s3, key):
+    return json.loads(s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+
+
+def make_record(i, shard_id='shardId-000000000000', arrival=None, event_type='page_view'):
+    data = {
+        'date': '2024-01-02T03:04:05Z',
+        'appId': 'app1',
+        'data': json.dumps({'event_type': event_type, 'user_id': f"u{i % 7}"}),
+    }
+    return {
+        'eventID': f"{shard_id}:{1000 + i}",
+        'eventSourceARN': 'arn:aws:kinesis:us-east-1:000000000000:stream/clicks',
+        'kinesis': {
+            'data': base64.b64encode(json.dumps(data).encode('utf-8')).decode('ascii'),
+            'sequenceNumber': str(1000 + i),
+            'approximateArrivalTimestamp': arrival or 1704164645.0,
+            'partitionKey': 'k',
+        },
+    }
+
+
+def make_event(count, start=0, **kwargs):
+    return {'Records': [make_record(i, **kwargs) for i in range(start, start + count)]}
+
+
+@pytest.fixture
+def kinesis_event():
+    return make_event
@@ -0,0 +1,94 @@
+import gzip
+import json
+
+from aggregates import Aggregator, HyperLogLog, compact_hour, rollup_file_name
+from conftest import bucket, list_keys
+
+config = {'dimensions': [['appId'], ['appId', 'data.event_type']], 'userField': 'data.user_id'}
+hour = 'year=2024/month=01/day=02/hour=03'
+
+
+def sketch(users):
+    hll = HyperLogLog()
+    for user in users:
+        hll.add_hash(HyperLogLog.hash(user))
+    return hll
+
+
+def record(user, event_type='click'):
+    return {'appId': 'app1', 'data': json.dumps({'event_type': event_type, 'user_id': user})}
+
+
+def put_aggregate(s3, name, users, config=config):
+    aggregator = Aggregator(config)
+    for user in users:
+        aggregator.add(record(user), 100)
+    s3.put_object(Bucket=bucket, Key=f"raw/{hour}/_agg-{name}.json.gz", Body=aggregator.to_bytes(hour))
+
+
+def read_rollup(s3):
+    body = s3.get_object(Bucket=bucket, Key=f"raw/{hour}/{rollup_file_name}")['Body'].read()
+    return json.loads(gzip.decompress(body))
+
+
+def test_sketch_counts_distinct_users():
+    assert sketch(['u1', 'u2', 'u1']).count() == 2
+    assert abs(sketch(f"u{i}" for i in range(20000)).count() - 20000) < 20000 * 0.05
+
+
+def test_merge_is_the_union_of_the_sketches():
+    merged = sketch(f"u{i}" for i in range(6000))
+    merged.merge(sketch(f"u{i}" for i in range(4000, 10000)))
+    # merging the same users again changes nothing
+    merged.merge(sketch(f"u{i}" for i in range(5000)))
+
+    assert abs(merged.count() - 10000) < 10000 * 0.05
+    roundtrip = HyperLogLog.from_str(12, merged.to_str())
+    assert roundtrip.count() == merged.count()
+
+
+def test_groups_per_dimension_set():
+    aggregator = Aggregator(config)
+    for user, event_type in [('u1', 'click'), ('u2', 'click'), ('u1', 'view')]:
+        aggregator.add(record(user, event_type), 10)
+
+    sets = aggregator.to_dict(hour)['sets']
+
+    assert [(g['events'], g['bytes'], g['users']) for g in sets[0]['groups']] == [(3, 30, 2)]
+    assert {g['dimensions']['data.event_type']: g['users'] for g in sets[1]['groups']} == {'click': 2, 'view': 1}
+
+
+def test_compaction_merges_each_file_once(s3):
+    put_aggregate(s3, 'a', ['u1', 'u2'])
+    put_aggregate(s3, 'b', ['u2', 'u3'])
+
+    assert compact_hour(s3, bucket, 'raw', hour) == {'partition': hour, 'merged': 2, 'deleted': 2,
+                                                     'skipped': {}}
+    put_aggregate(s3, 'c', ['u4'])
+    assert compact_hour(s3, bucket, 'raw', hour)['merged'] == 1
+
+    rollup = read_rollup(s3)
+    group = rollup['sets'][0]['groups'][0]
+    assert (group['events'], group['bytes'], group['users']) == (5, 500, 4)
+    assert len(rollup['sources']) == 3
+    assert list_keys(s3, 'raw/') == [f"raw/{hour}/{rollup_file_name}"]
+
+
+def test_sets_are_matched_by_their_dimensions(s3):
+    put_aggregate(s3, 'a', ['u1', 'u2'])
+    # the same dimension sets, reordered
+    put_aggregate(s3, 'b', ['u3'], {**config, 'dimensions': config['dimensions'][::-1]})
+    # a set added, a smaller sketch
+    put_aggregate(s3, 'c', ['u4'], {**config, 'dimensions': config['dimensions'] + [['platform']]})
+    put_aggregate(s3, 'd', ['u5'], {**config, 'precision': 10})
+
+    result = compact_hour(s3, bucket, 'raw', hour)
+
+    assert result['merged'] == 2
+    assert sorted(result['skipped']) == [f"raw/{hour}/_agg-c.json.gz", f"raw/{hour}/_agg-d.json.gz"]
+    rollup = read_rollup(s3)
+    assert [s['dimensions'] for s in rollup['sets']] == [['appId'], ['appId', 'data.event_type']]
+    for dimension_set in rollup['sets']:
+        group = dimension_set['groups'][0]
+        assert (group['events'], group['users']) == (3, 3)
+    assert f"raw/{hour}/_agg-d.json.gz" in list_keys(s3, 'raw/')
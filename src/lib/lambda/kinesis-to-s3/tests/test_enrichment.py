@@ -0,0 +1,56 @@
+from enrichment import build_geo_db, compile_enrichment
+from projection import compile_stage
+
+ua = 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) Version/17.1 Mobile/15E148 Safari/604.1'
+
+
+def geo_db(tmp_path):
+    csv_path = tmp_path / 'ranges.csv'
+    csv_path.write_text('10.0.0.0,10.0.0.255,US,Washington,Seattle\n')
+    path = str(tmp_path / 'ranges.bin')
+    build_geo_db(str(csv_path), path)
+    return path
+
+
+def test_lookups_are_parsed_and_cached(tmp_path):
+    enrich = compile_enrichment({'userAgent': True, 'geoDbFile': geo_db(tmp_path)})
+
+    record = enrich({'ua': ua, 'ip': '10.0.0.7, 172.16.0.1'})
+
+    assert record['ua_parsed']['browser'] == 'Safari'
+    assert record['ua_parsed']['device'] == 'Mobile'
+    assert record['geo'] == {'country': 'US', 'region': 'Washington', 'city': 'Seattle'}
+    assert enrich({'ip': '192.168.0.1'})['geo'] is None
+
+
+def test_records_do_not_share_the_cached_lookups(tmp_path):
+    enrich = compile_enrichment({'userAgent': True, 'geoDbFile': geo_db(tmp_path)})
+    stage = compile_stage({'drop': ['geo.city', 'ua_parsed.os_version']}, enrich)
+
+    first = stage({'ua': ua, 'ip': '10.0.0.7'})
+    second = enrich({'ua': ua, 'ip': '10.0.0.7'})
+
+    assert 'city' not in first['geo']
+    assert second['geo']['city'] == 'Seattle'
+    assert second['ua_parsed']['os_version'] == '17.1'
+
+
+def test_app_metadata_is_copied_deeply(tmp_path):
+    path = tmp_path / 'app-metadata.json'
+    path.write_text('{"shop": {"owner": {"team": "web"}, "tags": ["a"]}}')
+    enrich = compile_enrichment({'appMetadataFile': str(path)})
+
+    first = enrich({'appId': 'shop'})
+    first['app']['owner']['team'] = 'changed'
+    first['app']['tags'].append('b')
+
+    assert enrich({'appId': 'shop'})['app'] == {'owner': {'team': 'web'}, 'tags': ['a']}
+
+
+def test_unreadable_app_metadata_disables_the_step(tmp_path):
+    (tmp_path / 'list.json').write_text('[1, 2]')
+
+    assert compile_enrichment({'appMetadataFile': str(tmp_path / 'missing.json')}) is None
+    assert compile_enrichment({'appMetadataFile': str(tmp_path / 'list.json')}) is None
+    enrich = compile_enrichment({'userAgent': True, 'appMetadataFile': str(tmp_path / 'missing.json')})
+    assert enrich({'appId': 'shop', 'ua': 'curl/8.0'})['ua_parsed']['device'] == 'Bot'
@@ -0,0 +1,90 @@
+import gzip
+import json
+
+import pytest
+
+from conftest import bucket, list_keys, read_json, make_event
+
+aggregates = {'dimensions': [['appId'], ['data.event_type']], 'userField': 'data.user_id'}
+
+
+def aggregate_events(s3, key):
+    data = json.loads(gzip.decompress(s3.get_object(Bucket=bucket, Key=key)['Body'].read()))
+    return {tuple(group['dimensions'].values()): group['events'] for group in data['sets'][0]['groups']}
+
+
+def test_batch_writes_objects_manifest_and_checkpoint(s3, app):
+    app.handler(make_event(20), None)
+
+    objects = list_keys(s3, 'raw/year=2024/month=01/day=02/hour=03/')
+    assert len(objects) == 1
+    lines = gzip.decompress(s3.get_object(Bucket=bucket, Key=objects[0])['Body'].read()).splitlines()
+    assert len(lines) == 20
+    manifest, = list_keys(s3, 'raw/_manifest/')
+    assert read_json(s3, manifest)['records'] == 20
+    checkpoint = read_json(s3, 'raw/_checkpoint/clicks/shardId-000000000000.json')
+    assert checkpoint['lastSequenceNumber'] == '1019'
+
+
+def test_retried_batch_writes_nothing_new(s3, app):
+    event = make_event(20)
+    app.handler(event, None)
+    before = {key: s3.head_object(Bucket=bucket, Key=key)['ETag'] for key in list_keys(s3)}
+
+    app.handler(event, None)
+
+    after = {key: s3.head_object(Bucket=bucket, Key=key)['ETag'] for key in list_keys(s3)}
+    assert after.keys() == before.keys()
+    assert after == before
+
+
+def test_skipped_retry_rewrites_manifest_and_aggregate(s3, app, monkeypatch):
+    monkeypatch.setattr(app, 'aggregate_config', aggregates)
+    event = make_event(20)
+    app.handler(event, None)
+    manifest, = list_keys(s3, 'raw/_manifest/')
+    aggregate, = [key for key in list_keys(s3) if '/_agg-' in key]
+    s3.delete_object(Bucket=bucket, Key=manifest)
+    s3.delete_object(Bucket=bucket, Key=aggregate)
+
+    # every record is skipped, the checkpoint lists them as written
+    app.handler(event, None)
+
+    assert list_keys(s3, 'raw/_manifest/') == [manifest]
+    assert read_json(s3, manifest)['records'] == 20
+    assert aggregate_events(s3, aggregate) == {('app1',): 20}
+
+
+def test_failure_before_manifest_leaves_checkpoint_untouched(s3, app, monkeypatch):
+    event = make_event(20)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('interrupted')
+
+    monkeypatch.setattr(app, 'write_manifest', fail)
+    with pytest.raises(RuntimeError):
+        app.handler(event, None)
+    assert list_keys(s3, 'raw/_checkpoint/') == []
+
+    monkeypatch.undo()
+    monkeypatch.setattr(app, 'aggregate_config', {})
+    app.handler(event, None)
+    manifest, = list_keys(s3, 'raw/_manifest/')
+    assert read_json(s3, manifest)['records'] == 20
+    assert len(list_keys(s3, 'raw/year=')) == 1
+
+
+def test_partial_retry_keeps_the_batch_manifest(s3, app):
+    first = make_event(10)
+    app.handler(first, None)
+    manifest, = list_keys(s3, 'raw/_manifest/')
+
+    # the retry carries the written records and new ones
+    app.handler(make_event(20), None)
+
+    manifests = [read_json(s3, key) for key in list_keys(s3, 'raw/_manifest/')]
+    latest = [m for m in manifests if m['records'] == 20]
+    assert len(latest) == 1
+    assert len(latest[0]['entries']) == 2
+    data_objects = list_keys(s3, 'raw/year=')
+    assert len(data_objects) == 2
@@ -0,0 +1,80 @@
+import gzip
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from conftest import bucket, list_keys, read_json
+
+aggregates = {'dimensions': [['appId']], 'userField': 'data.user_id'}
+hour_22 = int(datetime(2024, 1, 2, 22, 59, 59, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+@pytest.fixture
+def msk(app, monkeypatch):
+    import msk
+    monkeypatch.setattr(app, 'aggregate_config', aggregates)
+    return msk
+
+
+def two_hour_event(msk):
+    # 6 records per partition in hour 22, then 4 per partition in hour 23
+    event = msk.make_event('clicks', 2, 12, timestamp_ms=hour_22 - 100)
+    later = msk.make_event('clicks', 2, 8, start_offset=6, timestamp_ms=hour_22 + 1000)
+    for name, records in later['records'].items():
+        event['records'][name].extend(records)
+    return event
+
+
+def aggregate_events(s3, key):
+    data = json.loads(gzip.decompress(s3.get_object(Bucket=bucket, Key=key)['Body'].read()))
+    return sum(group['events'] for group in data['sets'][0]['groups'])
+
+
+def test_aggregate_and_manifest_per_topic_hour(s3, msk):
+    result = msk.handler(two_hour_event(msk), None)
+
+    assert result['records'] == 20
+    hour_prefix = 'raw/clicks/year=2024/month=01/day=02/hour='
+    agg_22, = [key for key in list_keys(s3, hour_prefix + '22/') if '/_agg-' in key]
+    agg_23, = [key for key in list_keys(s3, hour_prefix + '23/') if '/_agg-' in key]
+    assert aggregate_events(s3, agg_22) == 12
+    assert aggregate_events(s3, agg_23) == 8
+    manifest_22, = list_keys(s3, 'raw/_manifest/clicks/year=2024/month=01/day=02/hour=22/')
+    manifest_23, = list_keys(s3, 'raw/_manifest/clicks/year=2024/month=01/day=02/hour=23/')
+    assert read_json(s3, manifest_22)['records'] == 12
+    assert read_json(s3, manifest_22)['aggregateKey'] == agg_22
+    assert read_json(s3, manifest_23)['records'] == 8
+    assert hour_prefix + '23/clicks+0+6.json.gz' in list_keys(s3, hour_prefix + '23/')
+
+
+def test_retried_batch_recreates_aggregates_and_manifests(s3, msk):
+    event = two_hour_event(msk)
+    msk.handler(event, None)
+    written = set(list_keys(s3))
+    rewritten = [key for key in written if '/_agg-' in key or key.startswith('raw/_manifest/')]
+    for key in rewritten:
+        s3.delete_object(Bucket=bucket, Key=key)
+
+    msk.handler(event, None)
+
+    assert set(list_keys(s3)) == written
+    aggs = sorted(key for key in rewritten if '/_agg-' in key)
+    assert [aggregate_events(s3, key) for key in aggs] == [12, 8]
+
+
+def test_failure_before_manifest_leaves_checkpoints_untouched(s3, app, msk, monkeypatch):
+    event = two_hour_event(msk)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('interrupted')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(app, 'write_manifest', fail)
+        with pytest.raises(RuntimeError):
+            msk.handler(event, None)
+    assert list_keys(s3, 'raw/_checkpoint/') == []
+
+    msk.handler(event, None)
+    assert len(list_keys(s3, 'raw/_manifest/')) == 2
+    assert len(list_keys(s3, 'raw/_checkpoint/')) == 2
@@ -0,0 +1,44 @@
+import json
+
+from projection import compile_stage
+
+data = '{"event_type": "click",  "user_id": "u1", "properties": {"debug": 1, "x": 2}}'
+
+
+def record():
+    return {'appId': 'shop', 'ua': 'Mozilla/5.0', 'data': data}
+
+
+def test_drop_rules_and_keep_list():
+    stage = compile_stage({
+        'dropRules': [{'field': 'data.event_type', 'equals': '_clickstream_probe'}],
+        'keep': ['appId', 'data.event_type', 'data.properties'],
+        'drop': ['data.properties.debug'],
+    })
+
+    assert stage({'data': '{"event_type": "_clickstream_probe"}'}) is None
+    kept = stage(record())
+    assert kept == {'appId': 'shop', 'data': json.dumps({'event_type': 'click', 'properties': {'x': 2}})}
+
+
+def test_fields_only_read_keep_their_original_text():
+    stage = compile_stage({
+        'dropRules': [{'field': 'data.user_id', 'missing': True}],
+        'sampling': {'keyFields': ['data.user_id'], 'rates': {'heartbeat': 0}},
+        'drop': ['data.not_there', 'ua'],
+    })
+
+    kept = stage(record())
+
+    assert kept == {'appId': 'shop', 'data': data}
+
+
+def test_sampling_keeps_or_drops_a_user_as_a_whole():
+    stage = compile_stage({'sampling': {'keyFields': ['data.user_id'], 'defaultRate': 0.5}})
+    users = [f"u{i}" for i in range(200)]
+
+    first = [stage({'data': json.dumps({'user_id': u, 'n': 1})}) is not None for u in users]
+    second = [stage({'data': json.dumps({'user_id': u, 'n': 2})}) is not None for u in users]
+
+    assert first == second
+    assert 50 < sum(first) < 150
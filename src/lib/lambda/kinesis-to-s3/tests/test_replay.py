@@ -0,0 +1,71 @@
+import gzip
+import json
+from types import SimpleNamespace
+
+import replay
+from lambda_common import s3_transfer
+from conftest import bucket, list_keys
+
+source_key = 'raw/year=2024/month=01/day=02/hour=03/part-0.log.gz'
+
+
+def put_source(s3, key=source_key):
+    lines = [json.dumps({'appId': 'app1', 'n': i}) for i in range(5)]
+    # two gzip members, the way appended objects look
+    body = gzip.compress('\n'.join(lines[:2]).encode() + b'\n') + gzip.compress('\n'.join(lines[2:]).encode())
+    s3.put_object(Bucket=bucket, Key=key, Body=body)
+
+
+def run(app, manifest, flush_every=100):
+    args = SimpleNamespace(source_bucket=bucket, source_prefix='raw/', dest_prefix='replayed',
+                           manifest=manifest, manifest_flush_every=flush_every, concurrency=2, chunk_size=7)
+    return replay.replay(app, args)
+
+
+def test_replay_writes_the_lines_under_the_same_hour(s3, app):
+    put_source(s3)
+
+    result = run(app, f"s3://{bucket}/replay.json")
+
+    assert result == {'replayed': 1, 'records': 5, 'skipped': 0, 'failed': {}}
+    output_keys = list_keys(s3, 'replayed/')
+    assert len(output_keys) == 1
+    assert output_keys[0].startswith('replayed/year=2024/month=01/day=02/hour=03/replay-')
+    body = s3.get_object(Bucket=bucket, Key=output_keys[0])['Body'].read()
+    assert [json.loads(line)['n'] for line in gzip.decompress(body).splitlines()] == [0, 1, 2, 3, 4]
+
+
+def test_replay_resumes_from_the_manifest(s3, app):
+    put_source(s3)
+    run(app, f"s3://{bucket}/replay.json")
+
+    result = run(app, f"s3://{bucket}/replay.json")
+
+    assert result['replayed'] == 0
+    assert result['skipped'] == 1
+
+
+def test_lines_are_streamed_into_the_writer(s3, app, monkeypatch):
+    put_source(s3)
+    write_lines = app.write_lines
+    passed = []
+    monkeypatch.setattr(app, 'write_lines', lambda lines, *args, **kwargs:
+                        passed.append(lines) or write_lines(lines, *args, **kwargs))
+
+    assert run(app, None)['records'] == 5
+    assert not isinstance(passed[0], list)
+
+
+def test_manifest_is_written_in_batches(s3, app, monkeypatch):
+    for i in range(5):
+        put_source(s3, f"raw/year=2024/month=01/day=02/hour=03/part-{i}.log.gz")
+    put_text = s3_transfer.put_text
+    writes = []
+    monkeypatch.setattr(s3_transfer, 'put_text', lambda bucket, key, *args, **kwargs:
+                        writes.append(key) or put_text(bucket, key, *args, **kwargs))
+
+    run(app, f"s3://{bucket}/replay.json", flush_every=2)
+
+    # after 2 and 4 objects, then the last one at the end
+    assert writes == ['replay.json'] * 3
+    assert len(replay.Manifest(f"s3://{bucket}/replay.json").done) == 5
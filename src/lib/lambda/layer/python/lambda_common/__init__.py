@@ -0,0 +1,11 @@
+# Shared runtime for the Python Lambdas, shipped as a Lambda layer.
+# Import it before anything else in app.py, the cold start clock starts here.
+
+from lambda_common.cold_start import track_cold_start, init_timings
+from lambda_common.clients import get_client, lazy_client
+from lambda_common.env import env_str, env_int, env_float, env_bool
+from lambda_common.request import get_req_data, get_query_params, json_response
+from lambda_common.log import get_logger
+from lambda_common import custom_resource
+from lambda_common.profiling import profiled
+from lambda_common import s3_transfer
@@ -0,0 +1,56 @@
+import os
+import time
+import threading
+
+from lambda_common.cold_start import record_init
+
+# boto3 takes ~100ms to import, it is only imported with the first client
+max_pool_connections = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '50'))
+connect_timeout = int(os.environ.get('AWS_CONNECT_TIMEOUT_SEC', '5'))
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(service, region_name=None):
+    '''
+    Cached boto3 client with a larger connection pool, TCP keep-alive and
+    adaptive retries, clients are thread safe and shared across invocations.
+    '''
+    key = (service, region_name)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        if key not in _clients:
+            start = time.perf_counter()
+            import boto3
+            from botocore.config import Config
+            config = Config(
+                max_pool_connections=max_pool_connections,
+                connect_timeout=connect_timeout,
+                tcp_keepalive=True,
+                retries={'max_attempts': 5, 'mode': 'adaptive'},
+            )
+            _clients[key] = boto3.client(
+                service, region_name=region_name, config=config)
+            record_init(f"client:{service}", start)
+        return _clients[key]
+
+
+class LazyClient:
+    '''
+    Module level stand-in for a boto3 client, the client is created on
+    first use.
+    '''
+
+    def __init__(self, service, region_name=None):
+        self._service = service
+        self._region_name = region_name
+
+    def __getattr__(self, name):
+        return getattr(get_client(self._service, self._region_name), name)
+
+
+def lazy_client(service, region_name=None):
+    return LazyClient(service, region_name)
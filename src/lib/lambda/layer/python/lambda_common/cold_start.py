@@ -0,0 +1,34 @@
+import time
+import logging
+import functools
+
+log = logging.getLogger()
+
+# the layer is the first import of app.py
+layer_loaded_at = time.perf_counter()
+
+# name -> milliseconds spent during init, e.g. creating boto3 clients
+init_timings = {}
+
+_cold = True
+
+
+def record_init(name, start):
+    init_timings[name] = round((time.perf_counter() - start) * 1000, 2)
+
+
+def track_cold_start(handler):
+    '''
+    Log how long the init took on the first invocation of the handler.
+    Set PYTHONPROFILEIMPORTTIME=1 on the function for a per module import
+    time breakdown in the logs.
+    '''
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _cold
+        if _cold:
+            _cold = False
+            init_ms = round((time.perf_counter() - layer_loaded_at) * 1000, 2)
+            log.info(f"cold start, init: {init_ms}ms, timings: {init_timings}")
+        return handler(event, context)
+    return wrapper
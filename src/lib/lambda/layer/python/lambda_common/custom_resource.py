@@ -0,0 +1,106 @@
+'''
+onEvent / isComplete handlers for the CDK custom resource Provider.
+
+on_event starts the operation and returns at once, the Provider then calls
+is_complete every queryInterval until it reports IsComplete or the
+totalTimeout is reached. Both are served by one function:
+
+    from lambda_common import custom_resource
+
+    def create(event): ...           # start, return a result()
+    def is_create_complete(event):   # check, return complete() or None
+        ...
+
+    handler = custom_resource.provider_handler(
+        on_event={'Create': create, 'Delete': delete},
+        is_complete={'Create': is_create_complete, 'Delete': is_delete_complete})
+
+The state the checks need is carried in the resource: the PhysicalResourceId
+and the Data returned by on_event, which the Provider passes to every
+is_complete call. Checks derive everything else from the live state of
+the resources, so any of them can be repeated.
+'''
+import time
+from datetime import datetime, timezone
+
+from lambda_common.log import get_logger
+
+log = get_logger()
+
+# Data key of the on_event result, it marks the is_complete calls
+started_at_key = 'CrStartedAt'
+
+
+def result(physical_id=None, data=None):
+    '''
+    on_event result, physical_id None keeps the current one.
+    '''
+    res = {'Data': data or {}}
+    if physical_id is not None:
+        res['PhysicalResourceId'] = physical_id
+    return res
+
+
+def complete(data=None):
+    return {'IsComplete': True, 'Data': data or {}}
+
+
+def get_data(event):
+    return event.get('Data') or {}
+
+
+def elapsed_sec(event):
+    started_at = get_data(event).get(started_at_key)
+    if not started_at:
+        return 0
+    return time.time() - datetime.fromisoformat(started_at).timestamp()
+
+
+def is_check_due(event, query_interval_sec, first_delay_sec=None, max_delay_sec=120):
+    '''
+    Backoff on top of the fixed Provider queryInterval: the delay between
+    checks starts at first_delay_sec and doubles up to max_delay_sec, a
+    poll in between returns without calling any API.
+    '''
+    elapsed = elapsed_sec(event)
+    delay = first_delay_sec or query_interval_sec
+    check_at = 0
+    while check_at + delay <= elapsed:
+        check_at += delay
+        delay = min(delay * 2, max_delay_sec)
+    # the last scheduled check fell since the previous poll
+    return elapsed - check_at < query_interval_sec
+
+
+def provider_handler(on_event, is_complete=None, query_interval_sec=10, max_delay_sec=120):
+    '''
+    Lambda handler dispatching on the RequestType. on_event and is_complete
+    map a RequestType to a function of the event; a missing on_event entry
+    is a no-op and a missing is_complete entry is complete at once.
+    is_complete functions return complete(data) when done and None to be
+    called again.
+    '''
+    is_complete = is_complete or {}
+
+    def handler(event, context):
+        request_type = event['RequestType']
+        if started_at_key in get_data(event):
+            check = is_complete.get(request_type)
+            if check is None:
+                return complete()
+            if not is_check_due(event, query_interval_sec, max_delay_sec=max_delay_sec):
+                log.info(f"{request_type}: next check not due yet")
+                return {'IsComplete': False}
+            res = check(event)
+            log.info(f"{request_type} complete: {res is not None}, after {int(elapsed_sec(event))}s")
+            return res or {'IsComplete': False}
+
+        log.info(f"{request_type}: {event.get('PhysicalResourceId')}")
+        start = on_event.get(request_type)
+        res = start(event) if start is not None else None
+        res = res or result()
+        res['Data'] = {**res.get('Data', {}),
+                       started_at_key: datetime.now(timezone.utc).isoformat()}
+        return res
+
+    return handler
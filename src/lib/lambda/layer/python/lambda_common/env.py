@@ -0,0 +1,25 @@
+import os
+
+
+def env_str(name, default=None):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return value
+
+
+def env_int(name, default=0):
+    value = env_str(name)
+    return default if value is None else int(value)
+
+
+def env_float(name, default=0.0):
+    value = env_str(name)
+    return default if value is None else float(value)
+
+
+def env_bool(name, default=False):
+    value = env_str(name)
+    if value is None:
+        return default
+    return value.lower() in ['1', 'true', 'yes', 'on']
@@ -0,0 +1,7 @@
+import logging
+
+
+def get_logger(level='INFO'):
+    log = logging.getLogger()
+    log.setLevel(level)
+    return log
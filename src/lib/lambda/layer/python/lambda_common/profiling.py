@@ -0,0 +1,244 @@
+'''
+Opt-in profiling of the Lambda handlers, off unless PROFILE_SAMPLE_RATE is
+set on the function:
+
+    PROFILE_SAMPLE_RATE=0.05          share of the invocations profiled, 0 is off
+    PROFILE_MODE=sampling             sampling (all threads) or cprofile (handler thread)
+    PROFILE_SAMPLING_INTERVAL_MS=5    stack sampling interval
+    PROFILE_TRACEMALLOC=true          also trace the allocations
+    PROFILE_TRACEMALLOC_FRAMES=10     frames kept per allocation
+    PROFILE_S3_BUCKET=<bucket>        where the artifacts go, else only logged
+    PROFILE_S3_PREFIX=lambda-profiles
+
+A profiled invocation writes under
+<prefix>/<function>/<yyyy>/<mm>/<dd>/<request id>/:
+
+    summary.json        duration, top functions, top allocations
+    stacks.collapsed    folded stacks for flamegraph.pl, speedscope or inferno
+    profile.pstats      cProfile stats for pstats or snakeviz (cprofile mode)
+
+The other invocations only pay one random() call.
+'''
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import random
+import pstats
+import cProfile
+import threading
+import functools
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timezone
+
+from lambda_common.env import env_str, env_int, env_float, env_bool
+from lambda_common.log import get_logger
+
+log = get_logger()
+
+sample_rate = env_float('PROFILE_SAMPLE_RATE', 0.0)
+profile_mode = env_str('PROFILE_MODE', 'sampling')
+sampling_interval_sec = env_float('PROFILE_SAMPLING_INTERVAL_MS', 5) / 1000
+trace_allocations = env_bool('PROFILE_TRACEMALLOC', True)
+tracemalloc_frames = env_int('PROFILE_TRACEMALLOC_FRAMES', 10)
+s3_bucket = env_str('PROFILE_S3_BUCKET')
+s3_prefix = env_str('PROFILE_S3_PREFIX', 'lambda-profiles')
+
+top_count = 30
+
+
+def profiled(handler):
+    '''
+    Profile a share of the invocations of the handler, see the module doc.
+    Profiling errors are logged and never fail the invocation.
+    '''
+    if sample_rate <= 0:
+        return handler
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if random.random() >= sample_rate:
+            return handler(event, context)
+        profiler = Profiler(profile_mode)
+        profiler.start()
+        start = time.perf_counter()
+        try:
+            return handler(event, context)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            try:
+                profiler.stop()
+                export(profiler, duration_ms, context)
+            except Exception as e:
+                log.warning(f"profiling failed: {repr(e)}")
+    return wrapper
+
+
+class SamplingProfiler:
+    '''
+    Samples the stacks of all the threads but its own every interval, so
+    the work of thread pools shows up too.
+    '''
+
+    def __init__(self, interval_sec):
+        self.interval_sec = interval_sec
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval_sec):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def top_functions(self):
+        # leaf frames, the share of the samples a function was running
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return [{'function': name, 'samples': count} for name, count in leaves.most_common(top_count)]
+
+
+class Profiler:
+    '''
+    cProfile or SamplingProfiler plus tracemalloc.
+    '''
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.cprofile = cProfile.Profile() if mode == 'cprofile' else None
+        self.sampler = None if self.cprofile else SamplingProfiler(sampling_interval_sec)
+        self.allocations = None
+        self.peak_bytes = None
+
+    def start(self):
+        # tracemalloc may already be on, e.g. PYTHONTRACEMALLOC
+        self.owns_tracemalloc = trace_allocations and not tracemalloc.is_tracing()
+        if self.owns_tracemalloc:
+            tracemalloc.start(tracemalloc_frames)
+        if self.cprofile:
+            self.cprofile.enable()
+        else:
+            self.sampler.start()
+
+    def stop(self):
+        if self.cprofile:
+            self.cprofile.disable()
+        else:
+            self.sampler.stop()
+        if self.owns_tracemalloc:
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ])
+            _, self.peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.allocations = [{
+                'traceback': [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+                'bytes': stat.size,
+                'count': stat.count,
+            } for stat in snapshot.statistics('traceback')[:top_count]]
+
+    def collapsed(self):
+        if self.sampler:
+            stacks = self.sampler.stacks
+        else:
+            # cProfile only keeps caller -> callee edges, the stacks are two
+            # frames deep with the own time of the callee per caller in ms
+            stacks = Counter()
+            for func, (_, _, _, _, callers) in self.cprofile_stats().stats.items():
+                for caller, (_, _, own_time, _) in callers.items():
+                    stacks[f"{stats_name(caller)};{stats_name(func)}"] += int(own_time * 1000)
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks.items() if count > 0)
+
+    def cprofile_stats(self):
+        return pstats.Stats(self.cprofile, stream=io.StringIO())
+
+    def top_functions(self):
+        if self.sampler:
+            return self.sampler.top_functions()
+        stats = self.cprofile_stats().sort_stats('tottime')
+        return [{
+            'function': stats_name(func),
+            'calls': calls,
+            'ownMs': round(own_time * 1000, 2),
+            'cumulativeMs': round(cumulative * 1000, 2),
+        } for func, (_, calls, own_time, cumulative, _) in
+            ((func, stats.stats[func]) for func in stats.fcn_list[:top_count])]
+
+
+def frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def stats_name(func):
+    filename, line, name = func
+    if filename == '~':
+        return name  # built-ins
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def export(profiler, duration_ms, context):
+    function_name = getattr(context, 'function_name', None) or os.environ.get(
+        'AWS_LAMBDA_FUNCTION_NAME', 'local')
+    request_id = getattr(context, 'aws_request_id', None) or str(uuid.uuid4())
+    summary = {
+        'function': function_name,
+        'requestId': request_id,
+        'mode': profiler.mode,
+        'durationMs': round(duration_ms, 2),
+        'samples': profiler.sampler.samples if profiler.sampler else None,
+        'samplingIntervalMs': sampling_interval_sec * 1000 if profiler.sampler else None,
+        'peakTracedBytes': profiler.peak_bytes,
+        'topFunctions': profiler.top_functions(),
+        'topAllocations': profiler.allocations,
+    }
+    if not s3_bucket:
+        log.info(f"profile: {json.dumps(summary)}")
+        return
+    from lambda_common import s3_transfer
+    day = datetime.now(timezone.utc).strftime('%Y/%m/%d')
+    key_prefix = f"{s3_prefix}/{function_name}/{day}/{request_id}"
+    artifacts = {
+        'summary.json': json.dumps(summary, indent=2).encode('utf-8'),
+        'stacks.collapsed': profiler.collapsed().encode('utf-8'),
+    }
+    if profiler.cprofile:
+        stats = profiler.cprofile_stats()
+        artifacts['profile.pstats'] = pstats_bytes(stats)
+    for name, body in artifacts.items():
+        s3_transfer.put_bytes(s3_bucket, f"{key_prefix}/{name}", body)
+    log.info(f"profile: s3://{s3_bucket}/{key_prefix}/, {round(duration_ms, 2)}ms")
+
+
+def pstats_bytes(stats):
+    # Stats.dump_stats only writes to a path
+    path = f"/tmp/profile-{uuid.uuid4()}.pstats"
+    try:
+        stats.dump_stats(path)
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
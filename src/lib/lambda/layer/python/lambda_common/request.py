@@ -0,0 +1,38 @@
+import json
+import base64
+
+
+def get_req_data(event):
+    '''
+    Request parameters of an API Gateway / ALB event, the event itself when
+    the Lambda is invoked directly.
+    '''
+    if 'body' in event and event['body']:
+        # from api gateway, POST
+        req_body = event['body']
+        if event.get('isBase64Encoded', False):
+            req_body = base64.b64decode(req_body)
+        return json.loads(req_body)
+    if 'queryStringParameters' in event:
+        # from api gateway, GET
+        return event['queryStringParameters'] or {}
+    # invoke lambda directly
+    return event
+
+
+def get_query_params(event):
+    if 'queryStringParameters' in event:
+        return event['queryStringParameters'] or {}
+    return event
+
+
+def json_response(status_code, body, headers=None):
+    return {
+        "statusCode": status_code,
+        "headers": {
+            "Content-Type": "application/json",
+            "Access-Control-Allow-Origin": "*",
+            **(headers or {}),
+        },
+        "body": json.dumps(body, default=str),
+    }
@@ -0,0 +1,261 @@
+'''
+S3 reads and writes of the Lambdas, on the shared client (connection pool
+of AWS_MAX_POOL_CONNECTIONS, adaptive retries):
+
+    from lambda_common import s3_transfer
+
+    s3_transfer.put_bytes(bucket, key, body, if_absent=True)
+    s3_transfer.upload_stream(response, bucket, key)    # e.g. an urlopen response
+    s3_transfer.read_json(bucket, key)                  # None when missing
+    for chunk in s3_transfer.read_stream(bucket, key): ...   # e.g. a large object
+
+Bodies from S3_MULTIPART_THRESHOLD_MB up are sent as a multipart upload of
+S3_MULTIPART_PART_MB parts, S3_TRANSFER_CONCURRENCY at a time. The multipart
+upload is done here and not by boto3.s3.transfer so that the conditions
+(IfNoneMatch, IfMatch) apply to it as well, on CompleteMultipartUpload.
+
+Every call is counted per operation, take_stats() returns the calls, bytes
+and time since the last call, e.g. to log them once per invocation.
+'''
+import io
+import json
+import time
+import threading
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from lambda_common.clients import lazy_client
+from lambda_common.env import env_float, env_int
+from lambda_common.log import get_logger
+
+log = get_logger()
+s3 = lazy_client('s3')
+
+multipart_threshold_bytes = int(env_float('S3_MULTIPART_THRESHOLD_MB', 16) * 1024 * 1024)
+part_bytes_default = int(env_float('S3_MULTIPART_PART_MB', 8) * 1024 * 1024)
+concurrency_default = env_int('S3_TRANSFER_CONCURRENCY', 8)
+min_part_bytes = 5 * 1024 * 1024
+
+# condition errors of conditional writes
+precondition_errors = ('PreconditionFailed', 'ConditionalRequestConflict')
+missing_errors = ('NoSuchKey', '404', 'NotFound')
+condition_args = ('IfMatch', 'IfNoneMatch')
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+## Instrumentation
+def record(op, nbytes, start):
+    seconds = time.perf_counter() - start
+    with _stats_lock:
+        stats = _stats.setdefault(op, {'calls': 0, 'bytes': 0, 'seconds': 0.0, 'maxMs': 0.0})
+        stats['calls'] += 1
+        stats['bytes'] += nbytes
+        stats['seconds'] += seconds
+        stats['maxMs'] = max(stats['maxMs'], seconds * 1000)
+    return round(seconds * 1000, 2)
+
+
+def take_stats():
+    '''
+    {op: {calls, bytes, ms, maxMs, mbPerSec}} since the last call.
+    '''
+    global _stats
+    with _stats_lock:
+        stats, _stats = _stats, {}
+    return {op: {
+        'calls': s['calls'],
+        'bytes': s['bytes'],
+        'ms': round(s['seconds'] * 1000, 2),
+        'maxMs': round(s['maxMs'], 2),
+        'mbPerSec': round(s['bytes'] / 1024 / 1024 / s['seconds'], 2) if s['seconds'] else None,
+    } for op, s in stats.items()}
+
+
+def error_code(error):
+    return getattr(error, 'response', {}).get('Error', {}).get('Code')
+
+
+## Writes
+def put_bytes(bucket, key, body, content_type=None, metadata=None, if_absent=False,
+              part_bytes=None, concurrency=None, **extra):
+    '''
+    Returns False when if_absent and the key exists, True once written.
+    extra are put_object arguments, e.g. IfMatch or ContentEncoding.
+    '''
+    if if_absent:
+        extra['IfNoneMatch'] = '*'
+    args, conditions = object_args(content_type, metadata, extra)
+    start = time.perf_counter()
+    try:
+        if len(body) >= multipart_threshold_bytes:
+            part_bytes = max(part_bytes or part_bytes_default, min_part_bytes)
+            upload_parts(bucket, key, iter_parts(io.BytesIO(body), part_bytes), args, conditions,
+                         concurrency)
+        else:
+            s3.put_object(Bucket=bucket, Key=key, Body=body, **args, **conditions)
+    except Exception as e:
+        if not if_absent or error_code(e) not in precondition_errors:
+            raise
+        log.info(f"exists already: s3://{bucket}/{key}")
+        return False
+    ms = record('put', len(body), start)
+    log.info(f"put_object: s3://{bucket}/{key}, {len(body)} bytes, {ms}ms")
+    return True
+
+
+def put_text(bucket, key, text, content_type='text/plain', **kwargs):
+    return put_bytes(bucket, key, text.encode('utf-8'), content_type=content_type, **kwargs)
+
+
+def put_json(bucket, key, obj, **kwargs):
+    return put_text(bucket, key, json.dumps(obj), content_type='application/json', **kwargs)
+
+
+def upload_stream(fileobj, bucket, key, content_type=None, metadata=None,
+                  part_bytes=None, concurrency=None, **extra):
+    '''
+    Upload from a file-like object read once, front to back. At most
+    concurrency parts are held in memory, a stream shorter than one part
+    is a single put. Returns the number of bytes uploaded.
+    '''
+    part_bytes = max(part_bytes or part_bytes_default, min_part_bytes)
+    args, conditions = object_args(content_type, metadata, extra)
+    start = time.perf_counter()
+    parts = iter_parts(fileobj, part_bytes)
+    first = next(parts, b'')
+    if len(first) < part_bytes:
+        s3.put_object(Bucket=bucket, Key=key, Body=first, **args, **conditions)
+        size = len(first)
+    else:
+        size = upload_parts(bucket, key, chain([first], parts), args, conditions, concurrency)
+    ms = record('upload', size, start)
+    log.info(f"upload: s3://{bucket}/{key}, {size} bytes, {ms}ms")
+    return size
+
+
+def upload_parts(bucket, key, parts, args, conditions, concurrency=None):
+    '''
+    Multipart upload of the parts, aborted if any of it fails.
+    '''
+    upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key, **args)['UploadId']
+    concurrency = concurrency or concurrency_default
+    size = 0
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = set()
+            done_parts = []
+            for number, body in enumerate(parts, 1):
+                size += len(body)
+                pending.add(executor.submit(upload_part, bucket, key, upload_id, number, body))
+                if len(pending) >= concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    done_parts.extend(future.result() for future in done)
+            done_parts.extend(future.result() for future in pending)
+        s3.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id,
+            MultipartUpload={'Parts': sorted(done_parts, key=lambda part: part['PartNumber'])},
+            **conditions)
+    except BaseException:
+        s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    return size
+
+
+def upload_part(bucket, key, upload_id, number, body):
+    start = time.perf_counter()
+    res = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=body)
+    ms = record('upload_part', len(body), start)
+    log.debug(f"upload_part: s3://{bucket}/{key} #{number}, {len(body)} bytes, {ms}ms")
+    return {'PartNumber': number, 'ETag': res['ETag']}
+
+
+def iter_parts(fileobj, part_bytes):
+    while True:
+        part = read_full(fileobj, part_bytes)
+        if not part:
+            return
+        yield part
+        if len(part) < part_bytes:
+            return
+
+
+def read_full(fileobj, size):
+    # a socket stream may return less than asked for before its end
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = fileobj.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def object_args(content_type, metadata, extra):
+    '''
+    put_object arguments split into the ones of CreateMultipartUpload and
+    the conditions, which go to CompleteMultipartUpload.
+    '''
+    args = {name: value for name, value in extra.items() if name not in condition_args}
+    if content_type:
+        args['ContentType'] = content_type
+    if metadata:
+        args['Metadata'] = metadata
+    return args, {name: value for name, value in extra.items() if name in condition_args}
+
+
+## Reads
+def read_object(bucket, key):
+    '''
+    Returns the body and the ETag, (None, None) when the key does not exist.
+    '''
+    start = time.perf_counter()
+    try:
+        res = s3.get_object(Bucket=bucket, Key=key)
+        body = res['Body'].read()
+    except Exception as e:
+        if error_code(e) not in missing_errors:
+            raise
+        record('get_missing', 0, start)
+        return None, None
+    ms = record('get', len(body), start)
+    log.debug(f"get_object: s3://{bucket}/{key}, {len(body)} bytes, {ms}ms")
+    return body, res['ETag']
+
+
+def read_bytes(bucket, key):
+    return read_object(bucket, key)[0]
+
+
+def read_json(bucket, key):
+    body = read_bytes(bucket, key)
+    return None if body is None else json.loads(body)
+
+
+def read_stream(bucket, key, chunk_bytes=1024 * 1024):
+    '''
+    Yields the object in chunks without holding all of it.
+    '''
+    start = time.perf_counter()
+    size = 0
+    body = s3.get_object(Bucket=bucket, Key=key)['Body']
+    try:
+        for chunk in body.iter_chunks(chunk_bytes):
+            size += len(chunk)
+            yield chunk
+    finally:
+        body.close()
+        record('get_stream', size, start)
+
+
+def exists(bucket, key):
+    try:
+        s3.head_object(Bucket=bucket, Key=key)
+        return True
+    except Exception as e:
+        if error_code(e) in missing_errors:
+            return False
+        raise
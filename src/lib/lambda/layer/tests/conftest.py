@@ -0,0 +1,16 @@
+'''
+The shared layer, tested without a Lambda around it.
+
+    cd src/lib/lambda/layer && python -m pytest tests
+'''
+import os
+import sys
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python')]
+
+os.environ.update({
+    'AWS_REGION': 'us-east-1',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'test',
+    'AWS_SECRET_ACCESS_KEY': 'test',
+})
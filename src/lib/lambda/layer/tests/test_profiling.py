@@ -0,0 +1,93 @@
+import io
+import json
+import time
+import pstats
+from types import SimpleNamespace
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from lambda_common import profiling
+
+context = SimpleNamespace(function_name='cs-metric', aws_request_id='req-1')
+
+
+def busy_handler(event, context):
+    end = time.perf_counter() + 0.1
+    while time.perf_counter() < end:
+        sum(range(1000))
+    return {'statusCode': 200}
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    monkeypatch.setattr(profiling, 'sample_rate', 1.0)
+    monkeypatch.setattr(profiling, 's3_bucket', 'profiles')
+    with mock_aws():
+        s3 = boto3.client('s3')
+        s3.create_bucket(Bucket='profiles')
+
+        def artifacts():
+            listed = s3.list_objects_v2(Bucket='profiles').get('Contents', [])
+            return {obj['Key']: s3.get_object(Bucket='profiles', Key=obj['Key'])['Body'].read()
+                    for obj in listed}
+        yield artifacts
+
+
+def test_off_returns_the_handler(monkeypatch):
+    monkeypatch.setattr(profiling, 'sample_rate', 0.0)
+
+    assert profiling.profiled(busy_handler) is busy_handler
+
+
+def test_unsampled_invocations_are_not_profiled(monkeypatch):
+    exported = []
+    monkeypatch.setattr(profiling, 'sample_rate', 0.1)
+    monkeypatch.setattr(profiling.random, 'random', lambda: 0.1)
+    monkeypatch.setattr(profiling, 'export', lambda *args: exported.append(args))
+
+    assert profiling.profiled(busy_handler)({}, context) == {'statusCode': 200}
+    assert exported == []
+
+    monkeypatch.setattr(profiling.random, 'random', lambda: 0.09)
+    profiling.profiled(busy_handler)({}, context)
+    assert len(exported) == 1
+
+
+def test_sampling_profile_is_exported(bucket, monkeypatch):
+    monkeypatch.setattr(profiling, 'sampling_interval_sec', 0.002)
+
+    assert profiling.profiled(busy_handler)({}, context) == {'statusCode': 200}
+
+    artifacts = bucket()
+    prefix = next(iter(artifacts)).rsplit('/', 1)[0]
+    assert prefix.startswith('lambda-profiles/cs-metric/') and prefix.endswith('/req-1')
+    assert sorted(key.rsplit('/', 1)[1] for key in artifacts) == ['stacks.collapsed', 'summary.json']
+    summary = json.loads(artifacts[f"{prefix}/summary.json"])
+    assert summary['mode'] == 'sampling'
+    assert summary['samples'] > 0
+    assert summary['peakTracedBytes'] is not None
+    assert any('busy_handler' in stack for stack in artifacts[f"{prefix}/stacks.collapsed"].decode().splitlines())
+
+
+def test_cprofile_profile_is_exported(bucket, monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, 'profile_mode', 'cprofile')
+
+    profiling.profiled(busy_handler)({}, context)
+
+    artifacts = {key.rsplit('/', 1)[1]: body for key, body in bucket().items()}
+    assert sorted(artifacts) == ['profile.pstats', 'stacks.collapsed', 'summary.json']
+    summary = json.loads(artifacts['summary.json'])
+    assert summary['mode'] == 'cprofile'
+    assert any(f['function'].startswith('busy_handler') for f in summary['topFunctions'])
+    path = tmp_path / 'profile.pstats'
+    path.write_bytes(artifacts['profile.pstats'])
+    assert pstats.Stats(str(path), stream=io.StringIO()).total_calls > 0
+
+
+def test_export_errors_do_not_fail_the_invocation(bucket, monkeypatch):
+    monkeypatch.setattr(profiling, 's3_bucket', 'missing-bucket')
+
+    assert profiling.profiled(busy_handler)({}, context) == {'statusCode': 200}
+    assert bucket() == {}
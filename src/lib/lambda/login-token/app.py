@@ -1,6 +1,7 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
+from lambda_common import profiled
 import logging
 import os
 import json
@@ -19,6 +20,7 @@ oidc_provider = os.environ.get('OIDC_PROVIDER')
 
 LOGIN_CACHE = {}
 
+@profiled
 def handler(event, context):
     log.info(f"server_url={server_url}")
     log.info(f"oidc_provider={oidc_provider}")
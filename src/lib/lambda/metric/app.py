@@ -1,31 +1,136 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
-import logging
+from lambda_common import lazy_client, get_logger, track_cold_start, profiled, s3_transfer, get_query_params, get_req_data, json_response, env_str, env_float, env_int
 import os
 import json
+import gzip
+import time
+import base64
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from datetime import timedelta
-import boto3
 
-cloudwatch = boto3.client('cloudwatch')
-ecs = boto3.client('ecs')
-elbv2 = boto3.client('elbv2')
+try:
+    # packaged with the Pipfile, gzip only when it is missing
+    import brotli
+except ImportError:
+    brotli = None
 
-log = logging.getLogger()
-log.setLevel('INFO')
+cloudwatch = lazy_client('cloudwatch')
+ecs = lazy_client('ecs')
+elbv2 = lazy_client('elbv2')
+
+log = get_logger()
 aws_region = os.environ['AWS_REGION']
 alb_full_name = os.environ['LOAD_BALANCER_FULL_NAME']
-asg_name = os.environ['AUTO_SCALING_GROUP_NAME']
+asg_name = os.environ.get('AUTO_SCALING_GROUP_NAME', None)
 
 ecs_cluster_name = os.environ.get('ECS_CLUSTER_NAME', None)
 ecs_service_name = os.environ.get('ECS_SERVICE_NAME', None)
 target_group_arn = os.environ.get('TARGET_GROUP_ARN', None)
 
+time_format = '%Y-%m-%dT%H:%M:%S%z'
+
+# responses smaller than this are not compressed
+min_compress_bytes = env_int('METRIC_MIN_COMPRESS_BYTES', 1024)
+brotli_quality = env_int('METRIC_BROTLI_QUALITY', 5)
+# Content-Type of the compressed responses, the binaryMediaTypes of the API:
+# API Gateway only decodes the base64 body of these
+compressed_media_types = {'br': 'application/x-brotli', 'gzip': 'application/gzip'}
+# max-age of windows ending before the current period, their data is final
+max_cache_age_sec = env_int('METRIC_MAX_CACHE_AGE_SEC', 3600)
+
+# precomputed windows written by the schedule, see write_snapshots
+snapshot_bucket = env_str('METRIC_SNAPSHOT_BUCKET')
+snapshot_prefix = env_str('METRIC_SNAPSHOT_PREFIX', 'metric-snapshot')
+snapshot_period = env_int('METRIC_SNAPSHOT_PERIOD_SEC', 300)
+# a missed schedule or two is still served from the snapshot
+snapshot_max_age_sec = env_int('METRIC_SNAPSHOT_MAX_AGE_SEC', 900)
+snapshot_windows = {'1h': 60, '24h': 24 * 60, '7d': 7 * 24 * 60}
+# fields of a response that are not part of its metric window, the server
+# and consumer states as of the request or the snapshot
+live_state_fields = ('consumerLag', 'loadBalancerTargetState', 'ecsServiceState', 'state')
+
+# API limits of get_metric_data and describe_services
+max_metric_queries = 500
+max_ecs_services = 10
+# concurrent describe_target_health calls of the fleet endpoint
+max_concurrency = env_int('FLEET_MAX_CONCURRENCY', 16)
+
+# consumer lag of the S3 sink on MSK_TOPIC, kafka is only imported when set
+msk_brokers = env_str('MSK_BROKERS')
+msk_topic = env_str('MSK_TOPIC')
+# MSK Connect names the group connect-<connector name>, it is looked up
+# when not set
+msk_consumer_group = env_str('MSK_CONSUMER_GROUP')
+msk_cluster_name = env_str('MSK_CLUSTER_NAME', '')
+lag_cache_ttl_sec = env_float('MSK_LAG_CACHE_TTL_SEC', 15)
+# window of the lag growth rate
+lag_history_sec = 600
+
+# kept between invocations of a warm container
+kafka_admin = None
+kafka_consumer = None
+lag_cache = {'at': 0, 'value': None}
+lag_history = deque()
+
+@track_cold_start
+@profiled
 def handler(event, context):
-    req_json = get_req_data(event)
+    if is_fleet_request(event):
+        return fleet_handler(event)
+
+    if event.get('snapshot'):
+        # from the schedule rule
+        return write_snapshots()
+
+    req_json = get_query_params(event)
     log.info(req_json)
-    time_format = '%Y-%m-%dT%H:%M:%S%z'
+    startTime, endTime, period = get_query_window(req_json)
+    deployment = [alb_full_name, asg_name, ecs_cluster_name, ecs_service_name, target_group_arn, msk_topic]
+    window = get_snapshot_window(req_json)
+
+    def get_body(status):
+        if window:
+            body = read_snapshot(window)
+            if body is not None:
+                # the live status, the ETag is computed from it
+                return {**body, **status}
+        return get_server_body(startTime, endTime, period, status)
+
+    return cacheable_response(event, deployment, startTime, endTime, period,
+                              get_server_status, get_body, "GET, OPTIONS")
+
+
+def get_server_body(startTime, endTime, period, status):
+    return {
+        "serverMetric": get_server_metric(startTime, endTime, period),
+        **status,
+    }
+
+
+def get_server_status():
+    ecs_service_state = get_ecs_service_state() if ecs_cluster_name and ecs_service_name else None
+    target_state = get_healthy_state() if target_group_arn else None
+
+    body = {}
+
+    if msk_brokers and msk_topic:
+        body['consumerLag'] = get_consumer_lag()
+
+    if target_state:
+        body['loadBalancerTargetState'] = target_state 
+    if ecs_service_state:
+        body['ecsServiceState'] = ecs_service_state
+
+    body['state'] = get_server_state(target_state, ecs_service_state)
+    return body
+
+
+def get_query_window(req_json):
     now_str_time = datetime.now().astimezone(timezone.utc).strftime(time_format)
     endTime = req_json.get('endTime', now_str_time)
     fromMinutesAgo = int(req_json.get('fromMinutesAgo', 24 * 60))
@@ -38,20 +143,10 @@ def handler(event, context):
     log.info(f"startTime={startTime}")
     log.info(f"endTime={endTime}")
     log.info(f"period={period}")
+    return startTime, endTime, period
 
-    metric_value = get_server_metric(startTime, endTime, period)
-    ecs_service_state = get_ecs_service_state() if ecs_cluster_name and ecs_service_name else None
-    target_state = get_healthy_state() if target_group_arn else None
- 
-    body = {
-        "serverMetric": metric_value
-    }
 
-    if target_state:
-        body['loadBalancerTargetState'] = target_state 
-    if ecs_service_state:
-        body['ecsServiceState'] = ecs_service_state
-    
+def get_server_state(target_state, ecs_service_state):
     server_state = 'GREEN'
     if target_state and ecs_service_state:
         if target_state['state'] == 'RED' or ecs_service_state['state'] == 'RED':
@@ -62,205 +157,423 @@ def handler(event, context):
         server_state = target_state['state']
     elif ecs_service_state:
         server_state = ecs_service_state['state']
+    return server_state
 
-    body['state'] = server_state
 
-    return {
-        "statusCode": 200,
-        "headers": {
-           "Content-Type": "application/json",
-           "Access-Control-Allow-Origin": "*",
-           "Access-Control-Allow-Methods": "GET, OPTIONS"
-        },
-        "body": json.dumps(body),
+## Fleet
+def is_fleet_request(event):
+    return (event.get('resource') or event.get('path') or '').rstrip('/').endswith('/fleet') \
+        or 'deployments' in event
+
+
+def fleet_handler(event):
+    '''
+    Metrics of many deployments in one call, POST /v1/metric/fleet with
+
+        {
+            "deployments": [{
+                "name": "cs-server-a",
+                "albFullName": "app/...", "asgName": "...",
+                "ecsClusterName": "...", "ecsServiceName": "...",
+                "targetGroupArn": "arn:..."
+            }],
+            "fromMinutesAgo": 60, "period": 300
+        }
+
+    The metric queries of all deployments are packed in get_metric_data calls
+    of up to 500 queries, the ECS services described 10 per call and the
+    target groups fetched concurrently. The response is keyed by deployment
+    name, each value has the shape of the single deployment response.
+    '''
+    try:
+        req_json = get_req_data(event)
+        deployments = req_json['deployments']
+        if isinstance(deployments, str):
+            # GET, ?deployments=<json list>
+            deployments = json.loads(deployments)
+        names = [d.get('name') or d['albFullName'] for d in deployments]
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        log.error(repr(e))
+        return json_response(400, {'message': 'deployments must be a list of {name, albFullName, ...}'})
+    if len(set(names)) != len(names):
+        return json_response(400, {'message': 'deployment names must be unique'})
+    log.info(f"fleet of {len(deployments)} deployments")
+    startTime, endTime, period = get_query_window(req_json)
+    return cacheable_response(event, deployments, startTime, endTime, period,
+                              lambda: get_fleet_status(deployments, names),
+                              lambda status: get_fleet_body(deployments, names, status,
+                                                            startTime, endTime, period),
+                              "GET, POST, OPTIONS")
+
+
+def get_fleet_status(deployments, names):
+    '''
+    The ECS and target group states of every deployment and of the fleet.
+    '''
+    ecs_services = describe_ecs_services(
+        [(d['ecsClusterName'], d['ecsServiceName']) for d in deployments
+         if d.get('ecsClusterName') and d.get('ecsServiceName')])
+    target_arns = sorted({d['targetGroupArn'] for d in deployments if d.get('targetGroupArn')})
+    target_states = dict(zip(target_arns, run_concurrently(get_target_group_state, target_arns)))
+
+    status = {'deployments': {}}
+    for name, d in zip(names, deployments):
+        value = {}
+        target_state = target_states.get(d.get('targetGroupArn'))
+        ecs_service_state = None
+        if d.get('ecsClusterName') and d.get('ecsServiceName'):
+            ecs_service_state = ecs_state(d['ecsClusterName'],
+                                          ecs_services.get((d['ecsClusterName'], d['ecsServiceName'])))
+        if target_state:
+            value['loadBalancerTargetState'] = target_state
+        if ecs_service_state:
+            value['ecsServiceState'] = ecs_service_state
+        value['state'] = get_server_state(target_state, ecs_service_state)
+        status['deployments'][name] = value
+
+    states = [value['state'] for value in status['deployments'].values()]
+    status['state'] = 'RED' if 'RED' in states else 'YELLOW' if 'YELLOW' in states else 'GREEN'
+    return status
+
+
+def get_fleet_body(deployments, names, status, startTime, endTime, period):
+    queries = []
+    for i, d in enumerate(deployments):
+        # ids are unique across the deployments, d<index>_<metric id>
+        queries.extend({**query, 'Id': f"d{i}_{query['Id']}"}
+                       for query in server_metric_queries(d['albFullName'], d.get('asgName'), period))
+    metric_results = get_metric_data(queries, startTime, endTime)
+
+    body = {'deployments': {}}
+    for i, name in enumerate(names):
+        prefix = f"d{i}_"
+        body['deployments'][name] = {
+            'serverMetric': [{**result, 'Id': result['Id'][len(prefix):]}
+                             for result in metric_results if result['Id'].startswith(prefix)],
+            **status['deployments'][name],
+        }
+    body['state'] = status['state']
+    return body
+
+
+def run_concurrently(fn, items):
+    items = list(items)
+    if len(items) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(items), max_concurrency)) as executor:
+        return list(executor.map(fn, items))
+
+
+## Snapshots
+def get_snapshot_window(req_json):
+    '''
+    Name of the snapshot answering the request, None for custom ranges.
+    '''
+    if not snapshot_bucket or 'startTime' in req_json or 'endTime' in req_json:
+        return None
+    if int(req_json.get('period', 300)) != snapshot_period:
+        return None
+    minutes = int(req_json.get('fromMinutesAgo', 24 * 60))
+    for window, window_minutes in snapshot_windows.items():
+        if window_minutes == minutes:
+            return window
+    return None
+
+
+def get_snapshot_key(window):
+    return f"{snapshot_prefix}/{window}.json.gz"
+
+
+def read_snapshot(window):
+    '''
+    Body of the latest snapshot of the window, None when it is missing or
+    older than snapshot_max_age_sec.
+    '''
+    content = s3_transfer.read_bytes(snapshot_bucket, get_snapshot_key(window))
+    if content is None:
+        log.info(f"no snapshot of {window}")
+        return None
+    body = json.loads(gzip.decompress(content))
+    age = time.time() - to_epoch(body['snapshotTime'])
+    if age > snapshot_max_age_sec:
+        log.info(f"snapshot of {window} is {int(age)}s old, query live")
+        return None
+    return body
+
+
+def write_snapshots():
+    '''
+    Precompute the snapshot windows, the states are fetched once and shared.
+    '''
+    now = datetime.now().astimezone(timezone.utc)
+    endTime = now.strftime(time_format)
+    status = get_server_status()
+
+    def write_snapshot(item):
+        window, minutes = item
+        startTime = (now - timedelta(minutes=minutes)).strftime(time_format)
+        body = {
+            "serverMetric": get_server_metric(startTime, endTime, snapshot_period),
+            **status,
+            "snapshotTime": endTime,
+        }
+        content = gzip.compress(json.dumps(body, separators=(',', ':'), default=str).encode('utf-8'))
+        s3_transfer.put_bytes(snapshot_bucket, get_snapshot_key(window), content,
+                              content_type='application/json', ContentEncoding='gzip')
+        return {'window': window, 'bytes': len(content)}
+
+    written = run_concurrently(write_snapshot, snapshot_windows.items())
+    log.info(f"snapshots: {written}")
+    return {'snapshotTime': endTime, 'snapshots': written}
+
+
+## Caching and compression
+def cacheable_response(event, deployment, startTime, endTime, period, get_status, get_body, methods):
+    '''
+    JSON response of get_body(status) with an ETag and a Cache-Control
+    max-age derived from the query window aligned to the period and the
+    live status: the same window in the same state gives the same ETag
+    until the next period starts. Only the status is fetched before
+    If-None-Match is compared, a 304 queries no metrics. The body is
+    compressed when the client accepts br or gzip.
+    '''
+    headers = {
+        "Access-Control-Allow-Methods": methods,
+        "Access-Control-Expose-Headers": "ETag",
+        "Vary": "Accept-Encoding",
     }
+    status = get_status()
+    etag, max_age = get_cache_validators(deployment, startTime, endTime, period, get_live_state(status))
+    if etag is None:
+        headers['Cache-Control'] = 'no-cache'
+    else:
+        headers['ETag'] = etag
+        headers['Cache-Control'] = f"max-age={max_age}"
+        if etag_matches(get_header(event, 'if-none-match'), etag):
+            log.info(f"not modified: {etag}")
+            return {
+                "statusCode": 304,
+                "headers": {"Access-Control-Allow-Origin": "*", **headers},
+                "body": "",
+            }
+    return compress_response(event, json_response(200, get_body(status), headers=headers))
+
+
+def get_header(event, name):
+    # API Gateway keeps the case the client sent
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def to_epoch(value):
+    try:
+        return datetime.strptime(value, time_format).timestamp()
+    except ValueError:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def get_live_state(body):
+    '''
+    The live state fields of a single deployment or fleet status, without
+    the ones that change on every sample.
+    '''
+    state = {name: body[name] for name in live_state_fields if name in body}
+    if isinstance(state.get('consumerLag'), dict):
+        state['consumerLag'] = {name: value for name, value in state['consumerLag'].items()
+                                if name not in ('cached', 'sampledAt')}
+    if 'deployments' in body:
+        state['deployments'] = {name: get_live_state(value) for name, value in body['deployments'].items()}
+    return state
+
+
+def get_cache_validators(deployment, startTime, endTime, period, live_state=None):
+    '''
+    (ETag, max-age) of the window and live state, (None, 0) when the times
+    can not be parsed. With a live state the max-age is at most the
+    snapshot period, a final window does not make the state final.
+    '''
+    try:
+        start = int(to_epoch(startTime)) // period * period
+        end = int(to_epoch(endTime)) // period * period
+    except (ValueError, TypeError, ZeroDivisionError):
+        return None, 0
+    now = int(time.time())
+    current = now // period * period
+    max_age = current + period - now if end >= current else max_cache_age_sec
+    if live_state:
+        max_age = min(max_age, snapshot_period)
+    digest = hashlib.sha256(json.dumps([deployment, start, end, period, live_state], sort_keys=True,
+                                       default=str).encode('utf-8')).hexdigest()[:32]
+    return f'W/"{digest}"', max_age
 
-def get_req_data(event):
-    if 'queryStringParameters' in event:
-        # from api gateway
-        req_json = event['queryStringParameters'] or {}
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    # weak comparison, W/"x" matches "x"
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag.removeprefix('W/') in [tag.removeprefix('W/') for tag in tags]
+
+
+def accepted_encodings(accept_encoding):
+    encodings = set()
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+def compress_response(event, response):
+    body = response['body'].encode('utf-8')
+    if len(body) < min_compress_bytes:
+        return response
+    accepted = accepted_encodings(get_header(event, 'accept-encoding'))
+    if brotli is not None and 'br' in accepted:
+        body, encoding = brotli.compress(body, quality=brotli_quality), 'br'
+    elif 'gzip' in accepted or '*' in accepted:
+        body, encoding = gzip.compress(body, compresslevel=6), 'gzip'
     else:
-        # invoke lambda directly
-        req_json = event
-    return req_json
+        return response
+    response['headers']['Content-Encoding'] = encoding
+    response['headers']['Content-Type'] = compressed_media_types[encoding]
+    response['body'] = base64.b64encode(body).decode('ascii')
+    response['isBase64Encoded'] = True
+    return response
 
 
 ## Server metrics
-def get_server_metric(startTime, endTime, period):
-    # https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/Statistics-definitions.html
-    serverRequestCount = {
-            'Id': 'serverRequestCount',
-            'Label': 'Request Count',
-            'MetricStat': {
-                'Metric': {
-                    'Namespace': 'AWS/ApplicationELB',
-                    'MetricName': 'RequestCount',
-                    'Dimensions': [
-                        {
-                            'Name': 'LoadBalancer',
-                            'Value': alb_full_name
-                        },
-                    ]
-                },
-                'Period': period,
-                'Stat': 'Sum',
-                'Unit': 'Count'
-            }
-    }
-
-    serverRequest4XXCount = {
-            'Id': 'serverRequest4XXCount',
-            'Label': 'Error Request Count(4XX)',
-            'MetricStat': {
-                'Metric': {
-                    'Namespace': 'AWS/ApplicationELB',
-                    'MetricName': 'HTTPCode_ELB_4XX_Count',
-                    'Dimensions': [
-                        {
-                            'Name': 'LoadBalancer',
-                            'Value': alb_full_name
-                        },
-                    ]
-                },
-                'Period': period,
-                'Stat': 'Sum',
-                'Unit': 'Count'
+def metric_query(id, label, namespace, metric_name, dimension_name, dimension_value, period, stat, unit):
+    return {
+        'Id': id,
+        'Label': label,
+        'MetricStat': {
+            'Metric': {
+                'Namespace': namespace,
+                'MetricName': metric_name,
+                'Dimensions': [
+                    {
+                        'Name': dimension_name,
+                        'Value': dimension_value
+                    },
+                ]
             },
+            'Period': period,
+            'Stat': stat,
+            'Unit': unit
+        },
     }
 
-    serverRequest5XXCount = {
-            'Id': 'serverRequest5XXCount',
-            'Label': 'Error Request Count(5XX)',
-            'MetricStat': {
-                'Metric': {
-                    'Namespace': 'AWS/ApplicationELB',
-                    'MetricName': 'HTTPCode_ELB_5XX_Count',
-                    'Dimensions': [
-                        {
-                            'Name': 'LoadBalancer',
-                            'Value': alb_full_name
-                        },
-                    ]
-                },
-                'Period': period,
-                'Stat': 'Sum',
-                'Unit': 'Count'
-            },
-    }
 
-    serverCPUUtilizationAverage = {
-            'Id': 'serverCPUUtilizationAverage',
-            'Label': 'Server CPU Utilization Average',
-            'MetricStat': {
-                'Metric': {
-                    'Namespace': 'AWS/EC2',
-                    'MetricName': 'CPUUtilization',
-                    'Dimensions': [
-                        {
-                            'Name': 'AutoScalingGroupName',
-                            'Value': asg_name
-                        },
-                    ]
-                },
-                'Period': period,
-                'Stat': 'Average',
-                'Unit': 'Percent'
-            },
-    }
+def server_metric_queries(alb_full_name, asg_name, period):
+    # https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/Statistics-definitions.html
+    queries = [
+        metric_query('serverRequestCount', 'Request Count', 'AWS/ApplicationELB', 'RequestCount',
+                     'LoadBalancer', alb_full_name, period, 'Sum', 'Count'),
+        metric_query('serverRequest4XXCount', 'Error Request Count(4XX)', 'AWS/ApplicationELB',
+                     'HTTPCode_ELB_4XX_Count', 'LoadBalancer', alb_full_name, period, 'Sum', 'Count'),
+        metric_query('serverRequest5XXCount', 'Error Request Count(5XX)', 'AWS/ApplicationELB',
+                     'HTTPCode_ELB_5XX_Count', 'LoadBalancer', alb_full_name, period, 'Sum', 'Count'),
+    ]
+    if asg_name:
+        queries.extend([
+            metric_query('serverCPUUtilizationAverage', 'Server CPU Utilization Average', 'AWS/EC2',
+                         'CPUUtilization', 'AutoScalingGroupName', asg_name, period, 'Average', 'Percent'),
+            metric_query('serverCPUUtilizationMax', 'Server CPU Utilization Max', 'AWS/EC2',
+                         'CPUUtilization', 'AutoScalingGroupName', asg_name, period, 'Maximum', 'Percent'),
+        ])
+    return queries
+
 
-    serverCPUUtilizationMax = {
-            'Id': 'serverCPUUtilizationMax',
-            'Label': 'Server CPU Utilization Max',
-            'MetricStat': {
-                'Metric': {
-                    'Namespace': 'AWS/EC2',
-                    'MetricName': 'CPUUtilization',
-                    'Dimensions': [
-                        {
-                            'Name': 'AutoScalingGroupName',
-                            'Value': asg_name
-                        },
-                    ]
+def get_metric_data(queries, startTime, endTime):
+    '''
+    Results of the queries in their order, max_metric_queries per call, the
+    pages of a call are merged.
+    '''
+    results = {}
+    for i in range(0, len(queries), max_metric_queries):
+        kwargs = {}
+        while True:
+            response = cloudwatch.get_metric_data(
+                MetricDataQueries=queries[i:i + max_metric_queries],
+                StartTime=startTime,
+                EndTime=endTime,
+                ScanBy='TimestampAscending',
+                MaxDatapoints=100800,
+                LabelOptions={
+                    'Timezone': '+0000'
                 },
-                'Period': period,
-                'Stat': 'Maximum',
-                'Unit': 'Percent'
-            },
-    }
+                **kwargs)
+            for metric_result in response['MetricDataResults']:
+                result = results.setdefault(metric_result['Id'], {
+                    'Id': metric_result['Id'],
+                    'Label': metric_result['Label'],
+                    'Timestamps': [],
+                    'Values': [],
+                })
+                result['Timestamps'].extend(metric_result['Timestamps'])
+                result['Values'].extend(metric_result['Values'])
+            if not response.get('NextToken'):
+                break
+            kwargs = {'NextToken': response['NextToken']}
+    return json.loads(json.dumps([results[query['Id']] for query in queries if query['Id'] in results],
+                                 default=str))
 
-    metric_alb_response = cloudwatch.get_metric_data(
-        MetricDataQueries=[
-            serverRequestCount, 
-            serverRequest4XXCount, 
-            serverRequest5XXCount
-            ],
-        StartTime=startTime,
-        EndTime=endTime,
-        ScanBy='TimestampAscending',
-        MaxDatapoints=100800,
-        LabelOptions={
-            'Timezone': '+0000'
-        })
 
-    metric_asg_response = cloudwatch.get_metric_data(
-        MetricDataQueries=[
-            serverCPUUtilizationAverage,
-            serverCPUUtilizationMax
-            ],
-        StartTime=startTime,
-        EndTime=endTime,
-        ScanBy='TimestampAscending',
-        MaxDatapoints=100800,
-        LabelOptions={
-            'Timezone': '+0000'
-        })
+def get_server_metric(startTime, endTime, period):
+    return get_metric_data(server_metric_queries(alb_full_name, asg_name, period), startTime, endTime)
 
-    metric_alb_value = [{
-        'Id': metric_result['Id'], 
-        'Label': metric_result['Label'], 
-        'Timestamps': metric_result['Timestamps'],
-        'Values': metric_result['Values'] 
-       } for metric_result in metric_alb_response['MetricDataResults']]
-    
-    metric_asg_value = [{
-        'Id': metric_result['Id'], 
-        'Label': metric_result['Label'], 
-        'Timestamps': metric_result['Timestamps'],
-        'Values': metric_result['Values'] 
-       } for metric_result in metric_asg_response['MetricDataResults']]
 
-    metric_value = []
-    metric_value.extend(metric_alb_value)
-    metric_value.extend(metric_asg_value)
+## ECS Service State
+def describe_ecs_services(services):
+    '''
+    {(cluster, service): service description} of the (cluster, service)
+    pairs, max_ecs_services per describe_services call.
+    '''
+    by_cluster = {}
+    for cluster, service in services:
+        by_cluster.setdefault(cluster, set()).add(service)
+    described = {}
+    for cluster, names in by_cluster.items():
+        names = sorted(names)
+        for i in range(0, len(names), max_ecs_services):
+            ecs_service_response = ecs.describe_services(
+                cluster=cluster,
+                services=names[i:i + max_ecs_services],
+            )
+            for ecs_service in ecs_service_response['services']:
+                described[(cluster, ecs_service['serviceName'])] = ecs_service
+    return described
 
-    return json.loads(json.dumps(metric_value, default=str))
 
-## ECS Service State
 def get_ecs_service_state():
-    ecs_service_response = ecs.describe_services(
-        cluster=ecs_cluster_name,
-        services=[
-           ecs_service_name,
-        ],
-    )
+    ecs_services = describe_ecs_services([(ecs_cluster_name, ecs_service_name)])
+    return ecs_state(ecs_cluster_name, ecs_services.get((ecs_cluster_name, ecs_service_name)))
+
 
-    if len(ecs_service_response['services']) == 0:
+def ecs_state(cluster_name, ecs_service):
+    if ecs_service is None:
         ecsState = 'RED'
         detail = json.dumps({
-            'ecsCluster': ecs_cluster_name,
+            'ecsCluster': cluster_name,
             'message': 'services count is 0'
         })
     else:
-        ecs_service = ecs_service_response['services'][0]
         if ecs_service['pendingCount'] > 0 and ecs_service['runningCount'] > 0:
             ecsState = 'YELLOW'
         elif ecs_service['desiredCount'] == ecs_service['runningCount']:
             ecsState = 'GREEN'
         elif ecs_service['runningCount'] == 0 and ecs_service['desiredCount'] > 0:
             ecsState = 'RED'
+        else:
+            # some of the desired tasks are not running
+            ecsState = 'YELLOW'
         detail = json.dumps(
             {
-                'ecsCluster': ecs_cluster_name,
+                'ecsCluster': cluster_name,
                 'desiredTaskCount': ecs_service['desiredCount'],
                 'runningTaskCount': ecs_service['runningCount'],
                 'pendingTaskCount': ecs_service['pendingCount'],
@@ -275,6 +588,10 @@ def get_ecs_service_state():
 
 ## ALB target group State
 def get_healthy_state():
+    return get_target_group_state(target_group_arn)
+
+
+def get_target_group_state(target_group_arn):
     target_health_response = elbv2.describe_target_health(
          TargetGroupArn=target_group_arn,
     )
@@ -298,4 +615,118 @@ def get_healthy_state():
             }),
         'state': state,
     }
-    return target_healthy_state
\ No newline at end of file
+    return target_healthy_state
+
+
+## Kafka consumer lag
+def get_kafka_admin():
+    global kafka_admin
+    if kafka_admin is None:
+        from kafka import KafkaAdminClient
+        kafka_admin = KafkaAdminClient(bootstrap_servers=msk_brokers,
+                                       client_id='clickstream-metric',
+                                       request_timeout_ms=10000)
+    return kafka_admin
+
+
+def get_kafka_consumer():
+    # no group_id, it only reads the end offsets
+    global kafka_consumer
+    if kafka_consumer is None:
+        from kafka import KafkaConsumer
+        kafka_consumer = KafkaConsumer(bootstrap_servers=msk_brokers,
+                                       client_id='clickstream-metric',
+                                       enable_auto_commit=False,
+                                       request_timeout_ms=11000)
+    return kafka_consumer
+
+
+def close_kafka_clients():
+    global kafka_admin, kafka_consumer
+    for client in (kafka_admin, kafka_consumer):
+        if client is not None:
+            client.close()
+    kafka_admin = None
+    kafka_consumer = None
+
+
+def get_consumer_lag():
+    now = time.time()
+    if lag_cache['value'] is not None and now - lag_cache['at'] < lag_cache_ttl_sec:
+        return {**lag_cache['value'], 'cached': True}
+
+    try:
+        lag = fetch_consumer_lag(get_kafka_admin(), get_kafka_consumer())
+    except Exception as e:
+        log.error(repr(e))
+        close_kafka_clients()
+        return {'topic': msk_topic, 'error': repr(e)}
+
+    lag['lagGrowthPerSec'] = get_lag_growth(now, lag['totalLag']) if lag['totalLag'] is not None else None
+    lag['sampledAt'] = datetime.fromtimestamp(now, timezone.utc).isoformat()
+    lag_cache['at'] = now
+    lag_cache['value'] = lag
+    return {**lag, 'cached': False}
+
+
+def find_consumer_group(admin):
+    global msk_consumer_group
+    if not msk_consumer_group:
+        groups = sorted(group for group, _ in admin.list_consumer_groups()
+                        if group.startswith(f"connect-{msk_cluster_name}")
+                        and group.endswith('-s3-sink-connector'))
+        log.info(f"sink connector consumer groups: {groups}")
+        # remembered for the life of the container
+        msk_consumer_group = groups[0] if groups else None
+    return msk_consumer_group
+
+
+def fetch_consumer_lag(admin, consumer):
+    '''
+    Per partition and total lag of the sink consumer group on msk_topic,
+    from the end offsets of the partitions and the committed offsets of the
+    group. Without a group, e.g. with the Lambda sink, whose event source
+    mapping commits under its own group, the status is NO_GROUP and the
+    lags are null, not 0.
+    '''
+    from kafka import TopicPartition
+
+    group = find_consumer_group(admin)
+    partition_ids = consumer.partitions_for_topic(msk_topic)
+    if not partition_ids:
+        raise Exception(f"no partitions of topic {msk_topic}")
+    topic_partitions = [TopicPartition(msk_topic, p) for p in sorted(partition_ids)]
+    end_offsets = {tp.partition: offset for tp, offset in consumer.end_offsets(topic_partitions).items()}
+
+    committed = {}
+    if group:
+        offsets = admin.list_consumer_group_offsets(group, partitions=topic_partitions)
+        committed = {tp.partition: meta.offset for tp, meta in offsets.items() if meta.offset >= 0}
+
+    partitions = [{
+        'partition': p,
+        'endOffset': end_offsets[p],
+        'committedOffset': committed.get(p),
+        'lag': end_offsets[p] - committed[p] if p in committed else None,
+    } for p in sorted(end_offsets)]
+    return {
+        'topic': msk_topic,
+        'consumerGroup': group,
+        'status': 'OK' if group else 'NO_GROUP',
+        'totalLag': sum(p['lag'] for p in partitions if p['lag'] is not None) if group else None,
+        'partitions': partitions,
+    }
+
+
+def get_lag_growth(now, total_lag):
+    '''
+    Messages per second the lag grew (negative: shrank) over the samples of
+    the last lag_history_sec seen by this container.
+    '''
+    while lag_history and now - lag_history[0][0] > lag_history_sec:
+        lag_history.popleft()
+    growth = None
+    if lag_history and now - lag_history[0][0] >= 1:
+        growth = round((total_lag - lag_history[0][1]) / (now - lag_history[0][0]), 3)
+    lag_history.append((now, total_lag))
+    return growth
@@ -0,0 +1,17 @@
+'''
+app reads its configuration at import, the environment is set first.
+
+    cd src/lib/lambda/metric && python -m pytest tests
+'''
+import os
+import sys
+
+lambda_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [lambda_dir, os.path.join(lambda_dir, '..', 'layer', 'python')]
+
+os.environ.update({
+    'AWS_REGION': 'us-east-1',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'LOAD_BALANCER_FULL_NAME': 'app/test/0123456789',
+    'AUTO_SCALING_GROUP_NAME': 'test-asg',
+})
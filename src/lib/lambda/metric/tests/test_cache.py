@@ -0,0 +1,74 @@
+import json
+import base64
+import gzip
+
+import app
+
+window = ('2024-01-02T00:00:00+0000', '2024-01-02T01:00:00+0000', 300)
+deployment = ['app/test/0123456789']
+
+
+def body(state='GREEN', lag=5):
+    return {
+        'serverMetric': [{'Id': 'requests', 'Values': [1.0] * 12}],
+        'consumerLag': {'topic': 't', 'totalLag': lag, 'cached': False, 'sampledAt': 'x'},
+        'state': state,
+    }
+
+
+def respond(current_body, if_none_match=None, accept_encoding=None):
+    event = {'headers': {'If-None-Match': if_none_match, 'Accept-Encoding': accept_encoding}}
+    return app.cacheable_response(event, deployment, *window, lambda: current_body,
+                                  lambda status: current_body, 'GET, OPTIONS')
+
+
+def test_not_modified_queries_no_metrics(monkeypatch):
+    metric_calls = []
+    monkeypatch.setattr(app, 'get_server_status', lambda: {'state': 'GREEN'})
+    monkeypatch.setattr(app, 'get_metric_data',
+                        lambda queries, *args: metric_calls.append(queries) or [])
+    event = {'queryStringParameters': {'startTime': window[0], 'endTime': window[1]}, 'headers': {}}
+
+    first = app.handler(event, None)
+    assert first['statusCode'] == 200
+    assert len(metric_calls) == 1
+
+    event['headers'] = {'If-None-Match': first['headers']['ETag']}
+    assert app.handler(event, None)['statusCode'] == 304
+    assert len(metric_calls) == 1
+
+
+def test_etag_follows_the_live_state():
+    first = respond(body())
+    etag = first['headers']['ETag']
+
+    assert respond(body(), if_none_match=etag)['statusCode'] == 304
+    assert respond({**body(), 'consumerLag': {**body()['consumerLag'], 'cached': True}},
+                   if_none_match=etag)['statusCode'] == 304
+    changed = respond(body(state='RED'), if_none_match=etag)
+    assert changed['statusCode'] == 200
+    assert changed['headers']['ETag'] != etag
+    assert respond(body(lag=6), if_none_match=etag)['statusCode'] == 200
+
+
+def test_live_state_caps_the_max_age_of_a_final_window():
+    with_state = respond(body())['headers']['Cache-Control']
+    without_state = respond({'serverMetric': []})['headers']['Cache-Control']
+
+    assert with_state == f"max-age={app.snapshot_period}"
+    assert without_state == f"max-age={app.max_cache_age_sec}"
+
+
+def test_fleet_deployment_states_are_part_of_the_etag():
+    fleet = {'deployments': {'a': body(), 'b': body()}, 'state': 'GREEN'}
+    degraded = {'deployments': {'a': body(), 'b': body(state='YELLOW')}, 'state': 'GREEN'}
+
+    assert app.get_live_state(fleet) != app.get_live_state(degraded)
+
+
+def test_compressed_response_has_a_binary_media_type():
+    large = {**body(), 'serverMetric': [{'Id': str(i), 'Values': [1.0] * 100} for i in range(20)]}
+    response = respond(large, accept_encoding='gzip')
+
+    assert response['headers']['Content-Type'] == 'application/gzip'
+    assert json.loads(gzip.decompress(base64.b64decode(response['body']))) == large
@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+
+class FakeAdmin:
+
+    def __init__(self, groups, committed):
+        self.groups = groups
+        self.committed = committed
+
+    def list_consumer_groups(self):
+        return [(group, 'consumer') for group in self.groups]
+
+    def list_consumer_group_offsets(self, group, partitions):
+        return {tp: SimpleNamespace(offset=self.committed.get(tp.partition, -1)) for tp in partitions}
+
+
+class FakeConsumer:
+
+    def __init__(self, end_offsets):
+        self.offsets = end_offsets
+
+    def partitions_for_topic(self, topic):
+        return set(self.offsets)
+
+    def end_offsets(self, partitions):
+        return {tp: self.offsets[tp.partition] for tp in partitions}
+
+
+@pytest.fixture
+def kafka(monkeypatch):
+    monkeypatch.setattr(app, 'msk_topic', 'clicks')
+    monkeypatch.setattr(app, 'msk_cluster_name', 'cs-msk')
+    monkeypatch.setattr(app, 'msk_consumer_group', None)
+    monkeypatch.setattr(app, 'lag_cache', {'at': 0, 'value': None})
+
+    def use(groups, committed, end_offsets):
+        monkeypatch.setattr(app, 'get_kafka_admin', lambda: FakeAdmin(groups, committed))
+        monkeypatch.setattr(app, 'get_kafka_consumer', lambda: FakeConsumer(end_offsets))
+    return use
+
+
+def test_lag_of_the_connector_group(kafka):
+    kafka(['connect-cs-msk-s3-sink-connector'], {0: 90, 1: 200}, {0: 100, 1: 200, 2: 5})
+
+    lag = app.get_consumer_lag()
+
+    assert lag['status'] == 'OK'
+    assert lag['totalLag'] == 10
+    assert [p['lag'] for p in lag['partitions']] == [10, 0, None]
+
+
+def test_no_group_is_not_a_zero_lag(kafka):
+    kafka([], {}, {0: 100, 1: 200})
+
+    lag = app.get_consumer_lag()
+
+    assert lag['status'] == 'NO_GROUP'
+    assert lag['totalLag'] is None
+    assert lag['lagGrowthPerSec'] is None
+    assert [p['endOffset'] for p in lag['partitions']] == [100, 200]
@@ -0,0 +1,63 @@
+import json
+
+import app
+
+
+class FakeCloudWatch:
+    '''
+    get_metric_data returning one point per query, the first call in two
+    pages.
+    '''
+
+    def __init__(self):
+        self.calls = []
+
+    def get_metric_data(self, MetricDataQueries, NextToken=None, **kwargs):
+        self.calls.append(len(MetricDataQueries))
+        first_page = len(self.calls) == 1
+        return {
+            'MetricDataResults': [{'Id': query['Id'], 'Label': query['Label'],
+                                   'Timestamps': [len(self.calls)], 'Values': [1.0]}
+                                  for query in MetricDataQueries],
+            **({'NextToken': 'page-2'} if first_page else {}),
+        }
+
+
+class FakeECS:
+
+    def __init__(self):
+        self.calls = []
+
+    def describe_services(self, cluster, services):
+        self.calls.append((cluster, len(services)))
+        return {'services': [{'serviceName': name, 'desiredCount': 1, 'runningCount': 1, 'pendingCount': 0}
+                             for name in services]}
+
+
+def test_fleet_queries_are_packed_in_pages(monkeypatch):
+    cloudwatch, ecs = FakeCloudWatch(), FakeECS()
+    monkeypatch.setattr(app, 'cloudwatch', cloudwatch)
+    monkeypatch.setattr(app, 'ecs', ecs)
+    # 5 queries each, 600 in all
+    deployments = [{'name': f"d{i}", 'albFullName': f"app/d{i}/0", 'asgName': f"asg-{i}",
+                    'ecsClusterName': f"cluster-{i % 2}", 'ecsServiceName': f"service-{i}"}
+                   for i in range(120)]
+    event = {'path': '/v1/metric/fleet', 'body': json.dumps({
+        'deployments': deployments, 'startTime': '2024-01-02T00:00:00+0000',
+        'endTime': '2024-01-02T01:00:00+0000', 'period': 300}), 'headers': {}}
+
+    response = app.handler(event, None)
+
+    assert response['statusCode'] == 200
+    # the first call of 500 queries has a second page
+    assert cloudwatch.calls == [500, 500, 100]
+    assert sorted(ecs.calls) == [(f"cluster-{c}", 10) for c in (0, 1) for _ in range(6)]
+    body = json.loads(response['body'])
+    assert body['state'] == 'GREEN'
+    assert len(body['deployments']) == 120
+    d0 = body['deployments']['d0']['serverMetric']
+    assert [result['Id'] for result in d0] == [
+        'serverRequestCount', 'serverRequest4XXCount', 'serverRequest5XXCount',
+        'serverCPUUtilizationAverage', 'serverCPUUtilizationMax']
+    assert d0[0]['Timestamps'] == [1, 2]
+    assert body['deployments']['d119']['serverMetric'][0]['Timestamps'] == [3]
@@ -0,0 +1,62 @@
+import json
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import app
+
+hour_request = {'queryStringParameters': {'fromMinutesAgo': '60', 'period': '300'}, 'headers': {}}
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    '''
+    (startTime, endTime) of every live metric query.
+    '''
+    queried = []
+    monkeypatch.setattr(app, 'snapshot_bucket', 'metric-snapshots')
+    monkeypatch.setattr(app, 'get_server_status', lambda: {'state': 'GREEN'})
+    monkeypatch.setattr(app, 'get_server_metric', lambda startTime, endTime, period: queried.append(
+        (startTime, endTime)) or [{'Id': 'serverRequestCount', 'Values': [len(queried)]}])
+    with mock_aws():
+        boto3.client('s3').create_bucket(Bucket='metric-snapshots')
+        yield queried
+
+
+def test_snapshots_answer_their_windows(metrics):
+    written = app.handler({'snapshot': True}, None)
+
+    assert sorted(s['window'] for s in written['snapshots']) == ['1h', '24h', '7d']
+    assert len(metrics) == 3
+    snapshot = app.read_snapshot('1h')
+    assert snapshot['snapshotTime'] == written['snapshotTime']
+    assert snapshot['state'] == 'GREEN'
+
+    response = app.handler(hour_request, None)
+
+    assert response['statusCode'] == 200
+    assert len(metrics) == 3
+    assert json.loads(response['body'])['serverMetric'] == snapshot['serverMetric']
+
+
+def test_stale_or_missing_snapshots_are_queried_live(metrics, monkeypatch):
+    assert app.read_snapshot('1h') is None
+    app.handler(hour_request, None)
+    assert len(metrics) == 1
+
+    app.write_snapshots()
+    monkeypatch.setattr(app, 'snapshot_max_age_sec', -1)
+
+    assert app.read_snapshot('1h') is None
+    response = app.handler(hour_request, None)
+    assert len(metrics) == 5
+    assert json.loads(response['body'])['serverMetric'] == [{'Id': 'serverRequestCount', 'Values': [5]}]
+
+
+def test_custom_windows_skip_the_snapshots(metrics):
+    app.write_snapshots()
+
+    app.handler({'queryStringParameters': {'fromMinutesAgo': '60', 'period': '60'}, 'headers': {}}, None)
+
+    assert len(metrics) == 4
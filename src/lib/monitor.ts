@@ -1,5 +1,6 @@
 import { Construct } from "constructs";
 import { createServerMonitorEvent } from "./events";
+import { S3SinkConfig } from "./stack-main";
 import {
   createEmailSubscriptionToSnsTopic,
   importSnsTopicFromArn,
@@ -9,11 +10,12 @@ export function createServerMonitor(
   scope: Construct,
   snsTopicArn: string,
   serverUrl: string,
-  email?: string
+  email?: string,
+  probeSink?: S3SinkConfig
 ) {
   const snsTopic = importSnsTopicFromArn(scope, "sns-topic", snsTopicArn);
   if (email) {
     createEmailSubscriptionToSnsTopic(scope, snsTopic, email);
   }
-  createServerMonitorEvent(scope, serverUrl, snsTopic);
+  createServerMonitorEvent(scope, serverUrl, snsTopic, probeSink);
 }
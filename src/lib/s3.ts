@@ -62,3 +62,13 @@ export function createMSKPluginResourceBucket(scope: Construct) {
   });
   return s3bucket;
 }
+
+export function createMetricSnapshotBucket(scope: Construct) {
+  const s3bucket = new s3.Bucket(scope, "metric-snapshot", {
+    removalPolicy: cdk.RemovalPolicy.DESTROY,
+    autoDeleteObjects: true,
+    enforceSSL: true,
+    encryption: s3.BucketEncryption.S3_MANAGED,
+  });
+  return s3bucket;
+}
@@ -64,6 +64,22 @@ export function createMskCustomResourceLambdaSecurityGroup(
   return lambdaSg;
 }
 
+export function createMetricLambdaSecurityGroup(
+  scope: Construct,
+  vpc: ec2.IVpc,
+  mskSg?: ec2.ISecurityGroup
+): ec2.SecurityGroup {
+  const sg = new ec2.SecurityGroup(scope, "lambda-metric-sg", {
+    description: "Metric lambda security group",
+    vpc,
+    allowAllOutbound: true,
+  });
+  if (mskSg) {
+    mskSg.addIngressRule(sg, ec2.Port.tcpRange(9092, 9098));
+  }
+  return sg;
+}
+
 export function createLambdaServerSecurityGroup(
   scope: Construct,
   vpc: ec2.IVpc,
@@ -20,6 +20,7 @@ import { createTagsParameters } from "./parameter";
 import { addTags } from "./tags";
 import { IngestLambdaServerConstruct } from "./consturct-ingest-lambda-server";
 import { getHostedZone } from "./route53";
+import { addLambdaProfiling } from "./lambda";
 
 export enum TierType {
   XSMALL = "XSMALL",
@@ -223,6 +224,7 @@ export class ServerIngestionStack extends cdk.Stack {
     }
 
     addTags(ingestServer, tagParameters);
+    addLambdaProfiling(this);
 
     if (taskRole) {
       s3Bucket?.grantReadWrite(taskRole);
@@ -5,7 +5,7 @@ import {
   TierType,
 } from "./stack-main";
 import { AppConfig } from "./config";
-import { getExistingBucketName, getExistingMskConfig } from "./util";
+import { getExistingBucketName, getExistingMskConfig, getParamValue } from "./util";
 import { MSKS3SinkConnectorConstruct } from "./construct-msk-s3-connector";
 import { setUpVpc } from "./vpc";
 import { SOLUTION } from "./constant";
@@ -27,6 +27,12 @@ export interface Props extends cdk.StackProps {
     mskSecurityGroupIdParameterName?: string;
     mskClusterName?: string;
     mskClusterNameParameterName?: string;
+    // planned partition count of the topic, caps tasks.max
+    mskTopicPartitions?: string;
+    mskTopicPartitionsParameterName?: string;
+    // only for the lambda sink, see AppConfig.mskSinkType
+    mskClusterArn?: string;
+    mskClusterArnParameterName?: string;
   };
   s3Config: {
     bucketName?: string;
@@ -66,7 +72,16 @@ export class MskS3ConnectorStack extends cdk.Stack {
       clusterName: mskConfig.mskClusterName,
       mskBrokers: mskConfig.mskBrokers,
       mskSecurityGroup: mskConfig.mskSecurityGroup,
+      mskTopicPartitions: getParamValue(this, {
+        value: props.mskConfig.mskTopicPartitions,
+        valuePath: props.mskConfig.mskTopicPartitionsParameterName,
+      }),
       s3SinkConnectorSetting,
+      mskSetting: config.getMskSetting(),
+      mskClusterArn: getParamValue(this, {
+        value: props.mskConfig.mskClusterArn,
+        valuePath: props.mskConfig.mskClusterArnParameterName,
+      }),
     });
 
     addTags(mskS3SinkConnectorConstruct, tagParameters);
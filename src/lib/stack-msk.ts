@@ -58,6 +58,16 @@ export class MSKStack extends cdk.Stack {
       stringValue: mskTopic,
     });
 
+    const mskTopicPartitionsParam = new ssm.StringParameter(
+      this,
+      "mskTopicPartitionsParam",
+      {
+        description: "MSK topic partition count",
+        parameterName: `/${cdk.Stack.of(this).stackName}/mskTopicPartitions`,
+        stringValue: mskConstruct.topicPartitions,
+      }
+    );
+
     const mskSecurityGroupIdParam = new ssm.StringParameter(
       this,
       "mskSecurityGroupIdParam",
@@ -78,6 +88,16 @@ export class MSKStack extends cdk.Stack {
       }
     );
 
+    const mskClusterArnParam = new ssm.StringParameter(
+      this,
+      "mskClusterArnParam",
+      {
+        description: "Msk cluster arn",
+        parameterName: `/${cdk.Stack.of(this).stackName}/mskClusterArn`,
+        stringValue: mskConstruct.mskCluster.clusterArn,
+      }
+    );
+
     new cdk.CfnOutput(this, "MskBrokersParameter", {
       value: mskBrokersParam.parameterName,
     });
@@ -86,6 +106,10 @@ export class MSKStack extends cdk.Stack {
       value: mskTopicParam.parameterName,
     });
 
+    new cdk.CfnOutput(this, "MskTopicPartitionsParameter", {
+      value: mskTopicPartitionsParam.parameterName,
+    });
+
     new cdk.CfnOutput(this, "MskSecurityGroupIdParameter", {
       value: mskSecurityGroupIdParam.parameterName,
     });
@@ -94,6 +118,10 @@ export class MSKStack extends cdk.Stack {
       value: mskClusterNameParam.parameterName,
     });
 
+    new cdk.CfnOutput(this, "MskClusterArnParameter", {
+      value: mskClusterArnParam.parameterName,
+    });
+
     new cdk.CfnOutput(this, "MskBootstrapBrokers", {
       value: mskConstruct.bootstrapBrokers,
     });
@@ -0,0 +1,63 @@
+import * as cdk from "aws-cdk-lib";
+import { Template } from "aws-cdk-lib/assertions";
+import { TierType } from "../lib/stack-main";
+import { MskS3ConnectorStack } from "../lib/stack-msk-s3-connector";
+
+const clusterArn =
+  "arn:aws:kafka:us-east-1:123456789012:cluster/cs-msk-small-msk-cluster/abc-1";
+
+test("MskSinkType=lambda replaces the S3 sink connector with a Lambda", () => {
+  const app = new cdk.App({ context: { MskSinkType: "lambda" } });
+
+  const stack = new MskS3ConnectorStack(app, "cs-msk-s3-sink-test", {
+    profile: {
+      tier: TierType.SMALL,
+    },
+    mskConfig: {
+      mskBrokers: "b-1:9092,b-2:9092",
+      mskTopic: "cs-msk-small-topic",
+      mskSecurityGroupId: "sg-12345678",
+      mskClusterName: "cs-msk-small-msk-cluster",
+      mskTopicPartitions: "12",
+      mskClusterArn: clusterArn,
+    },
+    s3Config: {
+      bucketName: "sink-bucket",
+    },
+  });
+  const template = Template.fromStack(stack);
+
+  template.hasResourceProperties("AWS::Lambda::EventSourceMapping", {
+    EventSourceArn: clusterArn,
+    Topics: ["cs-msk-small-topic"],
+    StartingPosition: "TRIM_HORIZON",
+  });
+  template.hasResourceProperties("AWS::Lambda::Function", {
+    Handler: "msk.handler",
+  });
+  // no MSK Connect connector, nor its plugin bucket
+  template.resourceCountIs("AWS::CloudFormation::CustomResource", 0);
+  template.resourceCountIs("AWS::S3::Bucket", 0);
+});
+
+test("the lambda sink needs the cluster arn", () => {
+  const app = new cdk.App({ context: { MskSinkType: "lambda" } });
+
+  expect(
+    () =>
+      new MskS3ConnectorStack(app, "cs-msk-s3-sink-test", {
+        profile: {
+          tier: TierType.SMALL,
+        },
+        mskConfig: {
+          mskBrokers: "b-1:9092",
+          mskTopic: "cs-msk-small-topic",
+          mskSecurityGroupId: "sg-12345678",
+          mskClusterName: "cs-msk-small-msk-cluster",
+        },
+        s3Config: {
+          bucketName: "sink-bucket",
+        },
+      })
+  ).toThrow(/mskClusterArn/);
+});